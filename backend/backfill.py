@@ -0,0 +1,495 @@
+"""
+過去分の要約・ダイジェストの再処理 (バックフィル)
+
+プロンプトやモデルを変更した後の過去の要約の作り直しや、停止していた期間の未要約の記事の穴埋めを、
+日付の範囲 (記事・動画の公開日) または記事・動画のIDを指定してコマンドラインから実行する:
+    python backfill.py --from 2026-09-01 --to 2026-09-30                # 期間内の記事を全て要約し直す
+    python backfill.py --from 2026-09-01 --to 2026-09-30 --missing-only # 未要約の記事だけ要約する
+    python backfill.py --videos --from 2026-09-01 --to 2026-09-30       # 字幕のある動画も要約し直す
+    python backfill.py --article-id <id> --video-id <id>                # IDを指定する
+
+- 要約はプロセスプールで並行に行い、Gemini APIの呼び出しは全プロセスで合わせて毎分 BACKFILL_RPM 回までにする。
+- 要約の結果は親プロセスでまとめて (BACKFILL_FLUSH_SIZE 件ごとに1トランザクションで) 保存し、
+  記事の見出しを含む日のダイジェストを作り直す。見出しがない記事は公開日のダイジェストに追加する。
+- 保存が終わった記事・動画はチェックポイントファイルに記録する。同じ引数で実行し直すと、記録済みのものを飛ばして再開する。
+- --max-minutes を過ぎたら新しい要約を始めず、処理中の要約を保存して終了する (続きは同じ引数で再開する)。
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session, undefer
+
+from database import Article, DigestHeadline, KeyPoint, Video, VideoTranscript
+from deadline import Deadline
+from digests import headline_to_dict, merge_headlines
+from ingest import upsert_articles
+from records import ArticleRecord
+
+KIND_ARTICLE = "article"
+KIND_VIDEO = "video"
+
+# 全プロセス合計のGemini APIの呼び出し回数の上限 (毎分)
+BACKFILL_RPM = float(os.getenv("BACKFILL_RPM", "10"))
+# 要約するプロセス数
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+# 1回のAPI呼び出しでまとめて要約する記事数
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "10"))
+# まとめて保存する件数
+BACKFILL_FLUSH_SIZE = int(os.getenv("BACKFILL_FLUSH_SIZE", "100"))
+BACKFILL_CHECKPOINT = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+
+
+class RateLimiter:
+    """
+    プロセス間で共有する呼び出し間隔の制限。次に呼び出してよい時刻を共有メモリに持ち、
+    呼び出すたびに 60 / rpm 秒ずつ進める (プロセスプールの initializer に渡して共有する)。
+    """
+
+    def __init__(self, rpm: float, context=None):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = (context or multiprocessing).Value("d", 0.0)
+
+    def wait(self) -> None:
+        if self.interval <= 0:
+            return
+        with self._next.get_lock():
+            now = time.time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# =====================================================
+# 要約するプロセス
+# =====================================================
+
+_summarizer = None
+_limiter: Optional[RateLimiter] = None
+
+
+def _init_worker(limiter: RateLimiter, summarizer=None) -> None:
+    global _summarizer, _limiter
+    if summarizer is None:
+        from summarizer import Summarizer
+
+        summarizer = Summarizer(os.getenv("GEMINI_API_KEY"))
+    _summarizer = summarizer
+    _limiter = limiter
+
+
+def _usage_delta(before: Dict) -> Dict:
+    return {key: value - before.get(key, 0) for key, value in _summarizer.usage.items()}
+
+
+def _target_id(target) -> str:
+    return target.article_id if isinstance(target, ArticleRecord) else target["id"]
+
+
+def _summarize_job(kind: str, payload: List, seconds: Optional[float]) -> Dict:
+    """
+    記事 (ArticleRecord) のまとまり、または動画1件 ({"id", "transcript"}) を要約する。
+
+    Returns:
+        {"kind", "results": [{"id", "summary", "key_points"} または {"id", "error"}], "usage"}
+    """
+    _limiter.wait()
+    deadline = Deadline(seconds) if seconds else None
+    before = dict(_summarizer.usage)
+    results = []
+    try:
+        if kind == KIND_VIDEO:
+            [video] = payload
+            summaries = [_summarizer.summarize(video["transcript"], deadline=deadline)]
+        else:
+            summaries = _summarizer.summarize_batch(payload, deadline=deadline)
+        for i, target in enumerate(payload):
+            item = summaries[i] if i < len(summaries) else None
+            if not isinstance(item, dict) or item.get("error") or not item.get("summary"):
+                error = item.get("summary") if isinstance(item, dict) else "missing summary in batch response"
+                results.append({"id": _target_id(target), "error": error or "empty summary"})
+            else:
+                results.append({"id": _target_id(target), "summary": item["summary"], "key_points": item.get("key_points") or []})
+    except Exception as e:
+        results = [{"id": _target_id(target), "error": str(e)} for target in payload]
+    return {"kind": kind, "results": results, "usage": _usage_delta(before)}
+
+
+# =====================================================
+# 対象の選択と保存
+# =====================================================
+
+
+def _day_bounds(start: date, end: date):
+    """公開日時で絞り込む範囲 (サーバーのローカル日付の start 0時から end の翌日0時まで)"""
+    since = datetime.combine(start, dtime.min).astimezone(timezone.utc)
+    until = datetime.combine(end + timedelta(days=1), dtime.min).astimezone(timezone.utc)
+    return since, until
+
+
+def select_targets(
+    db: Session,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    article_ids: Optional[List[str]] = None,
+    video_ids: Optional[List[str]] = None,
+    include_articles: bool = True,
+    include_videos: bool = False,
+    missing_only: bool = False,
+) -> Dict[str, List[str]]:
+    """再処理する記事・動画のID (公開日時の順)"""
+    targets = {KIND_ARTICLE: list(article_ids or []), KIND_VIDEO: list(video_ids or [])}
+    if start is None:
+        return targets
+
+    since, until = _day_bounds(start, end or start)
+    if include_articles:
+        query = db.query(Article.article_id).filter(Article.published_at >= since, Article.published_at < until)
+        if missing_only:
+            query = query.filter(Article.status != "processed")
+        targets[KIND_ARTICLE] += [row.article_id for row in query.order_by(Article.published_at, Article.article_id)]
+    if include_videos:
+        query = (
+            db.query(Video.youtube_id)
+            .join(VideoTranscript, VideoTranscript.youtube_id == Video.youtube_id)
+            .filter(Video.published_at >= since, Video.published_at < until)
+        )
+        if missing_only:
+            query = query.filter(Video.status != "processed")
+        targets[KIND_VIDEO] += [row.youtube_id for row in query.order_by(Video.published_at, Video.youtube_id)]
+    return {kind: list(dict.fromkeys(ids)) for kind, ids in targets.items()}
+
+
+def load_articles(db: Session, ids: List[str]) -> List[ArticleRecord]:
+    """要約の入力にする記事"""
+    rows = db.query(Article).options(undefer(Article.content)).filter(Article.article_id.in_(ids)).all()
+    articles = [
+        ArticleRecord(
+            article_id=a.article_id,
+            title=a.title,
+            description=a.description or "",
+            content=a.content,
+        )
+        for a in rows
+    ]
+    db.rollback()
+    return articles
+
+
+def load_video(db: Session, youtube_id: str) -> Optional[Dict]:
+    """要約の入力にする動画の字幕 (字幕がない場合は None)"""
+    record = db.get(VideoTranscript, youtube_id)
+    transcript = record.text if record is not None else None
+    db.rollback()
+    if not transcript:
+        return None
+    return {"id": youtube_id, "transcript": transcript}
+
+
+def _local_date(value: datetime) -> date:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone().date()
+
+
+def save_article_summaries(db: Session, results: List[Dict], add_missing_headlines: bool = True) -> int:
+    """
+    記事の要約と重要ポイントをまとめて保存し、見出しのある日のダイジェストを作り直す。
+    add_missing_headlines の場合は、見出しのない記事を公開日のダイジェストに追加する。commitは呼び出し元で行う。
+    """
+    if not results:
+        return 0
+    by_id = {r["id"]: r for r in results}
+    articles = db.query(Article).filter(Article.article_id.in_(list(by_id))).all()
+    upsert_articles(db, [
+        ArticleRecord(
+            article_id=a.article_id,
+            title=a.title,
+            link=a.link,
+            description=a.description or "",
+            topic=a.category,
+            source=a.source,
+            published_at=a.published_at,
+            # 本文は書き換えない (None の場合は保存済みの本文を残す)
+            content=None,
+            summary=by_id[a.article_id]["summary"],
+            key_points=by_id[a.article_id]["key_points"],
+        )
+        for a in articles
+    ])
+
+    headlines = defaultdict(list)
+    has_headline = set()
+    for row in db.query(DigestHeadline).filter(DigestHeadline.article_id.in_(list(by_id))):
+        has_headline.add(row.article_id)
+        headlines[row.date].append(dict(headline_to_dict(row), summary=by_id[row.article_id]["summary"]))
+    if add_missing_headlines:
+        for a in articles:
+            if a.article_id in has_headline or a.published_at is None:
+                continue
+            headlines[_local_date(a.published_at)].append({
+                "article_id": a.article_id,
+                "title": a.title,
+                "summary": by_id[a.article_id]["summary"],
+                "link": a.link,
+                "source": a.source,
+                "topic": a.category,
+                "published_at": a.published_at,
+            })
+    # 日ごとに1回だけダイジェストを作り直す
+    for day in sorted(headlines):
+        merge_headlines(db, day, headlines[day])
+    return len(articles)
+
+
+def save_video_summaries(db: Session, results: List[Dict]) -> int:
+    """動画の要約と重要ポイントをまとめて保存する。commitは呼び出し元で行う"""
+    ids = {row.youtube_id for row in db.query(Video.youtube_id).filter(Video.youtube_id.in_([r["id"] for r in results]))}
+    results = [r for r in results if r["id"] in ids]
+    if not results:
+        return 0
+    db.execute(update(Video), [{"youtube_id": r["id"], "summary": r["summary"], "status": "processed"} for r in results])
+    db.execute(delete(KeyPoint).where(KeyPoint.youtube_id.in_(list(ids))))
+    points = [{"youtube_id": r["id"], "point": p} for r in results for p in r["key_points"] if p]
+    if points:
+        db.execute(insert(KeyPoint), points)
+    return len(results)
+
+
+# =====================================================
+# チェックポイント
+# =====================================================
+
+
+class Checkpoint:
+    """保存が終わった記事・動画のIDを記録するファイル (引数が同じ実行の間で共有する)"""
+
+    def __init__(self, path: Optional[str], key: str):
+        self.path = path
+        self.key = key
+        self.done = {KIND_ARTICLE: set(), KIND_VIDEO: set()}
+        self.failed: Dict[str, Dict[str, str]] = {KIND_ARTICLE: {}, KIND_VIDEO: {}}
+
+    @staticmethod
+    def key_for(targets: Dict[str, List[str]]) -> str:
+        body = json.dumps({kind: sorted(ids) for kind, ids in targets.items()}, sort_keys=True)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]
+
+    def load(self) -> bool:
+        """同じ対象の記録があれば読み込む (対象が違う記録は使わない)"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("key") != self.key:
+            print(f"Checkpoint {self.path} is for another target set; starting over")
+            return False
+        for kind in self.done:
+            self.done[kind] = set(data.get("done", {}).get(kind, []))
+        return True
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        data = {
+            "key": self.key,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "done": {kind: sorted(ids) for kind, ids in self.done.items()},
+            "failed": self.failed,
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".backfill-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+# =====================================================
+# 実行
+# =====================================================
+
+
+def _jobs(db: Session, targets: Dict[str, List[str]], checkpoint: Checkpoint, batch_size: int):
+    """要約するまとまりを順に作る (記事の本文は、まとまりごとに読み込む)"""
+    articles = [i for i in targets[KIND_ARTICLE] if i not in checkpoint.done[KIND_ARTICLE]]
+    for i in range(0, len(articles), batch_size):
+        payload = load_articles(db, articles[i:i + batch_size])
+        if payload:
+            yield KIND_ARTICLE, payload
+    for youtube_id in targets[KIND_VIDEO]:
+        if youtube_id in checkpoint.done[KIND_VIDEO]:
+            continue
+        video = load_video(db, youtube_id)
+        if video is None:
+            checkpoint.failed[KIND_VIDEO][youtube_id] = "transcript not found"
+            continue
+        yield KIND_VIDEO, [video]
+
+
+def run_backfill(
+    session_factory,
+    targets: Dict[str, List[str]],
+    workers: int = BACKFILL_WORKERS,
+    rpm: float = BACKFILL_RPM,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    flush_size: int = BACKFILL_FLUSH_SIZE,
+    checkpoint_path: Optional[str] = BACKFILL_CHECKPOINT,
+    max_seconds: Optional[float] = None,
+    add_missing_headlines: bool = True,
+    summarizer=None,
+) -> Dict:
+    """
+    対象を要約して保存する。workers が0の場合はこのプロセスのスレッド1つで要約する (summarizer を渡せる)。
+
+    Returns:
+        {"articles", "videos", "failed", "skipped", "calls", "input_tokens", "output_tokens", "completed"}
+    """
+    checkpoint = Checkpoint(checkpoint_path, Checkpoint.key_for(targets))
+    checkpoint.load()
+    stats = {
+        "articles": 0,
+        "videos": 0,
+        "failed": 0,
+        "skipped": sum(len(checkpoint.done[kind] & set(ids)) for kind, ids in targets.items()),
+        "calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "completed": False,
+    }
+    deadline = Deadline(max_seconds) if max_seconds else None
+    if workers > 0:
+        context = multiprocessing.get_context("spawn")
+        limiter = RateLimiter(rpm, context)
+        executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(limiter,))
+    else:
+        limiter = RateLimiter(rpm)
+        executor = ThreadPoolExecutor(1, initializer=_init_worker, initargs=(limiter, summarizer))
+
+    db = session_factory()
+    pending = {KIND_ARTICLE: [], KIND_VIDEO: []}
+
+    def flush():
+        if not pending[KIND_ARTICLE] and not pending[KIND_VIDEO]:
+            return
+        try:
+            stats["articles"] += save_article_summaries(db, pending[KIND_ARTICLE], add_missing_headlines)
+            stats["videos"] += save_video_summaries(db, pending[KIND_VIDEO])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        # 保存が終わってから記録する (途中で止まっても、保存していないものは再開時に要約し直す)
+        for kind, results in pending.items():
+            checkpoint.done[kind].update(r["id"] for r in results)
+            for r in results:
+                checkpoint.failed[kind].pop(r["id"], None)
+            results.clear()
+        checkpoint.save()
+        print(f"Backfill: saved {stats['articles']} articles, {stats['videos']} videos ({stats['failed']} failed)")
+
+    def collect(future):
+        outcome = future.result()
+        for key in ("calls", "input_tokens", "output_tokens"):
+            stats[key] += outcome["usage"].get(key, 0)
+        for result in outcome["results"]:
+            if "error" in result:
+                stats["failed"] += 1
+                checkpoint.failed[outcome["kind"]][result["id"]] = str(result["error"])[:500]
+            else:
+                pending[outcome["kind"]].append(result)
+        if sum(len(results) for results in pending.values()) >= flush_size:
+            flush()
+
+    try:
+        in_flight = set()
+        jobs = _jobs(db, targets, checkpoint, batch_size)
+        exhausted = False
+        while True:
+            # 処理中のまとまりをプロセス数の2倍までに抑える (本文を読み込みすぎない)
+            while not exhausted and len(in_flight) < max(1, workers) * 2:
+                if deadline is not None and deadline.expired():
+                    print("Backfill: time limit reached; run the same command again to resume")
+                    exhausted = True
+                    break
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    stats["completed"] = True
+                    break
+                seconds = deadline.remaining() if deadline is not None else None
+                in_flight.add(executor.submit(_summarize_job, job[0], job[1], seconds))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(future)
+        flush()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        checkpoint.save()
+        db.close()
+    print(f"Backfill finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="過去分の要約・ダイジェストの再処理")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="公開日の範囲の開始 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="公開日の範囲の終了 (省略時は開始日のみ)")
+    parser.add_argument("--article-id", action="append", default=[], help="記事ID (複数指定可)")
+    parser.add_argument("--video-id", action="append", default=[], help="動画のYouTube ID (複数指定可)")
+    parser.add_argument("--videos", action="store_true", help="期間内の字幕のある動画も対象にする")
+    parser.add_argument("--no-articles", action="store_true", help="期間内の記事を対象にしない")
+    parser.add_argument("--missing-only", action="store_true", help="未要約のものだけを対象にする")
+    parser.add_argument("--no-new-headlines", action="store_true", help="見出しのない記事をダイジェストに追加しない")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--rpm", type=float, default=BACKFILL_RPM, help="Gemini APIの呼び出し回数の上限 (毎分)")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT, help="チェックポイントファイル")
+    parser.add_argument("--fresh", action="store_true", help="チェックポイントを使わずに最初から処理する")
+    parser.add_argument("--max-minutes", type=float, help="この時間を過ぎたら新しい要約を始めずに終了する")
+    args = parser.parse_args()
+    if args.start is None and not args.article_id and not args.video_id:
+        parser.error("--from or --article-id/--video-id is required")
+
+    if args.fresh and args.checkpoint and os.path.exists(args.checkpoint):
+        os.unlink(args.checkpoint)
+    db = SessionLocal()
+    try:
+        selected = select_targets(
+            db,
+            args.start,
+            args.end,
+            args.article_id,
+            args.video_id,
+            include_articles=not args.no_articles,
+            include_videos=args.videos,
+            missing_only=args.missing_only,
+        )
+    finally:
+        db.close()
+    print(f"Backfill targets: {len(selected[KIND_ARTICLE])} articles, {len(selected[KIND_VIDEO])} videos")
+    run_backfill(
+        SessionLocal,
+        selected,
+        workers=args.workers,
+        rpm=args.rpm,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint,
+        max_seconds=args.max_minutes * 60 if args.max_minutes else None,
+        add_missing_headlines=not args.no_new_headlines,
+    )
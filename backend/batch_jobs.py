@@ -0,0 +1,438 @@
+"""
+Gemini のバッチインターフェースによる要約 (非同期の一括処理)
+
+過去の記事の要約し直しなど急がない要約を、Summarizer の同期呼び出しではなくバッチジョブで行う。
+同期呼び出しのクォータを収集処理と取り合わず、料金も同期呼び出しより安い。
+
+1. submit: 対象の記事 (BATCH_ARTICLES_PER_REQUEST 件ずつ1リクエスト)・動画のプロンプトをJSONLに書き、
+   ファイルをアップロードしてバッチジョブを作る。リクエストのキーと対象の対応は summary_batch_jobs テーブルに保存する。
+   未完了のジョブに含まれる記事・動画は、重ねて投入しない。
+2. poll: 投入済みのジョブの状態を確認し、完了したジョブの結果を取り込む (スケジューラーも BATCH_POLL_MINUTES ごとに行う)。
+3. 取り込みはジョブの行をロックして1回だけ行い、要約をまとめて保存してダイジェストを作り直す (backfill.py と同じ保存処理)。
+   取り込んだ記事のワークキューの未取得の作業は完了にする。
+
+コマンドラインから実行する:
+    python batch_jobs.py submit --from 2026-09-01 --to 2026-09-30 [--videos] [--missing-only]
+    python batch_jobs.py poll [--wait]
+    python batch_jobs.py status
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backfill import (
+    KIND_ARTICLE,
+    KIND_VIDEO,
+    load_articles,
+    load_video,
+    save_article_summaries,
+    save_video_summaries,
+    select_targets,
+)
+from database import SummaryBatchJob
+from metrics import GEMINI_BATCH_REQUESTS_TOTAL
+from prompt_prep import TokenCounter, batch_prompt, prepare_batch, video_prompt
+
+BATCH_MODEL = os.getenv("BATCH_MODEL") or os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# 1リクエストでまとめて要約する記事数
+BATCH_ARTICLES_PER_REQUEST = int(os.getenv("BATCH_ARTICLES_PER_REQUEST", "10"))
+# 投入するJSONLを書くディレクトリ (アップロード後に削除する)
+BATCH_DIR = os.getenv("BATCH_DIR") or tempfile.gettempdir()
+# スケジューラーで投入済みのジョブを確認する間隔 (分、0で無効)
+BATCH_POLL_MINUTES = int(os.getenv("BATCH_POLL_MINUTES", "10"))
+
+# Summarizer._generation_config と同じ設定 (バッチのリクエストはJSONで書く)
+SAFETY_CATEGORIES = [
+    "HARM_CATEGORY_HATE_SPEECH",
+    "HARM_CATEGORY_HARASSMENT",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    "HARM_CATEGORY_DANGEROUS_CONTENT",
+    "HARM_CATEGORY_CIVIC_INTEGRITY",
+]
+
+# 提供側のジョブの状態のうち、終わったもの
+SUCCEEDED_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+FAILED_STATES = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+# 取り込みが終わっていないジョブ (含まれる記事・動画は重ねて投入しない)
+OPEN_STATES = ("submitted", "succeeded")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# =====================================================
+# バッチインターフェース
+# =====================================================
+
+
+class GeminiBatchBackend:
+    """Gemini API のバッチインターフェース (ファイルをアップロードしてジョブを作る)"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None):
+        from google import genai
+
+        self.client = genai.Client(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+
+    def submit(self, path: str, model: str, display_name: str) -> str:
+        from google.genai import types
+
+        uploaded = self.client.files.upload(
+            file=path, config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl")
+        )
+        job = self.client.batches.create(model=model, src=uploaded.name, config={"display_name": display_name})
+        return job.name
+
+    def state(self, name: str) -> Tuple[str, Optional[str]]:
+        """(状態, エラー) を返す。状態は JOB_STATE_* の名前"""
+        job = self.client.batches.get(name=name)
+        return job.state.name, str(job.error) if job.error else None
+
+    def results(self, name: str) -> Iterator[Dict]:
+        job = self.client.batches.get(name=name)
+        data = self.client.files.download(file=job.dest.file_name)
+        for line in data.decode("utf-8").splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+class LocalBatchBackend:
+    """
+    テスト用のバッチインターフェースの代わり。投入したJSONLを directory に置き、
+    最初の状態の確認で respond (プロンプト -> モデルの出力テキスト) を使って結果のJSONLを書く。
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str, respond: Callable[[str], str]):
+        self.directory = directory
+        self.respond = respond
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{name.split('/')[-1]}.{suffix}.jsonl")
+
+    def submit(self, path: str, model: str, display_name: str) -> str:
+        name = f"local/{uuid.uuid4().hex}"
+        with open(path, encoding="utf-8") as src, open(self._path(name, "input"), "w", encoding="utf-8") as dst:
+            dst.write(src.read())
+        return name
+
+    def state(self, name: str) -> Tuple[str, Optional[str]]:
+        output = self._path(name, "output")
+        if not os.path.exists(output):
+            with open(self._path(name, "input"), encoding="utf-8") as src, open(output, "w", encoding="utf-8") as dst:
+                for line in src:
+                    request = json.loads(line)
+                    prompt = request["request"]["contents"][0]["parts"][0]["text"]
+                    try:
+                        text = self.respond(prompt)
+                        result = {"key": request["key"], "response": {"candidates": [{"content": {"parts": [{"text": text}]}}]}}
+                    except Exception as e:
+                        result = {"key": request["key"], "error": {"message": str(e)}}
+                    dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return "JOB_STATE_SUCCEEDED", None
+
+    def results(self, name: str) -> Iterator[Dict]:
+        with open(self._path(name, "output"), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def default_backend() -> GeminiBatchBackend:
+    return GeminiBatchBackend()
+
+
+# =====================================================
+# 投入
+# =====================================================
+
+
+def _request(prompt: str) -> Dict:
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generation_config": {"response_mime_type": "application/json"},
+        "safety_settings": [{"category": c, "threshold": "BLOCK_NONE"} for c in SAFETY_CATEGORIES],
+    }
+
+
+def open_target_ids(db: Session) -> Dict[str, set]:
+    """取り込みが終わっていないジョブに含まれる記事・動画のID"""
+    ids = {KIND_ARTICLE: set(), KIND_VIDEO: set()}
+    for job in db.query(SummaryBatchJob).filter(SummaryBatchJob.state.in_(OPEN_STATES)):
+        for target in job.requests.values():
+            ids[target["kind"]].update(target["ids"])
+    return ids
+
+
+def build_requests(
+    db: Session, targets: Dict[str, List[str]], articles_per_request: int = BATCH_ARTICLES_PER_REQUEST
+) -> Iterator[Tuple[str, Dict, Dict]]:
+    """(キー, リクエスト, 対象) を順に作る。記事はまとめて1つのプロンプトにする"""
+    counter = TokenCounter()
+    ids = targets.get(KIND_ARTICLE, [])
+    for i in range(0, len(ids), articles_per_request):
+        articles = load_articles(db, ids[i:i + articles_per_request])
+        if not articles:
+            continue
+        articles_text, _ = prepare_batch(articles, counter)
+        key = f"{KIND_ARTICLE}-{i // articles_per_request + 1}"
+        yield key, _request(batch_prompt(articles_text)), {"kind": KIND_ARTICLE, "ids": [a.article_id for a in articles]}
+    for youtube_id in targets.get(KIND_VIDEO, []):
+        video = load_video(db, youtube_id)
+        if video is None:
+            continue
+        yield f"{KIND_VIDEO}-{youtube_id}", _request(video_prompt(video["transcript"])), {"kind": KIND_VIDEO, "ids": [youtube_id]}
+
+
+def submit_job(
+    db: Session,
+    backend,
+    targets: Dict[str, List[str]],
+    model: str = BATCH_MODEL,
+    articles_per_request: int = BATCH_ARTICLES_PER_REQUEST,
+) -> Optional[SummaryBatchJob]:
+    """対象のプロンプトをJSONLに書いてバッチジョブを投入する (投入するものがなければ None)"""
+    busy = open_target_ids(db)
+    targets = {kind: [i for i in ids if i not in busy[kind]] for kind, ids in targets.items()}
+
+    requests = {}
+    fd, path = tempfile.mkstemp(dir=BATCH_DIR, prefix="summary-batch-", suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for key, request, target in build_requests(db, targets, articles_per_request):
+                f.write(json.dumps({"key": key, "request": request}, ensure_ascii=False) + "\n")
+                requests[key] = target
+        if not requests:
+            return None
+
+        job = SummaryBatchJob(
+            backend=backend.name, model=model, state="created", requests=requests, request_count=len(requests)
+        )
+        db.add(job)
+        db.commit()
+        # 投入に失敗しても、作ったジョブの行は失敗として残す (対象を解放する)
+        try:
+            job.name = backend.submit(path, model, f"news-summaries-{job.id}")
+            job.state = "submitted"
+            job.submitted_at = _now()
+        except Exception as e:
+            print(f"Error submitting batch job {job.id}: {e}")
+            job.state = "failed"
+            job.error = str(e)[:1000]
+        db.commit()
+        print(f"Batch job {job.id} ({job.name}): {job.state}, {len(requests)} requests")
+        return job
+    finally:
+        os.unlink(path)
+
+
+# =====================================================
+# 確認と取り込み
+# =====================================================
+
+
+def _response_text(response: Dict) -> str:
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+def _usage(response: Dict) -> Tuple[int, int]:
+    usage = response.get("usageMetadata") or response.get("usage_metadata") or {}
+    return (
+        usage.get("promptTokenCount") or usage.get("prompt_token_count") or 0,
+        usage.get("candidatesTokenCount") or usage.get("candidates_token_count") or 0,
+    )
+
+
+def parse_result(line: Dict, target: Dict) -> List[Dict]:
+    """
+    結果の1行を対象ごとの結果にする。
+
+    Returns:
+        [{"id", "summary", "key_points"} または {"id", "error"}, ...]
+    """
+    ids = target["ids"]
+    if line.get("error"):
+        return [{"id": i, "error": str(line["error"])} for i in ids]
+    try:
+        parsed = json.loads(_response_text(line.get("response") or {}))
+    except ValueError as e:
+        return [{"id": i, "error": f"invalid JSON in batch response: {e}"} for i in ids]
+
+    items = [parsed] if target["kind"] == KIND_VIDEO else parsed
+    if not isinstance(items, list):
+        items = []
+    results = []
+    for i, target_id in enumerate(ids):
+        item = items[i] if i < len(items) else None
+        if isinstance(item, dict) and item.get("summary"):
+            results.append({"id": target_id, "summary": item["summary"], "key_points": item.get("key_points") or []})
+        else:
+            results.append({"id": target_id, "error": "missing summary in batch response"})
+    return results
+
+
+def ingest_job(db: Session, backend, job_id: int) -> int:
+    """
+    完了したジョブの結果を取り込む。ジョブの行をロックし、取り込み済みの場合は何もしない。
+
+    Returns:
+        保存した記事・動画の数
+    """
+    from work_queue import cancel
+
+    job = db.query(SummaryBatchJob).filter(SummaryBatchJob.id == job_id).with_for_update().one()
+    if job.state != "succeeded" or job.ingested_at is not None:
+        db.rollback()
+        return 0
+
+    results = {KIND_ARTICLE: [], KIND_VIDEO: []}
+    failed = 0
+    input_tokens = output_tokens = 0
+    for line in backend.results(job.name):
+        target = job.requests.get(line.get("key"))
+        if target is None:
+            continue
+        tokens = _usage(line.get("response") or {})
+        input_tokens += tokens[0]
+        output_tokens += tokens[1]
+        outcome = "error" if line.get("error") else "ok"
+        GEMINI_BATCH_REQUESTS_TOTAL.labels(outcome=outcome).inc()
+        for result in parse_result(line, target):
+            if "error" in result:
+                failed += 1
+            else:
+                results[target["kind"]].append(result)
+
+    saved = save_article_summaries(db, results[KIND_ARTICLE]) + save_video_summaries(db, results[KIND_VIDEO])
+    # 要約できた記事・動画を、ワークキューで重ねて要約しない
+    for kind, kind_results in results.items():
+        cancel(db, kind, [r["id"] for r in kind_results])
+    job.state = "ingested"
+    job.ingested_at = _now()
+    job.summarized = saved
+    job.failed = failed
+    job.input_tokens = input_tokens
+    job.output_tokens = output_tokens
+    db.commit()
+    print(f"Batch job {job.id}: ingested {saved} summaries ({failed} failed)")
+    return saved
+
+
+def poll_jobs(db: Session, backend=None) -> Dict[str, int]:
+    """投入済みのジョブの状態を確認し、完了したジョブを取り込む"""
+    counts = {"pending": 0, "ingested": 0, "failed": 0}
+    jobs = (
+        db.query(SummaryBatchJob)
+        .filter(SummaryBatchJob.state.in_(("submitted", "succeeded")))
+        .order_by(SummaryBatchJob.id)
+        .all()
+    )
+    if not jobs:
+        return counts
+    backend = backend or default_backend()
+    job_ids = [job.id for job in jobs]
+    db.rollback()
+    for job_id in job_ids:
+        try:
+            job = db.get(SummaryBatchJob, job_id)
+            if job.state == "submitted":
+                state, error = backend.state(job.name)
+                if state in SUCCEEDED_STATES:
+                    job.state = "succeeded"
+                    job.completed_at = _now()
+                elif state in FAILED_STATES:
+                    job.state = "failed"
+                    job.completed_at = _now()
+                    job.error = error or state
+                db.commit()
+            if job.state == "succeeded":
+                ingest_job(db, backend, job_id)
+                counts["ingested"] += 1
+            elif job.state == "failed":
+                print(f"Batch job {job_id} failed: {job.error}")
+                counts["failed"] += 1
+            else:
+                counts["pending"] += 1
+        except Exception as e:
+            print(f"Error polling batch job {job_id}: {e}")
+            db.rollback()
+            counts["pending"] += 1
+    return counts
+
+
+def job_to_dict(job: SummaryBatchJob) -> Dict:
+    return {
+        "id": job.id,
+        "name": job.name,
+        "state": job.state,
+        "model": job.model,
+        "requests": job.request_count,
+        "summarized": job.summarized or 0,
+        "failed": job.failed or 0,
+        "input_tokens": job.input_tokens or 0,
+        "output_tokens": job.output_tokens or 0,
+        "error": job.error,
+        "submitted_at": job.submitted_at.isoformat() if job.submitted_at else None,
+        "ingested_at": job.ingested_at.isoformat() if job.ingested_at else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Gemini のバッチインターフェースによる要約")
+    sub = parser.add_subparsers(dest="command", required=True)
+    submit = sub.add_parser("submit", help="バッチジョブを投入する")
+    submit.add_argument("--from", dest="start", type=date.fromisoformat, help="公開日の範囲の開始 (YYYY-MM-DD)")
+    submit.add_argument("--to", dest="end", type=date.fromisoformat, help="公開日の範囲の終了 (省略時は開始日のみ)")
+    submit.add_argument("--article-id", action="append", default=[], help="記事ID (複数指定可)")
+    submit.add_argument("--video-id", action="append", default=[], help="動画のYouTube ID (複数指定可)")
+    submit.add_argument("--videos", action="store_true", help="期間内の字幕のある動画も対象にする")
+    submit.add_argument("--missing-only", action="store_true", help="未要約のものだけを対象にする")
+    submit.add_argument("--articles-per-request", type=int, default=BATCH_ARTICLES_PER_REQUEST)
+    submit.add_argument("--model", default=BATCH_MODEL)
+    poll = sub.add_parser("poll", help="投入済みのジョブを確認し、完了したものを取り込む")
+    poll.add_argument("--wait", action="store_true", help="全てのジョブが終わるまで確認を続ける")
+    poll.add_argument("--interval", type=float, default=60, help="--wait の確認の間隔 (秒)")
+    sub.add_parser("status", help="最近のジョブの状態")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "submit":
+            if args.start is None and not args.article_id and not args.video_id:
+                parser.error("--from or --article-id/--video-id is required")
+            selected = select_targets(
+                db, args.start, args.end, args.article_id, args.video_id,
+                include_videos=args.videos, missing_only=args.missing_only,
+            )
+            submit_job(db, default_backend(), selected, args.model, args.articles_per_request)
+        elif args.command == "poll":
+            while True:
+                counts = poll_jobs(db)
+                print(f"Batch jobs: {counts}")
+                if not args.wait or not counts["pending"]:
+                    break
+                time.sleep(args.interval)
+        else:
+            jobs = db.query(SummaryBatchJob).order_by(SummaryBatchJob.id.desc()).limit(20)
+            for job in jobs:
+                print(json.dumps(job_to_dict(job), ensure_ascii=False))
+    finally:
+        db.close()
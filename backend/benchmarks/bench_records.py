@@ -0,0 +1,205 @@
+"""
+取得した記事のレコード (records.ArticleRecord) と、以前の dict の形式のメモリ・処理時間の比較
+
+同じ文字列 (タイトル・リンク・概要) から、以前の形式 (キーを持つ dict に収集処理が article_id・要約・重要ポイントを
+書き足し、見出しの dict を別に作る) と ArticleRecord を件数分作り、収集処理と同じ順に
+取得 → 要約の書き込み → 保存用の行と見出しの作成 を行う。tracemalloc で次を計測する:
+
+- 1件あたりのメモリ: 取得直後の記事を保持するのに使うメモリ (文字列そのものは両方で共有するため含まない)
+- 全体の割り当て: 保存用の行と見出しを作り終えるまでのメモリのピーク
+- 処理時間: 同じ処理を tracemalloc なしで実行した時間
+
+使い方:
+    python benchmarks/bench_records.py --articles 5000
+
+ingest.py の読み込みに DATABASE_URL が必要なため、指定しない場合は一時ディレクトリのSQLiteファイルを使用する (DBには接続しない)。
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_records.db')}"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import _article_row  # noqa: E402
+from records import ArticleRecord  # noqa: E402
+
+SOURCES = ["Google News", "NHK"]
+TOPICS = ["top", "business", "technology", "main"]
+
+
+def make_fields(n):
+    """両方の形式で共有する文字列と日時"""
+    base = datetime(2026, 1, 5, tzinfo=timezone.utc)
+    return [
+        (
+            f"gn_{i:016x}",
+            f"記事{i}の見出し - 配信元{i % 50}",
+            f"https://example.com/news/{i}",
+            f"記事{i}の概要。" * 8,
+            base + timedelta(minutes=i),
+            SOURCES[i % 2],
+            TOPICS[i % 4],
+            f"記事{i}の要約",
+        )
+        for i in range(n)
+    ]
+
+
+# -------------------------------------------------
+# 以前の形式 (クライアントが dict を返し、収集処理が書き足す)
+# -------------------------------------------------
+
+
+def fetch_dicts(fields):
+    return [
+        {
+            "article_id": article_id,
+            "title": title,
+            "link": link,
+            "description": description,
+            "published_at": published_at,
+            "source": source,
+            "topic": topic,
+        }
+        for article_id, title, link, description, published_at, source, topic, _ in fields
+    ]
+
+
+def summarize_dicts(articles, fields):
+    for article, field in zip(articles, fields):
+        article["summary"] = field[7]
+        article["key_points"] = []
+
+
+def persist_dicts(articles, now):
+    rows = []
+    headlines = []
+    for article in articles:
+        summary = article.get("summary") or ""
+        rows.append({
+            "article_id": article["article_id"],
+            "title": article.get("title", ""),
+            "link": article.get("link", ""),
+            "description": article.get("description") or "",
+            "content": article.get("content"),
+            "summary": summary,
+            "category": article.get("category") or article.get("topic"),
+            "source": article.get("source"),
+            "published_at": article.get("published_at"),
+            "status": "processed" if summary else "unprocessed",
+            "created_at": now,
+        })
+        headlines.append({
+            "article_id": article["article_id"],
+            "title": article.get("title", ""),
+            "summary": article.get("summary", ""),
+            "link": article.get("link", ""),
+            "source": article.get("source"),
+            "topic": article.get("topic") or article.get("category"),
+            "published_at": article.get("published_at").isoformat() if article.get("published_at") else None,
+        })
+    return rows, headlines
+
+
+# -------------------------------------------------
+# ArticleRecord
+# -------------------------------------------------
+
+
+def fetch_records(fields):
+    return [
+        ArticleRecord(
+            article_id=article_id,
+            title=title,
+            link=link,
+            description=description,
+            published_at=published_at,
+            source=source,
+            topic=topic,
+        )
+        for article_id, title, link, description, published_at, source, topic, _ in fields
+    ]
+
+
+def summarize_records(articles, fields):
+    for article, field in zip(articles, fields):
+        article.summary = field[7]
+        article.key_points = []
+
+
+def persist_records(articles, now):
+    rows = [_article_row(article, now) for article in articles]
+    headlines = [article.headline() for article in articles]
+    return rows, headlines
+
+
+PATHS = {
+    "dict": (fetch_dicts, summarize_dicts, persist_dicts),
+    "record": (fetch_records, summarize_records, persist_records),
+}
+
+
+def measure(name, fields, repeat):
+    fetch, summarize, persist = PATHS[name]
+    now = datetime.now(timezone.utc)
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    articles = fetch(fields)
+    fetched = tracemalloc.get_traced_memory()[0] - base
+    summarize(articles, fields)
+    persist(articles, now)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    del articles
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        articles = fetch(fields)
+        summarize(articles, fields)
+        persist(articles, now)
+        timings.append(time.perf_counter() - start)
+        del articles
+    return {
+        "bytes_per_article": fetched / len(fields),
+        "peak_bytes": peak,
+        "seconds": min(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記事のレコードと dict のメモリ・処理時間の比較")
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fields = make_fields(args.articles)
+    results = {name: measure(name, fields, args.repeat) for name in PATHS}
+
+    print(f"{args.articles} articles")
+    print(f"{'':8} {'bytes/article':>14} {'peak (KiB)':>12} {'time (ms)':>10}")
+    for name, r in results.items():
+        print(f"{name:8} {r['bytes_per_article']:>14.0f} {r['peak_bytes'] / 1024:>12.0f} {r['seconds'] * 1000:>10.1f}")
+    old, new = results["dict"], results["record"]
+    # 処理時間は実行ごとのばらつきが大きいため、メモリの差と同じ意味では比べない
+    print(
+        f"record vs dict: per-article memory {new['bytes_per_article'] / old['bytes_per_article'] - 1:+.0%}, "
+        f"peak allocation {new['peak_bytes'] / old['peak_bytes'] - 1:+.0%}, "
+        f"time {new['seconds'] / old['seconds'] - 1:+.0%} (noisy)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+取得先のホストごとのサーキットブレーカー
+
+Google News・NHK・YouTube や記事の配信元が遅い・ブロックしている間も、呼び出しのたびにタイムアウトまで
+待っていると、収集1回が失敗するまでに数分かかる。ホストごとに呼び出しの結果を数え、
+失敗が続く (連続 BREAKER_CONSECUTIVE_FAILURES 回、または区間内の失敗率が BREAKER_FAILURE_RATE 以上) と
+open にして、そのホストへの呼び出しは待たずに CircuitOpenError で失敗させる。
+
+- open の期間 (BREAKER_OPEN_SECONDS、続けて open になるたびに倍、BREAKER_MAX_OPEN_SECONDS まで) を過ぎると
+  half_open にし、1回だけ試しに呼び出す。成功すれば closed に戻し、失敗すれば再び open にする。
+- 状態は upstream_breakers テーブルに保存し、全ワーカー (gunicornの各ワーカー、別ホストのプロセス) で共有する。
+  DBが使えない場合は、プロセス内の状態で同じように動作する。
+- 呼び出しのたびにDBを読み書きしないよう、共有の状態は BREAKER_SYNC_SECONDS の間プロセス内にキャッシュし、
+  closed の間の成功はプロセス内で数える。共有の行を更新するのは、失敗・状態の遷移と、
+  キャッシュの期限切れのたびに数えた成功をまとめて反映する場合だけ
+  (他のワーカーが open にしたことに気づくまで、最大 BREAKER_SYNC_SECONDS かかる)。
+- 状態は GET /api/upstreams で確認できる。
+
+使い方:
+    with breakers.guard(url):
+        response = session.get(url, timeout=10)
+        response.raise_for_status()
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from sqlalchemy.orm import Session
+
+from database import UpstreamBreaker, dialect_insert
+from metrics import BREAKER_REJECTED_TOTAL, BREAKER_TRANSITIONS_TOTAL
+
+# 失敗率を数える区間の秒数
+WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "300"))
+# 失敗率で判定する最小の呼び出し数
+MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+CONSECUTIVE_FAILURES = int(os.getenv("BREAKER_CONSECUTIVE_FAILURES", "3"))
+OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "60"))
+MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "900"))
+# half_open の試しの呼び出しがこの秒数で終わらない場合は、別の呼び出しに試させる
+PROBE_TIMEOUT_SECONDS = float(os.getenv("BREAKER_PROBE_TIMEOUT", "30"))
+# 共有の状態をプロセス内にキャッシュする秒数 (closed の間の成功もこの間隔でまとめて反映する)
+SYNC_SECONDS = float(os.getenv("BREAKER_SYNC_SECONDS", "10"))
+# 失敗として数えるHTTPステータス (5xx の他に、ブロック・レート制限を示すもの)
+FAILURE_STATUSES = {403, 429}
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが open のホストへの呼び出し"""
+
+    def __init__(self, host: str, retry_at: Optional[datetime] = None):
+        self.host = host
+        self.retry_at = retry_at
+        when = f" until {retry_at.isoformat()}" if retry_at else ""
+        super().__init__(f"circuit open for {host}{when}")
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).hostname or url
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """DBから読んだ日時をUTCのaware datetimeに揃える (SQLiteはnaiveで返すため)"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """ホストの不調として数える例外か (タイムアウト・接続エラー・5xx・403・429)"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 500
+        return status >= 500 or status in FAILURE_STATUSES
+    return isinstance(error, requests.RequestException)
+
+
+def _new_state(host: str) -> UpstreamBreaker:
+    return UpstreamBreaker(host=host, state="closed", calls=0, failures=0, consecutive_failures=0, open_count=0)
+
+
+def _set_state(state: UpstreamBreaker, value: str, now: datetime) -> None:
+    if state.state != value:
+        print(f"Circuit breaker {state.host}: {state.state} -> {value}")
+        BREAKER_TRANSITIONS_TOTAL.labels(host=state.host, state=value).inc()
+    state.state = value
+    state.updated_at = now
+
+
+def before_call(state: UpstreamBreaker, now: datetime) -> bool:
+    """
+    呼び出してよいかを判定する。open の期間を過ぎていれば half_open にし、この呼び出しを試しの呼び出しにする。
+    """
+    if state.state == "open":
+        if now < _as_utc(state.open_until):
+            return False
+        _set_state(state, "half_open", now)
+        state.probe_started_at = now
+        return True
+    if state.state == "half_open":
+        probe_started = _as_utc(state.probe_started_at)
+        if probe_started and now - probe_started < timedelta(seconds=PROBE_TIMEOUT_SECONDS):
+            # 別の呼び出しが試している間は待たせない
+            return False
+        state.probe_started_at = now
+        return True
+    return True
+
+
+def _roll_window(state: UpstreamBreaker, now: datetime) -> None:
+    window_started = _as_utc(state.window_started_at)
+    if window_started is None or now - window_started > timedelta(seconds=WINDOW_SECONDS):
+        state.window_started_at = now
+        state.calls = 0
+        state.failures = 0
+
+
+def record_successes(state: UpstreamBreaker, now: datetime, count: int) -> None:
+    """closed の間にプロセス内で数えた成功をまとめて反映する"""
+    if count <= 0 or state.state != "closed":
+        return
+    _roll_window(state, now)
+    state.calls = (state.calls or 0) + count
+    state.consecutive_failures = 0
+    state.updated_at = now
+
+
+def record_result(state: UpstreamBreaker, now: datetime, ok: bool, error: Optional[str] = None) -> None:
+    """呼び出しの結果を数え、状態を更新する"""
+    if not ok:
+        state.last_error = (error or "")[:500]
+    if state.state == "half_open":
+        if ok:
+            _set_state(state, "closed", now)
+            state.open_count = 0
+            state.consecutive_failures = 0
+            state.window_started_at = now
+            state.calls = 0
+            state.failures = 0
+        else:
+            _trip(state, now)
+        state.probe_started_at = None
+        return
+    if state.state == "open":
+        # open になる前に始まった呼び出しの結果は数えない
+        return
+
+    _roll_window(state, now)
+    state.calls = (state.calls or 0) + 1
+    state.updated_at = now
+    if ok:
+        state.consecutive_failures = 0
+        return
+    state.failures = (state.failures or 0) + 1
+    state.consecutive_failures = (state.consecutive_failures or 0) + 1
+    if state.consecutive_failures >= CONSECUTIVE_FAILURES or (
+        state.calls >= MIN_CALLS and state.failures / state.calls >= FAILURE_RATE
+    ):
+        _trip(state, now)
+
+
+def _trip(state: UpstreamBreaker, now: datetime) -> None:
+    state.open_count = (state.open_count or 0) + 1
+    seconds = min(MAX_OPEN_SECONDS, OPEN_SECONDS * 2 ** (state.open_count - 1))
+    _set_state(state, "open", now)
+    state.opened_at = now
+    state.open_until = now + timedelta(seconds=seconds)
+
+
+def state_to_dict(state: UpstreamBreaker) -> Dict:
+    calls = state.calls or 0
+    return {
+        "host": state.host,
+        "state": state.state,
+        "calls": calls,
+        "failures": state.failures or 0,
+        "failure_rate": round((state.failures or 0) / calls, 3) if calls else 0.0,
+        "consecutive_failures": state.consecutive_failures or 0,
+        "opened_at": _as_utc(state.opened_at).isoformat() if state.opened_at else None,
+        "retry_at": _as_utc(state.open_until).isoformat() if state.state == "open" and state.open_until else None,
+        "last_error": state.last_error,
+        "updated_at": _as_utc(state.updated_at).isoformat() if state.updated_at else None,
+    }
+
+
+class CircuitBreakers:
+    """
+    ホストごとのブレーカー。共有の状態はDBの行ロックを取って更新する (複数のワーカーが同時に記録しても
+    数えこぼさない)。closed の間の成功と状態の参照はプロセス内で済ませ、SYNC_SECONDS ごとにDBと同期する。
+    """
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None):
+        self.session_factory = session_factory
+        # DBが使えない場合のプロセス内の状態
+        self._local: Dict[str, UpstreamBreaker] = {}
+        # 最後に読み書きした共有の状態: ホスト -> (state, open_until, 読み書きした time.monotonic())
+        self._cache: Dict[str, Tuple[str, Optional[datetime], float]] = {}
+        # まだ共有の状態に反映していない、closed の間の成功の数
+        self._successes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._warned = False
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def _fallback(self, error: Exception) -> None:
+        if not self._warned:
+            print(f"Circuit breaker state is not shared (database unavailable): {error}")
+            self._warned = True
+
+    def _remember(self, host: str, state: Optional[UpstreamBreaker]) -> None:
+        with self._lock:
+            if state is None:
+                self._cache[host] = ("closed", None, time.monotonic())
+            else:
+                self._cache[host] = (state.state, _as_utc(state.open_until), time.monotonic())
+
+    def _read(self, host: str) -> Optional[UpstreamBreaker]:
+        try:
+            db = self._session()
+            try:
+                state = db.get(UpstreamBreaker, host)
+            finally:
+                db.close()
+        except Exception as e:
+            self._fallback(e)
+            with self._lock:
+                state = self._local.get(host)
+        self._remember(host, state)
+        return state
+
+    def _state(self, host: str) -> Tuple[str, Optional[datetime]]:
+        """ホストの (state, open_until)。キャッシュが SYNC_SECONDS より古ければDBと同期する"""
+        with self._lock:
+            cached = self._cache.get(host)
+            if cached is not None and time.monotonic() - cached[2] < SYNC_SECONDS:
+                return cached[0], cached[1]
+            successes = self._successes.pop(host, 0)
+        if successes:
+            # プロセス内で数えた成功を反映し、同時に最新の状態を読む
+            self._update(host, lambda s, now: record_successes(s, now, successes))
+        else:
+            self._read(host)
+        with self._lock:
+            cached = self._cache[host]
+        return cached[0], cached[1]
+
+    def _update(self, host: str, fn: Callable[[UpstreamBreaker, datetime], object]):
+        """ホストの状態を行ロックを取って読み、fn で変更して保存する"""
+        now = datetime.now(timezone.utc)
+        try:
+            db = self._session()
+            try:
+                db.execute(
+                    dialect_insert(db)(UpstreamBreaker)
+                    .values(host=host, state="closed", calls=0, failures=0, consecutive_failures=0, open_count=0, updated_at=now)
+                    .on_conflict_do_nothing(index_elements=[UpstreamBreaker.host])
+                )
+                state = db.query(UpstreamBreaker).filter(UpstreamBreaker.host == host).with_for_update().one()
+                result = fn(state, now)
+                db.commit()
+                self._remember(host, state)
+                return result
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+        except Exception as e:
+            self._fallback(e)
+            with self._lock:
+                state = self._local.setdefault(host, _new_state(host))
+                result = fn(state, now)
+            self._remember(host, state)
+            return result
+
+    def check(self, url: str) -> str:
+        """呼び出してよければホスト名を返す。open の場合は CircuitOpenError を送出する"""
+        host = host_of(url)
+        state, open_until = self._state(host)
+        if state == "closed":
+            return host
+        if state == "open" and open_until is not None and datetime.now(timezone.utc) < open_until:
+            # open の期間中はDBを読み書きせずに失敗させる
+            BREAKER_REJECTED_TOTAL.labels(host=host).inc()
+            raise CircuitOpenError(host, open_until)
+        allowed, retry_at = self._update(
+            host, lambda s, now: (before_call(s, now), _as_utc(s.open_until) if s.state == "open" else None)
+        )
+        if not allowed:
+            BREAKER_REJECTED_TOTAL.labels(host=host).inc()
+            raise CircuitOpenError(host, retry_at)
+        return host
+
+    def record(self, host: str, ok: bool, error: Optional[str] = None) -> None:
+        with self._lock:
+            cached = self._cache.get(host)
+            if ok and (cached is None or cached[0] == "closed"):
+                # closed の間の成功はプロセス内で数え、次の同期か失敗の記録でまとめて反映する
+                self._successes[host] = self._successes.get(host, 0) + 1
+                return
+            successes = self._successes.pop(host, 0)
+
+        def apply(state: UpstreamBreaker, now: datetime) -> None:
+            record_successes(state, now, successes)
+            record_result(state, now, ok, error)
+
+        self._update(host, apply)
+
+    @contextmanager
+    def guard(self, url: str, is_failure: Callable[[BaseException], bool] = is_upstream_failure):
+        """
+        ブロック内の呼び出しを url のホストへの呼び出しとして数える。
+        open の場合は CircuitOpenError を送出し、ブロックを実行しない (ブロック内の待機も行わない)。
+        """
+        host = self.check(url)
+        try:
+            yield
+        except Exception as e:
+            failed = is_failure(e)
+            self.record(host, not failed, str(e) if failed else None)
+            raise
+        self.record(host, True)
+
+    def status(self, db: Session) -> List[Dict]:
+        """全ホストの状態 (DBに保存された状態と、このプロセス内の状態)"""
+        states = {}
+        try:
+            states = {s.host: s for s in db.query(UpstreamBreaker).all()}
+        except Exception as e:
+            db.rollback()
+            self._fallback(e)
+        with self._lock:
+            for host, state in self._local.items():
+                states.setdefault(host, state)
+        return [state_to_dict(states[host]) for host in sorted(states)]
+
+
+breakers = CircuitBreakers()
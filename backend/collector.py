@@ -0,0 +1,392 @@
+"""
+ニュース収集処理
+
+設定された全てのソース (Google News, NHK, YouTube) からニュースを並行に取得し、
+バッチ処理で要約して記事テーブルと日別ダイジェスト (見出しごとにソースを記録) に保存する。
+APIエンドポイントとスケジューラの双方から呼び出される。
+取得 → 重複除去 → 補完 → 要約 → 保存 をパイプライン (pipeline.py) のステージとして並行に実行し、
+最初のフィードを取得した時点で要約を始め、要約できた分から保存する。
+補完ステージでは、Google Newsのリダイレクト用リンクを配信元のURLに解決し、記事本文を抽出する (enrich.py)。
+要約できなかった記事はワークキュー (work_queue.py) に登録し、ワーカーが再要約する。
+1回の実行ごとに、所要時間・件数・Gemini APIの呼び出し回数とトークン数を collect_runs テーブルに記録する。
+
+収集1回には締め切り (COLLECT_DEADLINE_SECONDS) があり、時間予算を取得・要約・公開の各段階に割り振る。
+締め切りが近づいても終わらない場合は、その時点で取得済みの見出しと完了した要約を公開して呼び出し元に返し、
+残りの要約はバックグラウンドで続けてダイジェストに反映する (実行記録の状態は partial → success)。
+
+ニュースクライアントと要約モジュール (feedparser, google.genai 等) は読み込みが重く、
+参照系のリクエストしか処理しないワーカーでは不要なため、収集処理の実行時に読み込む。
+"""
+
+import os
+import threading
+import time
+from dataclasses import replace
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import Article, CollectRun, DigestHeadline, mark_primary_write
+from deadline import Deadline
+from digests import merge_headlines, refresh_stale_digests
+from ingest import upsert_articles
+from metrics import COLLECT_DURATION_SECONDS, observe_stage, record_stage_durations
+from pipeline import Pipeline, Stage
+from records import ArticleRecord
+from sources import SOURCE_TIMEOUT_SECONDS, configured_jobs, fetch_job
+from work_queue import KIND_ARTICLE, cancel, enqueue
+
+# パイプラインの各ステージの並列数・バッチサイズ
+FETCH_WORKERS = int(os.getenv("COLLECT_FETCH_WORKERS", "8"))
+ENRICH_WORKERS = int(os.getenv("COLLECT_ENRICH_WORKERS", "8"))
+SUMMARIZE_WORKERS = int(os.getenv("COLLECT_SUMMARIZE_WORKERS", "2"))
+SUMMARIZE_BATCH_SIZE = int(os.getenv("COLLECT_SUMMARIZE_BATCH_SIZE", "5"))
+PERSIST_BATCH_SIZE = int(os.getenv("COLLECT_PERSIST_BATCH_SIZE", "20"))
+# ステージ間のキューの容量 (処理中の記事数の上限)
+QUEUE_SIZE = int(os.getenv("COLLECT_QUEUE_SIZE", "50"))
+
+# 収集1回の締め切り (NFR-02: 要約は1分以内)
+COLLECT_DEADLINE_SECONDS = float(os.getenv("COLLECT_DEADLINE_SECONDS", "55"))
+# 締め切りに対する各段階の予算の割合
+FETCH_BUDGET = 0.3  # ソースの取得 (これを過ぎたソースはタイムアウトとして扱う)
+ENRICH_BUDGET = 0.5  # リンクの解決と本文の抽出 (これを過ぎた記事はRSSの内容のまま要約する)
+PUBLISH_AT = 0.9  # これを過ぎても終わらない場合は、その時点の結果を公開する
+# 公開後にバックグラウンドで処理を続ける上限 (締め切りの倍数、これを過ぎたら打ち切る)
+BACKGROUND_LIMIT = float(os.getenv("COLLECT_BACKGROUND_LIMIT", "5"))
+
+# バックグラウンドで続いている収集処理 (終了待ちに使う)
+_background: List[threading.Thread] = []
+
+
+def run_collect(db: Session, trigger: str = "api") -> Dict:
+    """
+    設定された全てのソースからニュースを取得し、バッチ処理で要約してDailyDigestに保存する。
+    1回のAPI呼び出しで複数記事を要約するため、API使用量を大幅に削減。
+    一部のソースの取得に失敗・タイムアウトしても、残りのソースの記事で収集を続ける。
+    締め切りまでに終わらない場合は途中の結果を公開して返し、残りはバックグラウンドで続ける。
+
+    失敗した場合はロールバックして実行記録をエラーとして保存し、例外を呼び出し元に送出する。
+    """
+    from summarizer import Summarizer
+
+    run = CollectRun(trigger=trigger, status="running", started_at=datetime.now(timezone.utc))
+    db.add(run)
+    db.commit()
+
+    summarizer = Summarizer(os.getenv("GEMINI_API_KEY"))
+    collect = _Collect(db, summarizer, Deadline(COLLECT_DEADLINE_SECONDS))
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with record_stage_durations() as durations:
+            try:
+                result = collect.run()
+                run.status = result["status"]
+                outcome = "ok" if result["status"] == "success" else "partial"
+            except Exception as e:
+                db.rollback()
+                run.status = "error"
+                run.error = str(e)
+                collect.close()
+                raise
+            finally:
+                _record_run(run, collect, durations)
+                db.commit()
+    finally:
+        COLLECT_DURATION_SECONDS.labels(outcome=outcome).observe(time.perf_counter() - start)
+
+    if result["status"] == "partial":
+        thread = threading.Thread(
+            target=collect.finish_in_background,
+            args=(run.id, durations),
+            name=f"collect-{run.id}",
+            daemon=True,
+        )
+        thread.start()
+        _background.append(thread)
+
+    result["run_id"] = run.id
+    result["api_calls"] = run.gemini_calls
+    return result
+
+
+def wait_for_background(timeout: float) -> bool:
+    """バックグラウンドで続いている収集処理の終了を待つ (全て終了した場合は True)"""
+    end = time.monotonic() + timeout
+    for thread in list(_background):
+        thread.join(max(0.0, end - time.monotonic()))
+    _background[:] = [t for t in _background if t.is_alive()]
+    return not _background
+
+
+def _record_run(run: CollectRun, collect: "_Collect", durations: Dict[str, float]) -> None:
+    """件数・所要時間・パイプラインの統計・Gemini APIの使用量を実行記録に反映する"""
+    progress = collect.progress
+    run.finished_at = datetime.now(timezone.utc)
+    run.stage_durations = {stage: round(sec, 3) for stage, sec in dict(durations).items()}
+    run.pipeline_stats = progress["pipeline"]
+    run.source_stats = dict(progress["sources"])
+    run.articles_fetched = progress["fetched"]
+    run.articles_new = progress["new"]
+    run.articles_summarized = progress["summarized"]
+    run.gemini_calls = collect.summarizer.usage["calls"]
+    run.input_tokens = collect.summarizer.usage["input_tokens"]
+    run.output_tokens = collect.summarizer.usage["output_tokens"]
+    run.input_tokens_saved = collect.summarizer.usage["input_tokens_saved"]
+
+
+class _Collect:
+    """
+    収集1回分の処理。
+    保存はパイプラインのスレッドで行うため、呼び出し元とは別のセッション (writer) を使う。
+    締め切り後もバックグラウンドで保存を続けられるよう、writer は処理が終わるまで開いておく。
+    """
+
+    def __init__(self, db: Session, summarizer, deadline: Deadline):
+        self.db = db
+        self.summarizer = summarizer
+        self.deadline = deadline
+        # バックグラウンドでの処理を含めた打ち切りの期限
+        self.hard_deadline = deadline.extend(BACKGROUND_LIMIT)
+        self.writer = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())()
+        self.write_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.today = date.today()
+        self.seen = set()
+        # 取得済みでまだ保存していない記事 (途中で公開する場合に見出しだけ保存する)
+        self.pending: Dict[str, ArticleRecord] = {}
+        # 件数とパイプラインの統計 (失敗してロールバックした場合も実行記録に残す)
+        self.progress = {"fetched": 0, "new": 0, "summarized": 0, "saved": 0, "changed": 0, "pipeline": {}, "sources": {}}
+        self.pipeline: Optional[Pipeline] = None
+        self.enricher = None
+
+    def close(self) -> None:
+        with self.write_lock:
+            self.writer.close()
+
+    def run(self) -> Dict:
+        jobs = configured_jobs()
+        if os.getenv("COLLECT_ENRICH", "true").lower() == "true":
+            from enrich import Enricher
+
+            self.enricher = Enricher(self.lookup_resolutions)
+
+        # その日のダイジェストで要約済みの記事 (再要約しない)
+        self.summarized_ids = {
+            row.article_id
+            for row in self.db.query(DigestHeadline.article_id)
+            .filter(DigestHeadline.date == self.today, func.coalesce(DigestHeadline.summary, "") != "")
+        }
+        self.existing_ids = {
+            row.article_id
+            for row in self.db.query(DigestHeadline.article_id).filter(DigestHeadline.date == self.today)
+        }
+
+        self.pipeline = Pipeline(
+            [
+                Stage("fetch", self.fetch, workers=max(1, min(FETCH_WORKERS, len(jobs)))),
+                Stage("dedup", self.dedup),
+                # リンクの解決と本文の取得はHTTPの待ちが大半のため、多めのスレッドで並行に行う
+                Stage("enrich", self.enrich, workers=ENRICH_WORKERS if self.enricher else 1),
+                Stage("summarize", self.summarize, workers=SUMMARIZE_WORKERS, batch_size=SUMMARIZE_BATCH_SIZE),
+                # DBセッションはスレッド間で共有できないため、保存は1スレッドで行う
+                Stage("persist", self.persist, batch_size=PERSIST_BATCH_SIZE),
+            ],
+            queue_size=QUEUE_SIZE,
+        )
+        self.pipeline.start(jobs)
+        finished = self.pipeline.join(self.deadline.portion(PUBLISH_AT).remaining())
+        self.progress["pipeline"] = self.pipeline.stats_dict()
+
+        if not finished:
+            # 締め切り: 取得済みの見出しと完了した要約を公開し、残りはバックグラウンドで続ける
+            published = self.publish_pending()
+            print(f"Collect deadline reached: published {published} headlines without summaries")
+            return {
+                "status": "partial",
+                "date": self.today.isoformat(),
+                "articles_count": self.progress["saved"],
+                "headlines_changed": self.progress["changed"],
+                "pending_summaries": published,
+            }
+
+        self.refresh_digests()
+        self.close()
+        if self.pipeline.error is not None:
+            raise self.pipeline.error
+
+        if not self.progress["fetched"]:
+            return {
+                "status": "success",
+                "message": "No articles found",
+                "articles_count": 0,
+            }
+
+        return {
+            "status": "success",
+            "date": self.today.isoformat(),
+            "articles_count": self.progress["saved"],
+            "headlines_changed": self.progress["changed"],
+        }
+
+    def finish_in_background(self, run_id: int, durations: Dict[str, float]) -> None:
+        """途中で公開した収集処理の完了 (または打ち切り) を待ち、実行記録を更新する"""
+        if not self.pipeline.join(self.hard_deadline.remaining()):
+            print(f"Collect run {run_id} exceeded the background limit; cancelling")
+            self.pipeline.cancel()
+            self.pipeline.join()
+        self.progress["pipeline"] = self.pipeline.stats_dict()
+        try:
+            self.refresh_digests()
+        except Exception as e:
+            print(f"Error refreshing digests for collect run {run_id}: {e}")
+
+        with self.write_lock:
+            try:
+                run = self.writer.get(CollectRun, run_id)
+                if run is not None:
+                    _record_run(run, self, durations)
+                    run.status = "error" if self.pipeline.error is not None else "success"
+                    run.error = str(self.pipeline.error) if self.pipeline.error is not None else None
+                    self.writer.commit()
+                print(f"Collect run {run_id} finished in background: {self.progress['summarized']} summarized")
+            except Exception as e:
+                print(f"Error finishing collect run {run_id}: {e}")
+                self.writer.rollback()
+            finally:
+                self.writer.close()
+
+    # -------------------------------------------------
+    # パイプラインのステージ
+    # -------------------------------------------------
+
+    def fetch(self, job) -> List[ArticleRecord]:
+        # ソースのフィードごとに取得 (タイムアウト・失敗したソースは空として扱い、他のソースは続ける)
+        timeout = min(SOURCE_TIMEOUT_SECONDS, self.deadline.portion(FETCH_BUDGET).remaining())
+        articles = fetch_job(job, self.progress["sources"], timeout=timeout)
+        print(f"Fetched {len(articles)} articles from {job.key}")
+        return articles
+
+    def dedup(self, article: ArticleRecord) -> List[ArticleRecord]:
+        # 複数ソースに重複する記事と、その日に要約済みの記事を除く
+        article_id = article.article_id
+        with self.lock:
+            self.progress["fetched"] += 1
+            if article_id not in self.existing_ids:
+                self.progress["new"] += 1
+            if article_id in self.seen or article_id in self.summarized_ids:
+                return []
+            self.seen.add(article_id)
+        return [article]
+
+    def enrich(self, article: ArticleRecord) -> List[ArticleRecord]:
+        with self.lock:
+            self.pending[article.article_id] = article
+        if self.enricher is not None:
+            # 予算を過ぎた場合は、RSSのリンクと概要のまま次のステージに渡す
+            self.enricher.enrich(article, deadline=self.deadline.portion(ENRICH_BUDGET))
+        return [article]
+
+    def lookup_resolutions(self, urls: List[str]) -> Dict:
+        # リンクの解決結果のキャッシュを writer セッションで参照する (保存と同じロックで直列化する)
+        from enrich import load_resolutions
+
+        with self.write_lock:
+            return load_resolutions(self.writer, urls)
+
+    def save_resolutions(self) -> None:
+        # 新しく解決したリンクを保存する (write_lock を取得した状態で呼ぶ。commitは呼び出し元で行う)
+        if self.enricher is not None:
+            from enrich import save_resolutions
+
+            save_resolutions(self.writer, self.enricher.take_resolutions())
+
+    def summarize(self, batch: List[ArticleRecord]) -> List[ArticleRecord]:
+        # 1回のAPI呼び出しで複数記事をまとめて要約する (リトライ待ちは打ち切りの期限まで)
+        with observe_stage("summarize"):
+            summaries = self.summarizer.summarize_batch(batch, deadline=self.hard_deadline)
+        for i, article in enumerate(batch):
+            summary_text = ""
+            key_points = []
+            if i < len(summaries):
+                summary_item = summaries[i]
+                if isinstance(summary_item, dict):
+                    # 失敗した要約は保存せず、次回の収集で再要約する
+                    if not summary_item.get("error"):
+                        summary_text = summary_item.get("summary", "")
+                        key_points = summary_item.get("key_points") or []
+                else:
+                    summary_text = str(summary_item)
+            article.summary = summary_text
+            article.key_points = key_points
+        return batch
+
+    def persist(self, batch: List[ArticleRecord]) -> None:
+        # 記事を一括保存し、新規・変更された見出しだけをその日のダイジェストに反映する
+        headlines = [article.headline() for article in batch]
+        with self.write_lock:
+            try:
+                with observe_stage("persist"):
+                    upsert_articles(self.writer, batch)
+                    # ダイジェストのキャッシュ等はバッチごとではなく収集の終わりに1回だけ作り直す
+                    changed = merge_headlines(self.writer, self.today, headlines, defer_refresh=True)
+                    self.save_resolutions()
+                    # 要約できなかった記事はワークキューのワーカーに任せる
+                    enqueue(self.writer, KIND_ARTICLE, [a.article_id for a in batch if not a.summary])
+                    cancel(self.writer, KIND_ARTICLE, [a.article_id for a in batch if a.summary])
+                with observe_stage("commit"):
+                    self.writer.commit()
+            except Exception:
+                self.writer.rollback()
+                raise
+        mark_primary_write()
+        with self.lock:
+            for article in batch:
+                self.pending.pop(article.article_id, None)
+            self.progress["saved"] += len(batch)
+            self.progress["summarized"] += sum(1 for h in headlines if h["summary"])
+            self.progress["changed"] += len(changed)
+
+    def refresh_digests(self) -> None:
+        """保存したバッチで変更された日のダイジェストのキャッシュ等を作り直す"""
+        with self.write_lock:
+            try:
+                with observe_stage("refresh"):
+                    if refresh_stale_digests(self.writer):
+                        self.writer.commit()
+            except Exception:
+                self.writer.rollback()
+                raise
+
+    def publish_pending(self) -> int:
+        """まだ保存していない記事の見出しを要約なしで保存する (既存の要約は上書きしない)"""
+        with self.lock:
+            articles = [replace(a, summary="", key_points=None) for a in self.pending.values()]
+        if not articles:
+            return 0
+        with self.write_lock:
+            try:
+                with observe_stage("publish"):
+                    upsert_articles(self.writer, articles)
+                    merge_headlines(self.writer, self.today, [a.headline() for a in articles], defer_refresh=True)
+                    # 収集が中断されても要約されるよう、要約のない記事は同じトランザクションでワークキューに入れる
+                    # (収集が最後まで進めば、persist で要約できた記事はキューから外れる)
+                    ids = [a.article_id for a in articles]
+                    unsummarized = [
+                        row.article_id
+                        for row in self.writer.query(Article.article_id).filter(
+                            Article.article_id.in_(ids), or_(Article.summary.is_(None), Article.summary == ""),
+                        )
+                    ]
+                    enqueue(self.writer, KIND_ARTICLE, unsummarized)
+                    # 途中で公開する時点までに保存した見出しをキャッシュ等に反映する
+                    refresh_stale_digests(self.writer)
+                    self.save_resolutions()
+                    self.writer.commit()
+            except Exception:
+                self.writer.rollback()
+                raise
+        mark_primary_write()
+        return len(articles)
@@ -1,27 +1,66 @@
+import math
 import os
+import time
+import zlib
 from datetime import datetime
+from typing import Optional
 
 from sqlalchemy import (
     Column,
     Date,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    TypeDecorator,
+    UniqueConstraint,
     create_engine,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import Session, deferred, relationship, sessionmaker, validates
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://admin:password@db:5432/news_db")
+# 参照系 (GET) のリクエストに使う読み取り専用レプリカ (未設定の場合はプライマリを使う)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+# 書き込み後、この秒数はレプリカの遅延を避けてプライマリから読む
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+# 書き込み時刻のCookieで許容するワーカー間の時計のずれ (秒)
+CLOCK_SKEW_SECONDS = 5
 
 engine = create_engine(DATABASE_URL)
+read_engine = create_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 
+class CompressedText(TypeDecorator):
+    """zlibで圧縮して保存するテキスト (字幕など、大きく検索対象にならない本文用)"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zlib.compress(value.encode("utf-8"), 6)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return zlib.decompress(value).decode("utf-8")
+
+# このプロセスで最後に書き込みをcommitした時刻 (time.time())
+_last_write_at = 0.0
+
+
 class Channel(Base):
     __tablename__ = "channels"
     channel_id = Column(String, primary_key=True)
@@ -37,23 +76,56 @@ class Video(Base):
     youtube_id = Column(String, primary_key=True)
     title = Column(String, nullable=False)
     channel_id = Column(String, ForeignKey("channels.channel_id"))
-    transcript = Column(Text)
     summary = Column(Text)
     thumbnail_url = Column(String)
     published_at = Column(DateTime(timezone=True))
     status = Column(String, default="unprocessed")
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
+    # 一覧取得 (status == "processed" を公開日時の降順) 用の部分インデックス
+    __table_args__ = (
+        Index(
+            "ix_videos_processed_published",
+            published_at.desc(),
+            postgresql_where=status == "processed",
+            sqlite_where=status == "processed",
+        ),
+    )
+
     channel = relationship("Channel", back_populates="videos")
     key_points = relationship(
         "KeyPoint", back_populates="video", cascade="all, delete-orphan"
     )
+    # 字幕は別テーブルに圧縮して保存し、参照したときだけ読み込む (一覧取得では読み込まない)
+    transcript_record = relationship(
+        "VideoTranscript", uselist=False, back_populates="video", cascade="all, delete-orphan"
+    )
+    transcript = association_proxy(
+        "transcript_record", "text", creator=lambda text: VideoTranscript(text=text)
+    )
+
+
+class VideoTranscript(Base):
+    """YouTube動画の字幕 (zlib圧縮)"""
+
+    __tablename__ = "video_transcripts"
+    youtube_id = Column(String, ForeignKey("videos.youtube_id", ondelete="CASCADE"), primary_key=True)
+    text = Column(CompressedText)
+    original_size = Column(Integer)  # 圧縮前のバイト数
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+    video = relationship("Video", back_populates="transcript_record")
+
+    @validates("text")
+    def _record_size(self, key, value):
+        self.original_size = len(value.encode("utf-8")) if value else 0
+        return value
 
 
 class KeyPoint(Base):
     __tablename__ = "key_points"
     id = Column(Integer, primary_key=True, index=True)
-    youtube_id = Column(String, ForeignKey("videos.youtube_id"))
+    youtube_id = Column(String, ForeignKey("videos.youtube_id"), index=True)
     point = Column(Text, nullable=False)
 
     video = relationship("Video", back_populates="key_points")
@@ -72,7 +144,7 @@ class Article(Base):
     title = Column(String, nullable=False)
     link = Column(String, nullable=False)
     description = Column(Text)  # RSSのdescription (概要)
-    content = Column(Text)  # 記事本文 (スクレイピングで取得)
+    content = deferred(Column(Text))  # 記事本文 (スクレイピングで取得、参照したときだけ読み込む)
     summary = Column(Text)  # Geminiによる要約
     category = Column(String)  # ニュースカテゴリ
     source = Column(String, default="NHK")  # ニュースソース
@@ -80,6 +152,16 @@ class Article(Base):
     status = Column(String, default="unprocessed")
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
 
+    # 一覧取得 (status == "processed" を公開日時の降順) 用の部分インデックス
+    __table_args__ = (
+        Index(
+            "ix_articles_processed_published",
+            published_at.desc(),
+            postgresql_where=status == "processed",
+            sqlite_where=status == "processed",
+        ),
+    )
+
     key_points = relationship(
         "ArticleKeyPoint", back_populates="article", cascade="all, delete-orphan"
     )
@@ -90,12 +172,21 @@ class ArticleKeyPoint(Base):
 
     __tablename__ = "article_key_points"
     id = Column(Integer, primary_key=True, index=True)
-    article_id = Column(String, ForeignKey("articles.article_id"))
+    article_id = Column(String, ForeignKey("articles.article_id"), index=True)
     point = Column(Text, nullable=False)
 
     article = relationship("Article", back_populates="key_points")
 
 
+class ResolvedUrl(Base):
+    """Google Newsのリダイレクト用URLと、転送先 (配信元の記事ページ) の対応のキャッシュ"""
+
+    __tablename__ = "resolved_urls"
+    url = Column(String, primary_key=True)
+    resolved_url = Column(String)  # 解決できなかった場合はNULL (期限が過ぎたら再試行する)
+    resolved_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+
 # =====================================================
 # 日別ダイジェスト用モデル
 # =====================================================
@@ -112,9 +203,260 @@ class DailyDigest(Base):
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class DigestHeadline(Base):
+    """
+    日別ダイジェストの見出し (1記事1行)。
+    収集のたびに (日付, 記事ID) で差分だけを書き込み、その日の全ての収集結果の和集合をダイジェストとする。
+    DailyDigest.headlines はこのテーブルから再構築するキャッシュ。
+    """
+
+    __tablename__ = "digest_headlines"
+    __table_args__ = (UniqueConstraint("date", "article_id", name="uq_digest_headlines_date_article"),)
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, nullable=False)
+    article_id = Column(String, nullable=False)  # ソースごとの安定した記事ID
+    title = Column(String, nullable=False)
+    summary = Column(Text)
+    link = Column(String)
+    source = Column(String)
+    topic = Column(String)
+    published_at = Column(DateTime(timezone=True))
+    first_seen_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+class TopicDigest(Base):
+    """
+    日別ダイジェストをトピック・ソースごとに分けたもの (日別ダイジェストの更新時に再構築する)。
+    トピックやソースで絞り込んだ表示は、その日の全見出しではなくこの1行を読む。
+    """
+
+    __tablename__ = "topic_digests"
+    __table_args__ = (UniqueConstraint("date", "facet", "value", name="uq_topic_digests_date_facet_value"),)
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, nullable=False)
+    facet = Column(String, nullable=False)  # "topic" または "source"
+    value = Column(String, nullable=False)  # 例: "business", "NHK"
+    headlines = Column(JSONB, nullable=False)  # DailyDigest.headlines と同じ形式
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DigestRollup(Base):
+    """週・月単位のダイジェスト (日別ダイジェストの更新時に差分で再構築する)"""
+
+    __tablename__ = "digest_rollups"
+    __table_args__ = (UniqueConstraint("period", "period_start", name="uq_digest_rollups_period"),)
+    id = Column(Integer, primary_key=True, index=True)
+    period = Column(String, nullable=False)  # "week" (月曜始まり) または "month"
+    period_start = Column(Date, nullable=False)
+    days = Column(JSONB, nullable=False)  # {"YYYY-MM-DD": [{title, summary, link, source}, ...], ...}
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# =====================================================
+# 全文検索用モデル (文字bigramの転置インデックス)
+# =====================================================
+
+
+class SearchDocument(Base):
+    """検索対象の文書 (ダイジェストの見出し、または記事)"""
+
+    __tablename__ = "search_documents"
+    id = Column(Integer, primary_key=True, index=True)
+    doc_key = Column(String, unique=True, nullable=False)  # 例: "headline:2026-01-05:<hash>", "article:<article_id>"
+    kind = Column(String, nullable=False)  # "headline" または "article"
+    date = Column(Date, index=True)
+    title = Column(String, nullable=False)
+    summary = Column(Text)
+    link = Column(String)
+    source = Column(String)
+    published_at = Column(DateTime(timezone=True))
+
+
+class SearchPosting(Base):
+    """転置インデックスのポスティング (語 → 文書と重み)"""
+
+    __tablename__ = "search_postings"
+    term = Column(String, primary_key=True)
+    document_id = Column(Integer, ForeignKey("search_documents.id", ondelete="CASCADE"), primary_key=True, index=True)
+    weight = Column(Float, nullable=False)  # タイトル中の出現は重み付けして加算
+
+
+# =====================================================
+# スケジューラ用モデル
+# =====================================================
+
+
+class FeedPollState(Base):
+    """フィードごとのポーリング状態 (適応的な間隔と変更検知用の情報)"""
+
+    __tablename__ = "feed_poll_states"
+    feed_key = Column(String, primary_key=True)  # 例: "google:top", "nhk:main", "youtube:UC..."
+    interval_seconds = Column(Integer, nullable=False)  # 現在のポーリング間隔
+    avg_change_interval = Column(Float)  # 観測した更新間隔の指数移動平均 (秒)
+    fingerprint = Column(String)  # 前回取得時のエントリ一覧のハッシュ
+    etag = Column(String)
+    last_modified = Column(String)
+    unchanged_count = Column(Integer, default=0)  # 連続で変更がなかった回数
+    last_checked_at = Column(DateTime(timezone=True))
+    last_changed_at = Column(DateTime(timezone=True))
+
+
+class UpstreamBreaker(Base):
+    """
+    取得先のホストごとのサーキットブレーカーの状態 (breaker.py)。
+    全ワーカーで共有し、どのワーカーで失敗が続いても全ワーカーで呼び出しを止める。
+    """
+
+    __tablename__ = "upstream_breakers"
+    host = Column(String, primary_key=True)  # 例: "news.google.com"
+    state = Column(String, nullable=False, default="closed")  # closed, open, half_open
+    window_started_at = Column(DateTime(timezone=True))  # 失敗率を数えている区間の開始時刻
+    calls = Column(Integer, default=0)  # 区間内の呼び出し数
+    failures = Column(Integer, default=0)  # 区間内の失敗数
+    consecutive_failures = Column(Integer, default=0)
+    open_count = Column(Integer, default=0)  # 続けて open になった回数 (open の時間を延ばす)
+    opened_at = Column(DateTime(timezone=True))
+    open_until = Column(DateTime(timezone=True))  # これを過ぎたら1回だけ試しに呼び出す (half_open)
+    probe_started_at = Column(DateTime(timezone=True))  # half_open の試しの呼び出しを始めた時刻
+    last_error = Column(Text)
+    updated_at = Column(DateTime(timezone=True))
+
+
+# =====================================================
+# 収集処理の実行記録
+# =====================================================
+
+
+class CollectRun(Base):
+    """収集処理1回ごとの実行記録 (所要時間、件数、Gemini APIの呼び出し回数とトークン数)"""
+
+    __tablename__ = "collect_runs"
+    id = Column(Integer, primary_key=True, index=True)
+    trigger = Column(String, nullable=False)  # "api" または "scheduler"
+    status = Column(String, nullable=False, default="running")  # running, success, error
+    started_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    finished_at = Column(DateTime(timezone=True))
+    stage_durations = Column(JSONB)  # {"fetch": 1.2, "parse": 0.1, "summarize": 8.5, ...} (秒)
+    pipeline_stats = Column(JSONB)  # パイプラインのステージごとの処理件数・稼働率 (pipeline.StageStats)
+    source_stats = Column(JSONB)  # フィードごとの取得結果 {"nhk:main": {"status": "ok", "articles": 5, ...}}
+    articles_fetched = Column(Integer, default=0)
+    articles_new = Column(Integer, default=0)  # その日のダイジェストに含まれていなかった記事数
+    articles_summarized = Column(Integer, default=0)
+    gemini_calls = Column(Integer, default=0)
+    input_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    input_tokens_saved = Column(Integer, default=0)  # バッチ要約の入力の整形で減らしたトークン数 (見積もり)
+    error = Column(Text)
+
+
+# =====================================================
+# 要約のワークキュー
+# =====================================================
+
+
+class WorkItem(Base):
+    """
+    記事・動画1件ごとの要約の作業 (work_queue.py)。
+    ワーカーは SELECT ... FOR UPDATE SKIP LOCKED で取得し、リース期限までに完了させる。
+    """
+
+    __tablename__ = "work_items"
+    __table_args__ = (
+        UniqueConstraint("kind", "target_id", name="uq_work_items_kind_target"),
+        # 取得 (status, available_at の順) 用
+        Index("ix_work_items_status_available", "status", "available_at"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # "article" または "video"
+    target_id = Column(String, nullable=False)  # article_id または youtube_id
+    status = Column(String, nullable=False, default="pending")  # pending, running, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    available_at = Column(DateTime(timezone=True), nullable=False)  # この時刻以降に取得できる (リトライの待ち)
+    locked_by = Column(String)  # 処理中のワーカー
+    lease_expires_at = Column(DateTime(timezone=True))  # 過ぎたら他のワーカーが取得し直す
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+
+class SummaryBatchJob(Base):
+    """
+    Gemini のバッチインターフェースに投入した要約のジョブ (batch_jobs.py)。
+    リクエストのキーと対象の記事・動画の対応を保存し、完了したら結果を1回だけ取り込む。
+    """
+
+    __tablename__ = "summary_batch_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True)  # 提供側のジョブ名 (例: "batches/abc123")。投入前は空
+    backend = Column(String, nullable=False)  # "gemini" または "local" (テスト用)
+    model = Column(String, nullable=False)
+    state = Column(String, nullable=False, default="created", index=True)  # created, submitted, succeeded, failed, ingested
+    requests = Column(JSONB, nullable=False)  # {"article-1": {"kind": "article", "ids": [...]}, ...}
+    request_count = Column(Integer, default=0)
+    summarized = Column(Integer, default=0)  # 取り込んだ記事・動画の数
+    failed = Column(Integer, default=0)  # 要約できなかった記事・動画の数
+    input_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    submitted_at = Column(DateTime(timezone=True))
+    completed_at = Column(DateTime(timezone=True))  # 提供側でジョブが終わった時刻 (を検知した時刻)
+    ingested_at = Column(DateTime(timezone=True))
+
+def dialect_insert(db):
+    """
+    接続先のDBに対応した INSERT 文のコンストラクタを返す。
+    PostgreSQLとSQLiteはどちらも ON CONFLICT (upsert) に対応している。
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+def mark_primary_write() -> float:
+    """
+    プライマリへの書き込み (収集処理のcommit) を記録する。
+    以後 READ_YOUR_WRITES_SECONDS の間、このプロセスの参照系リクエストはプライマリから読む。
+
+    Returns:
+        記録した時刻 (クライアントのCookieに設定する)
+    """
+    global _last_write_at
+    _last_write_at = time.time()
+    return _last_write_at
+
+
+def _recently_written(client_written_at: Optional[str]) -> bool:
+    now = time.time()
+    if now - _last_write_at < READ_YOUR_WRITES_SECONDS:
+        return True
+    # 他のワーカーで書き込んだクライアントは、クライアントから送られた書き込み時刻で判定する
+    try:
+        written_at = float(client_written_at or 0)
+    except ValueError:
+        return False
+    # 未来の時刻 (inf など) でクライアントがプライマリに固定されないよう、時計のずれを超える値は無視する
+    if not math.isfinite(written_at) or written_at > now + CLOCK_SKEW_SECONDS:
+        return False
+    return now - written_at < READ_YOUR_WRITES_SECONDS
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def read_session(client_written_at: Optional[str] = None) -> Session:
+    """
+    参照系のセッションを作る。
+    レプリカが設定されていればレプリカを使い、直後の書き込みが見えない可能性がある間はプライマリを使う。
+    client_written_at はクライアントが最後に書き込んだ時刻 (UNIX時間の文字列、main.py ではCookieの値)。
+    """
+    if read_engine is engine or _recently_written(client_written_at):
+        return SessionLocal()
+    return ReadSessionLocal()
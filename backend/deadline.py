@@ -0,0 +1,32 @@
+"""
+収集処理の締め切り
+
+収集1回あたりの時間予算を表し、各段階 (取得、要約、公開) に割り振る。
+Gemini APIのリトライ待ちやHTTPタイムアウトも残り時間を超えないようにする。
+"""
+
+import time
+from typing import Optional
+
+
+class Deadline:
+    """開始時刻から seconds 秒後を期限とする締め切り (time.monotonic 基準)"""
+
+    def __init__(self, seconds: float, start: Optional[float] = None):
+        self.start = time.monotonic() if start is None else start
+        self.seconds = seconds
+        self.at = self.start + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def portion(self, fraction: float) -> "Deadline":
+        """同じ開始時刻から、全体の fraction 倍の時間を期限とする締め切り (段階ごとの予算)"""
+        return Deadline(self.seconds * fraction, start=self.start)
+
+    def extend(self, factor: float) -> "Deadline":
+        """同じ開始時刻から、全体の factor 倍の時間を期限とする締め切り"""
+        return Deadline(self.seconds * factor, start=self.start)
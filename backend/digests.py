@@ -0,0 +1,298 @@
+"""
+日別ダイジェストと週・月ロールアップの保存処理
+
+見出しは (日付, 記事ID) ごとに digest_headlines テーブルへ差分だけを書き込み、
+その日の全ての収集結果の和集合を日別ダイジェストとする。
+新規・変更された見出しがあった場合のみ、検索インデックスを更新して変更された見出しをSSEのクライアントに通知し (events.py)、
+DailyDigest.headlines (キャッシュ)、トピック・ソースごとのダイジェスト、その日を含む週・月のロールアップを作り直す。
+commit後には、その日のダイジェストを nginx が直接返す静的ファイルとして書き出す (snapshots.py)。
+少しずつ何度も保存する収集処理は、キャッシュ等の作り直しを refresh_stale_digests で収集の終わりにまとめて行う
+(defer_refresh=True)。ロールアップはその日の分だけをDB側で差し替える。
+「今週」「今月」やトピックで絞り込んだ表示は1行の読み取りで済む。
+"""
+
+import hashlib
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import DailyDigest, DigestHeadline, DigestRollup, TopicDigest, dialect_insert
+from events import notify_digest_update
+from search import index_headlines
+from snapshots import schedule_snapshot
+
+ROLLUP_PERIODS = ("week", "month")
+# キャッシュ等の作り直しを後回しにした日付 (Session.info のキー)
+_STALE_KEY = "stale_digest_days"
+# 日別ダイジェストを分ける見出しの項目
+TOPIC_FACETS = ("topic", "source")
+
+# 変更の有無を比較する見出しの列
+HEADLINE_FIELDS = ("title", "summary", "link", "source", "topic", "published_at")
+
+
+def period_bounds(period: str, day: date) -> Tuple[date, date]:
+    """指定日を含む期間の開始日と終了日を返す (週は月曜始まり)"""
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if period == "month":
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    raise ValueError(f"Unknown rollup period: {period}")
+
+
+def headline_id(headline: Dict) -> str:
+    """見出しの安定したID (記事IDがなければリンクまたはタイトルのハッシュ)"""
+    if headline.get("article_id"):
+        return headline["article_id"]
+    ident = headline.get("link") or headline.get("title", "")
+    return f"h_{hashlib.sha1(ident.encode()).hexdigest()[:16]}"
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """比較用にUTCのnaiveな日時へ揃える (SQLiteはタイムゾーンを保持しないため)"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _headline_values(headline: Dict) -> Dict:
+    return {
+        "title": headline.get("title", ""),
+        "summary": headline.get("summary") or "",
+        "link": headline.get("link", ""),
+        "source": headline.get("source"),
+        "topic": headline.get("topic"),
+        "published_at": _parse_datetime(headline.get("published_at")),
+    }
+
+
+def _is_unchanged(row: DigestHeadline, values: Dict) -> bool:
+    for field in HEADLINE_FIELDS:
+        current = getattr(row, field)
+        if field == "published_at":
+            if _utc_naive(current) != _utc_naive(values[field]):
+                return False
+        elif (current or "") != (values[field] or ""):
+            return False
+    return True
+
+
+def headline_to_dict(row: DigestHeadline) -> Dict:
+    return {
+        "article_id": row.article_id,
+        "title": row.title,
+        "summary": row.summary or "",
+        "link": row.link or "",
+        "source": row.source,
+        "topic": row.topic,
+        "published_at": row.published_at.isoformat() if row.published_at else None,
+    }
+
+
+def merge_headlines(db: Session, day: date, headlines: List[Dict], defer_refresh: bool = False) -> List[Dict]:
+    """
+    見出しをその日のダイジェストに差分で追加・更新する。
+    以前の収集で保存した見出しは残し、新規または内容が変わった見出しだけを書き込む。
+    要約が空の見出しは、既に保存されている要約を上書きしない。
+    defer_refresh=True の場合、キャッシュ等は作り直さず、refresh_stale_digests の呼び出しまで後回しにする。
+    commitは呼び出し元で行う。
+
+    Returns:
+        新規または更新された見出しのリスト (変更がなければ空で、キャッシュ等も更新しない)
+    """
+    incoming = {}
+    for headline in headlines:
+        incoming[headline_id(headline)] = headline
+    if not incoming:
+        return []
+
+    existing = {
+        row.article_id: row
+        for row in db.query(DigestHeadline)
+        .filter(DigestHeadline.date == day, DigestHeadline.article_id.in_(list(incoming)))
+        .all()
+    }
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    for article_id, headline in incoming.items():
+        values = _headline_values(headline)
+        row = existing.get(article_id)
+        if row is not None:
+            if not values["summary"]:
+                values["summary"] = row.summary or ""
+            if _is_unchanged(row, values):
+                continue
+        rows.append({"date": day, "article_id": article_id, "first_seen_at": now, "updated_at": now, **values})
+
+    if not rows:
+        return []
+
+    stmt = dialect_insert(db)(DigestHeadline).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["date", "article_id"],
+        set_={
+            "title": stmt.excluded.title,
+            # 並行する収集処理が先に要約を書き込んでいた場合も、空の要約で上書きしない
+            "summary": func.coalesce(func.nullif(stmt.excluded.summary, ""), DigestHeadline.summary),
+            "link": stmt.excluded.link,
+            "source": stmt.excluded.source,
+            "topic": stmt.excluded.topic,
+            "published_at": stmt.excluded.published_at,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
+
+    changed = [
+        {
+            "article_id": r["article_id"],
+            "title": r["title"],
+            "summary": r["summary"],
+            "link": r["link"],
+            "source": r["source"],
+            "topic": r["topic"],
+            "published_at": r["published_at"].isoformat() if r["published_at"] else None,
+        }
+        for r in rows
+    ]
+    if defer_refresh:
+        db.info.setdefault(_STALE_KEY, set()).add(day)
+    else:
+        refresh_digest_cache(db, day)
+    index_headlines(db, day, changed)
+    notify_digest_update(db, day, changed)
+    return changed
+
+
+def refresh_digest_cache(db: Session, day: date) -> DailyDigest:
+    """
+    見出しの行からその日の DailyDigest.headlines を作り直し、週・月ロールアップにも反映する。
+    commitは呼び出し元で行う。
+    """
+    rows = (
+        db.query(DigestHeadline)
+        .filter(DigestHeadline.date == day)
+        .order_by(DigestHeadline.published_at.desc().nulls_last(), DigestHeadline.id)
+        # upsertはセッションを経由しないため、読み込み済みのオブジェクトも最新の値で上書きする
+        .populate_existing()
+        .all()
+    )
+    headlines = [headline_to_dict(row) for row in rows]
+
+    updated_at = datetime.utcnow()
+    digest = db.query(DailyDigest).filter(DailyDigest.date == day).first()
+    if digest:
+        digest.headlines = headlines
+        digest.updated_at = updated_at
+    else:
+        digest = DailyDigest(date=day, headlines=headlines, updated_at=updated_at)
+        db.add(digest)
+
+    # commit後に nginx が直接返す静的ファイルを書き出す
+    schedule_snapshot(db, day, headlines, updated_at)
+    update_topic_digests(db, day, headlines)
+    update_rollups(db, day, headlines)
+    return digest
+
+
+def refresh_stale_digests(db: Session) -> int:
+    """
+    merge_headlines(defer_refresh=True) で後回しにした日のキャッシュ等を作り直す。
+    commitは呼び出し元で行う。
+
+    Returns:
+        作り直した日数
+    """
+    days = db.info.pop(_STALE_KEY, set())
+    for day in sorted(days):
+        refresh_digest_cache(db, day)
+    return len(days)
+
+
+def split_by_facet(headlines: List[Dict]) -> Dict[Tuple[str, str], List[Dict]]:
+    """見出しを (項目, 値) ごとに分ける (値のない見出しはその項目に含めない)。見出しの順序は保つ"""
+    groups: Dict[Tuple[str, str], List[Dict]] = {}
+    for headline in headlines:
+        for facet in TOPIC_FACETS:
+            value = headline.get(facet)
+            if value:
+                groups.setdefault((facet, value), []).append(headline)
+    return groups
+
+
+def update_topic_digests(db: Session, day: date, headlines: List[Dict]) -> None:
+    """指定日のトピック・ソースごとのダイジェストを、内容が変わった分だけ書き換える"""
+    groups = split_by_facet(headlines)
+    existing = {
+        (row.facet, row.value): row
+        for row in db.query(TopicDigest).filter(TopicDigest.date == day).all()
+    }
+    for key, group in groups.items():
+        row = existing.pop(key, None)
+        if row is None:
+            db.add(TopicDigest(date=day, facet=key[0], value=key[1], headlines=group))
+        elif row.headlines != group:
+            row.headlines = group
+            row.updated_at = datetime.utcnow()
+    # 見出しがなくなったトピック・ソース
+    for row in existing.values():
+        db.delete(row)
+
+
+def update_rollups(db: Session, day: date, headlines: List[Dict]) -> None:
+    """
+    指定日を含む各ロールアップ行の、その日の分だけを差し替える。
+    期間全体のJSONを読み書きせず、その日の分だけをDB側でマージする (PostgreSQLは ||、SQLiteは json_patch)。
+    """
+    now = datetime.now(timezone.utc)
+    for period in ROLLUP_PERIODS:
+        start, _ = period_bounds(period, day)
+        stmt = dialect_insert(db)(DigestRollup).values(
+            period=period, period_start=start, days={day.isoformat(): headlines}, updated_at=now
+        )
+        if db.get_bind().dialect.name == "sqlite":
+            merged = func.json_patch(DigestRollup.days, stmt.excluded.days)
+        else:
+            merged = DigestRollup.days.op("||")(stmt.excluded.days)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["period", "period_start"],
+            set_={"days": merged, "updated_at": stmt.excluded.updated_at},
+        )
+        db.execute(stmt)
+
+
+def rebuild_rollups(db: Session, start: date, end: date) -> int:
+    """
+    期間内の日別ダイジェストからトピック・ソースごとのダイジェストとロールアップを作り直す (過去分の補完用)。
+    commitは呼び出し元で行う。
+
+    Returns:
+        反映した日別ダイジェストの件数
+    """
+    digests = (
+        db.query(DailyDigest)
+        .filter(DailyDigest.date.between(start, end))
+        .order_by(DailyDigest.date)
+        .all()
+    )
+    for digest in digests:
+        update_topic_digests(db, digest.date, digest.headlines)
+        update_rollups(db, digest.date, digest.headlines)
+    return len(digests)
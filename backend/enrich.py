@@ -0,0 +1,296 @@
+"""
+記事の補完 (リンクの解決と本文の抽出)
+
+Google News RSS の link は news.google.com/rss/articles/... のリダイレクト用URLのため、
+転送先 (配信元の記事ページ) を解決して直接のリンクに置き換える。解決結果は resolved_urls テーブルに
+キャッシュし、同じ記事を次回以降の収集で解決し直さない。
+配信元のページからは lxml で本文を抽出し、RSSの短い概要の代わりに要約の入力にする。
+
+収集パイプラインの enrich ステージで複数スレッドから呼ばれるため、同じドメインへのリクエストは
+ドメインごとの最小間隔 (ENRICH_DOMAIN_INTERVAL) を空けて送る。
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from lxml import etree, html as lxml_html
+from sqlalchemy.orm import Session
+
+from breaker import breakers
+from database import ResolvedUrl, dialect_insert
+from deadline import Deadline
+from metrics import ENRICH_TOTAL, observe_stage
+from records import ArticleRecord
+
+# 1リクエストのタイムアウト秒数
+REQUEST_TIMEOUT = float(os.getenv("ENRICH_REQUEST_TIMEOUT", "8"))
+# 同じドメインへのリクエストの最小間隔 (秒)
+DOMAIN_INTERVAL = float(os.getenv("ENRICH_DOMAIN_INTERVAL", "0.5"))
+# 保存する本文の最大文字数
+MAX_CONTENT_CHARS = 4000
+# 本文として扱う段落の最小文字数 (メニューやキャプションを除く)
+MIN_PARAGRAPH_CHARS = 20
+# 解決できなかったURLを再試行するまでの時間
+RETRY_UNRESOLVED_AFTER = timedelta(hours=24)
+
+GOOGLE_NEWS_HOST = "news.google.com"
+
+# 本文ではない要素
+_NOISE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "figure"]
+_WHITESPACE_RE = re.compile(r"\s+")
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.IGNORECASE)
+
+
+def is_redirect_link(url: str) -> bool:
+    """Google Newsのリダイレクト用URLか"""
+    parts = urlsplit(url or "")
+    return parts.hostname == GOOGLE_NEWS_HOST and "/articles/" in parts.path
+
+
+class DomainRateLimiter:
+    """ドメインごとにリクエストの間隔を空ける (複数スレッドから呼ばれる)"""
+
+    def __init__(self, interval: float = DOMAIN_INTERVAL):
+        self.interval = interval
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, domain: str, max_wait: Optional[float] = None) -> bool:
+        """
+        domain へのリクエストの順番が来るまで待つ。
+        待ち時間が max_wait を超える場合は待たずに False を返す (順番も確保しない)。
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(domain, 0.0))
+            if max_wait is not None and slot - now > max_wait:
+                return False
+            self._next[domain] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+def _parse_html(content, encoding: Optional[str] = None):
+    """
+    HTMLを解析する。文字コードはレスポンスヘッダ (encoding)、<meta charset> の順に使い、
+    どちらもない場合はUTF-8とみなす (lxmlの既定のLatin-1では日本語のページが文字化けする)。
+    """
+    if isinstance(content, bytes):
+        if encoding:
+            content = content.decode(encoding, errors="replace")
+        elif not _META_CHARSET_RE.search(content[:4096]):
+            content = content.decode("utf-8", errors="replace")
+    try:
+        return lxml_html.fromstring(content)
+    except (etree.ParserError, LookupError, ValueError):
+        return None
+
+
+def _response_encoding(response) -> Optional[str]:
+    """Content-Type ヘッダで文字コードが指定されている場合だけ返す"""
+    content_type = getattr(response, "headers", {}).get("Content-Type", "")
+    return response.encoding if "charset=" in content_type.lower() else None
+
+
+def extract_text(content, encoding: Optional[str] = None) -> str:
+    """
+    記事ページのHTMLから本文を抽出する。
+    <article> があればその中から、なければ段落の文字数が最も多い要素から、一定以上の長さの段落を集める。
+    """
+    doc = _parse_html(content, encoding)
+    if doc is None:
+        return ""
+    etree.strip_elements(doc, *_NOISE_TAGS, with_tail=False)
+
+    candidates = doc.xpath("//article") or _densest_containers(doc)
+    best = ""
+    for node in candidates:
+        paragraphs = [_clean(p.text_content()) for p in node.iter("p")]
+        text = "\n".join(p for p in paragraphs if len(p) >= MIN_PARAGRAPH_CHARS)
+        if len(text) > len(best):
+            best = text
+    return best[:MAX_CONTENT_CHARS]
+
+
+def _densest_containers(doc) -> List:
+    """段落の文字数の合計が最も多い親要素"""
+    totals: Dict = {}
+    for p in doc.iter("p"):
+        parent = p.getparent()
+        if parent is not None:
+            totals[parent] = totals.get(parent, 0) + len(_clean(p.text_content()))
+    if not totals:
+        return []
+    return [max(totals, key=totals.get)]
+
+
+def _clean(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def _find_redirect_target(content, base_url: str) -> Optional[str]:
+    """
+    HTTPで転送されなかった場合に、ページ内の meta refresh か canonical / og:url から転送先を探す。
+    ページ内の任意のリンクは転送先とは限らない (ヘルプやプライバシーのページなど) ため使わず、
+    見つからない場合は None (解決できなかったものとして RETRY_UNRESOLVED_AFTER 後に再試行する) を返す。
+    """
+    doc = _parse_html(content)
+    if doc is None:
+        return None
+    targets = []
+    for refresh in doc.xpath("//meta[translate(@http-equiv, 'REFRESH', 'refresh')='refresh']/@content"):
+        _, _, target = refresh.partition("url=")
+        targets.append(target.strip("'\" "))
+    targets += doc.xpath("//link[@rel='canonical']/@href")
+    targets += doc.xpath("//meta[@property='og:url']/@content")
+    for target in targets:
+        target = urljoin(base_url, target)
+        host = urlsplit(target).hostname or ""
+        if target.startswith("http") and not host.endswith("google.com"):
+            return target
+    return None
+
+
+def load_resolutions(db: Session, urls: List[str]) -> Dict[str, Optional[str]]:
+    """
+    キャッシュ済みの解決結果を返す。
+    解決できなかったURLは RETRY_UNRESOLVED_AFTER を過ぎるまで失敗 (None) として返し、過ぎたら含めない。
+    """
+    if not urls:
+        return {}
+    retry_before = datetime.now(timezone.utc) - RETRY_UNRESOLVED_AFTER
+    resolutions = {}
+    for row in db.query(ResolvedUrl).filter(ResolvedUrl.url.in_(urls)):
+        resolved_at = row.resolved_at
+        if resolved_at is not None and resolved_at.tzinfo is None:
+            resolved_at = resolved_at.replace(tzinfo=timezone.utc)
+        if row.resolved_url or (resolved_at and resolved_at > retry_before):
+            resolutions[row.url] = row.resolved_url
+    return resolutions
+
+
+def save_resolutions(db: Session, resolutions: Dict[str, Optional[str]]) -> None:
+    """解決結果をキャッシュに保存する (既存の結果は置き換える)。commitは呼び出し元で行う。"""
+    if not resolutions:
+        return
+    now = datetime.now(timezone.utc)
+    stmt = dialect_insert(db)(ResolvedUrl).values(
+        [{"url": url, "resolved_url": target, "resolved_at": now} for url, target in resolutions.items()]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ResolvedUrl.url],
+        set_={"resolved_url": stmt.excluded.resolved_url, "resolved_at": stmt.excluded.resolved_at},
+    )
+    db.execute(stmt)
+
+
+class Enricher:
+    """
+    記事のリンクを解決し、本文を抽出する。
+
+    キャッシュの参照は lookup (URLのリストを受け取り、load_resolutions と同じ形式で返す) で行い、
+    新しく解決した結果は take_resolutions で取り出して呼び出し元が保存する
+    (DBセッションをスレッド間で共有しないため)。
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[List[str]], Dict[str, Optional[str]]],
+        limiter: Optional[DomainRateLimiter] = None,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.lookup = lookup
+        self.limiter = limiter or DomainRateLimiter()
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                          "AppleWebKit/537.36 (KHTML, like Gecko) "
+                          "Chrome/120.0.0.0 Safari/537.36"
+        })
+        self._resolved: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def take_resolutions(self) -> Dict[str, Optional[str]]:
+        """前回の呼び出し以降に新しく解決した結果を返す"""
+        with self._lock:
+            resolved, self._resolved = self._resolved, {}
+        return resolved
+
+    def enrich(self, article: ArticleRecord, deadline: Optional[Deadline] = None) -> ArticleRecord:
+        """
+        記事のリンクを転送先に置き換え、本文を content に入れる。
+        失敗・時間切れの場合は、その時点までの内容で記事をそのまま返す。
+        """
+        link = article.link or ""
+        page = None
+        if is_redirect_link(link):
+            target, page = self._resolve(link, deadline)
+            if not target:
+                return article
+            article.link = target
+
+        if article.content or article.source == "YouTube":
+            return article
+        if page is None:
+            page = self._get(article.link, deadline)
+        if page is None:
+            ENRICH_TOTAL.labels(step="extract", outcome="skipped").inc()
+            return article
+
+        with observe_stage("extract"):
+            content = extract_text(page.content, _response_encoding(page))
+        ENRICH_TOTAL.labels(step="extract", outcome="ok" if content else "failed").inc()
+        if content:
+            article.content = content
+        return article
+
+    def _resolve(self, link: str, deadline: Optional[Deadline]) -> Tuple[Optional[str], Optional[requests.Response]]:
+        """リダイレクト用URLの転送先と、HTTPで転送された場合はその記事ページを返す"""
+        cached = self.lookup([link])
+        if link in cached:
+            ENRICH_TOTAL.labels(step="resolve", outcome="cached").inc()
+            return cached[link], None
+
+        page = self._get(link, deadline)
+        if page is None:
+            # 時間切れの場合はキャッシュせず、次回の収集で解決する
+            ENRICH_TOTAL.labels(step="resolve", outcome="skipped").inc()
+            return None, None
+
+        if urlsplit(page.url).hostname != GOOGLE_NEWS_HOST:
+            target = page.url
+        else:
+            target = _find_redirect_target(page.content, page.url)
+            page = None
+        ENRICH_TOTAL.labels(step="resolve", outcome="ok" if target else "failed").inc()
+        with self._lock:
+            self._resolved[link] = target
+        return target, page
+
+    def _get(self, url: str, deadline: Optional[Deadline]) -> Optional[requests.Response]:
+        """ドメインごとの間隔と締め切りを守ってページを取得する (取得できない場合は None)"""
+        timeout = self.timeout
+        max_wait = None
+        if deadline is not None:
+            max_wait = deadline.remaining() - 1.0
+            timeout = min(timeout, deadline.remaining())
+            if max_wait < 0:
+                return None
+        if not self.limiter.wait(urlsplit(url).hostname or "", max_wait):
+            return None
+        try:
+            with observe_stage("enrich"), breakers.guard(url):
+                response = self.session.get(url, timeout=timeout, allow_redirects=True)
+                response.raise_for_status()
+            return response
+        except Exception as e:
+            print(f"Error enriching {url}: {e}")
+            return None
@@ -0,0 +1,209 @@
+"""
+ダイジェスト更新の通知 (Server-Sent Events 用)
+
+日別ダイジェストの見出しが追加・更新されると、変更された見出しだけを通知する。
+PostgreSQLでは見出しを書き込むトランザクションの中で NOTIFY を送り (commitされた場合だけ届く)、
+各ワーカーが1本の LISTEN 用接続で受け取って、そのワーカーに接続中のクライアントへ配る。
+gunicorn の複数ワーカーのどれが書き込んでも、全ワーカーのクライアントに届く。
+PostgreSQL以外 (テスト用のSQLite) では、commit後に同じプロセス内のクライアントにだけ配る。
+
+LISTEN 用の接続は、最初のクライアントが接続したときに開く (SSEを使わないワーカーは接続を持たない)。
+"""
+
+import asyncio
+import json
+import os
+import select
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+CHANNEL = "digest_updates"
+# NOTIFYのペイロードの上限 (PostgreSQLの既定は8000バイト)
+MAX_PAYLOAD_BYTES = 7500
+# クライアントごとに溜めておく通知の上限 (超えたらクライアントに再取得を求める)
+SUBSCRIBER_QUEUE_SIZE = 100
+# 1ワーカーあたりの同時接続数の上限
+MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_CLIENTS", "1000"))
+
+_PENDING_KEY = "pending_digest_events"
+
+
+def _payloads(day: date, headlines: List[Dict]) -> List[str]:
+    """変更された見出しを、NOTIFYの上限に収まる大きさの通知に分ける"""
+    payloads = []
+    chunk: List[Dict] = []
+
+    def encode(items: List[Dict]) -> str:
+        return json.dumps({"date": day.isoformat(), "headlines": items}, ensure_ascii=False, default=str)
+
+    for headline in headlines:
+        if len(encode(chunk + [headline]).encode("utf-8")) <= MAX_PAYLOAD_BYTES:
+            chunk.append(headline)
+            continue
+        if chunk:
+            payloads.append(encode(chunk))
+        chunk = [headline]
+        if len(encode(chunk).encode("utf-8")) > MAX_PAYLOAD_BYTES:
+            # 1件でも上限を超える見出しは送らず、クライアントに再取得を求める
+            payloads.append(json.dumps({"date": day.isoformat(), "resync": True}))
+            chunk = []
+    if chunk:
+        payloads.append(encode(chunk))
+    return payloads
+
+
+def notify_digest_update(db: Session, day: date, headlines: List[Dict]) -> None:
+    """
+    指定日のダイジェストの変更を通知する (commitされた場合だけ届く)。
+    commitは呼び出し元で行う。
+    """
+    if not headlines:
+        return
+    payloads = _payloads(day, headlines)
+    if db.get_bind().dialect.name == "postgresql":
+        for payload in payloads:
+            db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+    else:
+        db.info.setdefault(_PENDING_KEY, []).extend(payloads)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    for payload in session.info.pop(_PENDING_KEY, []):
+        broker.publish(json.loads(payload))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+class Subscription:
+    """1クライアント分の通知の受け取り口 (イベントループ上で読む)"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # 取りこぼしがあった場合は True (クライアントに再取得を求める)
+        self.overflowed = False
+
+    def offer(self, message: Dict) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        """次の通知を返す (timeout 秒以内に届かなければ None)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class EventBroker:
+    """プロセス内のクライアントへの通知の配信 (どのスレッドからも publish できる)"""
+
+    def __init__(self):
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._listener: Optional["PgListener"] = None
+
+    def subscribe(self) -> Subscription:
+        """イベントループ上で呼ぶ。PostgreSQLの場合は LISTEN 用の接続を開く"""
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            if len(self._subscribers) >= MAX_SUBSCRIBERS:
+                raise TooManySubscribers(f"more than {MAX_SUBSCRIBERS} clients")
+            self._subscribers.add(subscription)
+            if self._listener is None and engine.dialect.name == "postgresql":
+                self._listener = PgListener(self)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, message: Dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # イベントループが終了している
+                self.unsubscribe(subscription)
+
+    def close(self) -> None:
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+
+
+class PgListener(threading.Thread):
+    """LISTEN 用の接続で通知を待ち、届いた通知を broker に渡す (接続が切れたら張り直す)"""
+
+    def __init__(self, broker: EventBroker, poll_seconds: float = 5.0):
+        super().__init__(name="digest-listener", daemon=True)
+        self.broker = broker
+        self.poll_seconds = poll_seconds
+        self._stop_event = threading.Event()
+        self._reconnected = False
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Digest listener error: {e}")
+                self._stop_event.wait(self.poll_seconds)
+
+    def _listen(self) -> None:
+        # プールから切り離した専用の接続を使う (LISTEN の状態をプールに戻さない)
+        connection = engine.raw_connection()
+        conn = connection.driver_connection
+        connection.detach()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            if self._reconnected:
+                # 接続が切れていた間の通知は届かないため、クライアントに再取得を求める
+                self.broker.publish({"resync": True})
+            self._reconnected = True
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], self.poll_seconds) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        self.broker.publish(json.loads(notify.payload))
+                    except ValueError:
+                        print(f"Invalid digest notification: {notify.payload[:100]}")
+        finally:
+            connection.close()
+
+
+broker = EventBroker()
+
+
+def format_event(message: Dict) -> str:
+    """SSEの1イベントの形式にする (再取得を求める通知は "resync" イベント)"""
+    name = "resync" if message.get("resync") else "digest"
+    return f"event: {name}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
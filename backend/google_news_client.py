@@ -5,14 +5,19 @@ Google News RSSフィードからニュースを取得するモジュール。
 スクレイピング不要で、RSSフィードから直接タイトル・概要・リンク・日時を取得する。
 """
 
+import hashlib
 import html
 import re
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Optional
 
 import feedparser
 import requests
 
+from breaker import CircuitOpenError, breakers
+from metrics import observe_source, observe_stage
+from records import ArticleRecord
+
 
 class GoogleNewsClient:
     """Google News RSSフィードからニュースを取得するクライアント"""
@@ -76,7 +81,7 @@ class GoogleNewsClient:
         self,
         topics: Optional[List[str]] = None,
         max_articles: int = 20
-    ) -> List[Dict]:
+    ) -> List[ArticleRecord]:
         """
         Google News RSSからニュースを取得する
 
@@ -98,9 +103,11 @@ class GoogleNewsClient:
             print(f"Fetching Google News RSS: {url}")
 
             try:
-                response = self.session.get(url, timeout=self.timeout)
-                response.raise_for_status()
-                feed = feedparser.parse(response.content)
+                with observe_source("google_news"), observe_stage("fetch"), breakers.guard(url):
+                    response = self.session.get(url, timeout=self.timeout)
+                    response.raise_for_status()
+                with observe_stage("parse"):
+                    feed = feedparser.parse(response.content)
 
                 print(f"Found {len(feed.entries)} articles from topic '{topic}'")
 
@@ -111,7 +118,8 @@ class GoogleNewsClient:
                     seen_links.add(entry.link)
 
                     # 記事IDの生成（リンクのハッシュ）
-                    article_id = f"gn_{hash(entry.link) & 0xFFFFFFFF:08x}"
+                    # 組み込みの hash() はプロセスごとに値が変わるため、安定したハッシュを使う
+                    article_id = f"gn_{hashlib.md5(entry.link.encode()).hexdigest()[:16]}"
 
                     # descriptionからテキストを抽出
                     description = ""
@@ -123,20 +131,23 @@ class GoogleNewsClient:
                     if hasattr(entry, "published"):
                         published_at = self._parse_date(entry.published)
 
-                    article = {
-                        "article_id": article_id,
-                        "title": self._clean_html(entry.title),
-                        "link": entry.link,
-                        "description": description,
-                        "published_at": published_at,
-                        "source": "Google News",
-                        "topic": topic,
-                    }
+                    article = ArticleRecord(
+                        article_id=article_id,
+                        title=self._clean_html(entry.title),
+                        link=entry.link,
+                        description=description,
+                        published_at=published_at,
+                        source="Google News",
+                        topic=topic,
+                    )
                     all_articles.append(article)
 
                     if len(all_articles) >= max_articles:
                         break
 
+            except CircuitOpenError:
+                # 他のトピックも同じホストのため、待たずに呼び出し元に返す
+                raise
             except Exception as e:
                 print(f"Error fetching Google News RSS ({topic}): {e}")
                 continue
@@ -153,7 +164,7 @@ if __name__ == "__main__":
     articles = client.fetch_news(topics=["top"], max_articles=5)
     for i, article in enumerate(articles, 1):
         print(f"\n--- Article {i} ---")
-        print(f"Title: {article['title']}")
-        print(f"Description: {article['description'][:100]}...")
-        print(f"Link: {article['link']}")
-        print(f"Published: {article['published_at']}")
+        print(f"Title: {article.title}")
+        print(f"Description: {article.description[:100]}...")
+        print(f"Link: {article.link}")
+        print(f"Published: {article.published_at}")
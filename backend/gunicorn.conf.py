@@ -0,0 +1,55 @@
+"""
+gunicorn設定
+
+- マイグレーション (alembic upgrade head) はワーカー起動前にマスタープロセスで1回だけ実行する
+- GUNICORN_PRELOAD=true でアプリをマスターで読み込んでからフォークする (ワーカーの起動・再起動が速くなる)
+- WARMUP_ON_BOOT=true で各ワーカーの起動直後に重いモジュールの読み込みとDB接続を済ませる
+- PROMETHEUS_MULTIPROC_DIR を設定した場合、起動時に前回のメトリクスファイルを削除し、
+  終了したワーカーのメトリクスを集計対象から外す
+"""
+
+import glob
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# 4 workers as recommended for moderate workloads
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+
+def on_starting(server):
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+            os.remove(path)
+
+    if os.getenv("RUN_MIGRATIONS", "true").lower() != "true":
+        return
+
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+    server.log.info("Running database migrations")
+    command.upgrade(config, "head")
+
+
+def post_worker_init(worker):
+    if os.getenv("WARMUP_ON_BOOT", "false").lower() != "true":
+        return
+
+    from main import warmup
+
+    try:
+        warmup()
+    except Exception as e:
+        worker.log.warning(f"Warmup failed: {e}")
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,104 @@
+"""
+取得した記事の一括保存
+
+ニュースクライアントが取得した記事を、1回の複数行 INSERT ... ON CONFLICT (article_id) DO UPDATE で
+articles テーブルに保存する。重要ポイントも対象記事の分をまとめて削除し、まとめて挿入する。
+ORMで1件ずつ追加しないため、数百件の記事でもDBとの往復は数回で済む。
+保存した記事は同じトランザクションで検索インデックスにも反映する (search.index_articles)。
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from sqlalchemy import case, delete, func, insert
+from sqlalchemy.orm import Session
+
+from database import Article, ArticleKeyPoint, dialect_insert
+from records import ArticleRecord
+from search import index_articles
+
+# 1文あたりの行数 (SQLiteのバインド変数の上限を超えないようにする)
+CHUNK_SIZE = 500
+
+
+def _article_row(article: ArticleRecord, now: datetime) -> Dict:
+    summary = article.summary or ""
+    return {
+        "article_id": article.article_id,
+        "title": article.title,
+        "link": article.link,
+        "description": article.description or "",
+        "content": article.content,
+        "summary": summary,
+        "category": article.topic,
+        "source": article.source,
+        "published_at": article.published_at,
+        "status": "processed" if summary else "unprocessed",
+        "created_at": now,
+    }
+
+
+def upsert_articles(db: Session, articles: List[ArticleRecord]) -> int:
+    """
+    記事を articles テーブルに一括で保存 (既存の記事は更新) する。
+    要約が空の記事は、既に保存されている要約と処理状態を上書きしない (本文も、空の場合は上書きしない)。
+    記事に key_points がある場合は、その記事の重要ポイントを置き換える。
+    保存した記事は検索インデックスにも反映する。
+    commitは呼び出し元で行う。
+
+    Returns:
+        保存した記事数
+    """
+    now = datetime.now(timezone.utc)
+    rows = {}
+    for article in articles:
+        if article.article_id:
+            rows[article.article_id] = _article_row(article, now)
+    if not rows:
+        return 0
+
+    insert_stmt = dialect_insert(db)
+    values = list(rows.values())
+    for i in range(0, len(values), CHUNK_SIZE):
+        stmt = insert_stmt(Article).values(values[i:i + CHUNK_SIZE])
+        has_summary = func.coalesce(stmt.excluded.summary, "") != ""
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Article.article_id],
+            set_={
+                "title": stmt.excluded.title,
+                "link": stmt.excluded.link,
+                "description": stmt.excluded.description,
+                "content": func.coalesce(stmt.excluded.content, Article.content),
+                "summary": case((has_summary, stmt.excluded.summary), else_=Article.summary),
+                "category": func.coalesce(stmt.excluded.category, Article.category),
+                "source": func.coalesce(stmt.excluded.source, Article.source),
+                "published_at": stmt.excluded.published_at,
+                "status": case((has_summary, stmt.excluded.status), else_=Article.status),
+            },
+        )
+        db.execute(stmt)
+
+    _replace_key_points(db, [a for a in articles if a.article_id and a.key_points])
+    ids = list(rows)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        index_articles(db, ids[i:i + CHUNK_SIZE])
+    return len(rows)
+
+
+def _replace_key_points(db: Session, articles: List[ArticleRecord]) -> None:
+    """対象記事の重要ポイントをまとめて削除し、まとめて挿入する"""
+    if not articles:
+        return
+    ids = list({a.article_id for a in articles})
+    db.execute(delete(ArticleKeyPoint).where(ArticleKeyPoint.article_id.in_(ids)))
+
+    points = []
+    seen = set()
+    for article in articles:
+        if article.article_id in seen:
+            continue
+        seen.add(article.article_id)
+        points.extend({"article_id": article.article_id, "point": p} for p in article.key_points if p)
+    if points:
+        # executemany (SQLAlchemyが複数行のINSERTにまとめる)
+        db.execute(insert(ArticleKeyPoint), points)
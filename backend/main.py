@@ -5,29 +5,85 @@ Google News RSSからニュースを取得し、バッチ処理で要約して
 """
 
 import os
+import time
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Query
+from breaker import breakers
+from collector import run_collect, wait_for_background
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from google_news_client import GoogleNewsClient
-from sqlalchemy.orm import Session
-from summarizer import Summarizer
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session, selectinload
 
 from database import (
     Article,
     ArticleKeyPoint,
-    Base,
+    CollectRun,
     DailyDigest,
-    SessionLocal,
+    DigestRollup,
+    READ_YOUR_WRITES_SECONDS,
+    TopicDigest,
     Video,
     engine,
+    get_db,
+    read_engine,
+    read_session,
 )
+from digests import ROLLUP_PERIODS, period_bounds
+from events import Subscription, TooManySubscribers, broker, format_event
+from metrics import HTTP_REQUEST_SECONDS, HTTP_RESPONSE_BYTES, render_latest
+from search import search
 
-# テーブル作成
-Base.metadata.create_all(bind=engine)
+# テーブルの作成・変更は Alembic のマイグレーション (alembic upgrade head) で行う。
+# gunicorn起動時にマスタープロセスで1回だけ実行する (gunicorn.conf.py を参照)。
 
-app = FastAPI()
+
+def warmup() -> None:
+    """
+    ワーカー起動直後に呼び出し、初回リクエストの遅延を減らす (WARMUP_ON_BOOT=true の場合)。
+    収集処理で使う重いモジュールの読み込みと、DB接続の確立を先に済ませる。
+    """
+    import google_news_client  # noqa: F401
+    import nhk_client  # noqa: F401
+    import summarizer  # noqa: F401
+
+    for e in {engine, read_engine}:
+        with e.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+
+# 終了時にバックグラウンドの収集処理を待つ最大秒数
+SHUTDOWN_WAIT_SECONDS = float(os.getenv("COLLECT_SHUTDOWN_WAIT", "20"))
+# 書き込みを行ったクライアントに付けるCookie (値は書き込み時刻のUNIX時間)
+LAST_WRITE_COOKIE = "news_last_write"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    起動時にフィード監視スケジューラを開始する (SCHEDULER_ENABLED=true の場合のみ)。
+    終了時は、締め切り後にバックグラウンドで続いている収集処理の保存を待つ。
+    """
+    news_scheduler = None
+    if os.getenv("SCHEDULER_ENABLED", "false").lower() == "true":
+        from scheduler import NewsScheduler
+
+        news_scheduler = NewsScheduler()
+        news_scheduler.start()
+    try:
+        yield
+    finally:
+        if news_scheduler:
+            news_scheduler.shutdown()
+        if not wait_for_background(SHUTDOWN_WAIT_SECONDS):
+            print("Background collect still running at shutdown")
+        broker.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -39,117 +95,198 @@ app.add_middleware(
 )
 
 
-def get_db():
-    db = SessionLocal()
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """APIルートごとのレイテンシとレスポンスサイズを記録する"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    # パスパラメータでラベルが増えないよう、実際のパスではなくルートのテンプレートを使う
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(
+        method=request.method, route=route_path, status=str(response.status_code)
+    ).observe(elapsed)
+    content_length = response.headers.get("content-length")
+    if content_length:
+        HTTP_RESPONSE_BYTES.labels(method=request.method, route=route_path).observe(int(content_length))
+    return response
+
+
+def get_read_db(request: Request):
+    """
+    参照系のリクエスト用のセッション。
+    直前に書き込んだクライアント (他のワーカーで書き込んだ場合を含む) はCookieで判定してプライマリから読む。
+    """
+    db = read_session(request.cookies.get(LAST_WRITE_COOKIE))
     try:
         yield db
     finally:
         db.close()
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus形式のメトリクス (gunicornの全ワーカー分)"""
+    data, content_type = render_latest()
+    return Response(content=data, media_type=content_type)
+
+
+# 範囲取得で一度に返す最大日数
+MAX_RANGE_DAYS = 92
+
+
+def _parse_date(value: str) -> date:
+    """YYYY-MM-DD形式の日付をパースする (不正な形式は400エラー)"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+
+
 @app.post("/api/news/collect")
-def collect_news(db: Session = Depends(get_db)):
+def collect_news(response: Response, db: Session = Depends(get_db)):
     """
     Google News RSSからニュースを取得し、バッチ処理で要約してDailyDigestに保存する。
     1回のAPI呼び出しで複数記事を要約するため、API使用量を大幅に削減。
+    直後の参照系リクエストが別ワーカーで処理されてもプライマリから読むよう、書き込み時刻をCookieで返す。
+    締め切りまでに要約が終わらない場合は status "partial" で返し、残りの要約はバックグラウンドで反映する。
     """
     try:
-        news_client = GoogleNewsClient()
-        summarizer = Summarizer(os.getenv("GEMINI_API_KEY"))
-        today = date.today()
+        result = run_collect(db)
+        response.set_cookie(
+            LAST_WRITE_COOKIE,
+            f"{time.time():.3f}",
+            max_age=int(READ_YOUR_WRITES_SECONDS) + 1,
+            httponly=True,
+            samesite="lax",
+        )
+        return result
 
-        # Google News RSSから記事を取得
-        articles = news_client.fetch_news(topics=["top"], max_articles=5)
+    except Exception as e:
+        print(f"Error in collect_news: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not articles:
-            return {
-                "status": "success",
-                "message": "No articles found",
-                "articles_count": 0,
-            }
 
-        print(f"Fetched {len(articles)} articles from Google News")
-
-        # 既存のダイジェストを確認
-        existing_digest = db.query(DailyDigest).filter(DailyDigest.date == today).first()
-
-        # バッチ要約を実行
-        summaries = summarizer.summarize_batch(articles)
-
-        # ダイジェストデータを構築
-        headlines = []
-        for i, article in enumerate(articles):
-            summary_text = ""
-            if i < len(summaries):
-                summary_item = summaries[i]
-                if isinstance(summary_item, dict):
-                    summary_text = summary_item.get("summary", "")
-                else:
-                    summary_text = str(summary_item)
-
-            headlines.append({
-                "title": article.get("title", ""),
-                "summary": summary_text,
-                "link": article.get("link", ""),
-                "source": "Google News",
-                "published_at": article.get("published_at").isoformat() if article.get("published_at") else None,
-            })
+@app.get("/api/news/collect/runs")
+def list_collect_runs(
+    limit: int = Query(20, ge=1, le=200, description="返す実行記録の件数 (新しい順)"),
+    days: int = Query(7, ge=1, le=90, description="日別集計の対象日数"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    収集処理の実行記録と、日別のGemini API呼び出し回数・トークン数の集計を返す。
+    無料枠の使用量とスループットの推移の確認に使う。
+    """
+    runs = db.query(CollectRun).order_by(CollectRun.started_at.desc()).limit(limit).all()
+
+    since = datetime.utcnow() - timedelta(days=days)
+    recent = db.query(CollectRun).filter(CollectRun.started_at >= since).all()
+    daily = {}
+    for run in recent:
+        day = run.started_at.date().isoformat()
+        totals = daily.setdefault(day, {
+            "date": day, "runs": 0, "errors": 0, "articles_fetched": 0,
+            "gemini_calls": 0, "input_tokens": 0, "output_tokens": 0, "input_tokens_saved": 0,
+        })
+        totals["runs"] += 1
+        totals["errors"] += 1 if run.status == "error" else 0
+        totals["articles_fetched"] += run.articles_fetched or 0
+        totals["gemini_calls"] += run.gemini_calls or 0
+        totals["input_tokens"] += run.input_tokens or 0
+        totals["output_tokens"] += run.output_tokens or 0
+        totals["input_tokens_saved"] += run.input_tokens_saved or 0
+
+    return {
+        "runs": [
+            {
+                "id": r.id,
+                "trigger": r.trigger,
+                "status": r.status,
+                "started_at": r.started_at.isoformat() if r.started_at else None,
+                "finished_at": r.finished_at.isoformat() if r.finished_at else None,
+                "duration_seconds": (
+                    round((r.finished_at - r.started_at).total_seconds(), 3)
+                    if r.started_at and r.finished_at else None
+                ),
+                "stage_durations": r.stage_durations or {},
+                "pipeline_stats": r.pipeline_stats or {},
+                "source_stats": r.source_stats or {},
+                "articles_fetched": r.articles_fetched,
+                "articles_new": r.articles_new,
+                "articles_summarized": r.articles_summarized,
+                "gemini_calls": r.gemini_calls,
+                "input_tokens": r.input_tokens,
+                "output_tokens": r.output_tokens,
+                "input_tokens_saved": r.input_tokens_saved,
+                "error": r.error,
+            }
+            for r in runs
+        ],
+        "daily": [daily[d] for d in sorted(daily, reverse=True)],
+    }
 
-        # DailyDigestを保存または更新
-        if existing_digest:
-            existing_digest.headlines = headlines
-            existing_digest.updated_at = datetime.utcnow()
-        else:
-            new_digest = DailyDigest(
-                date=today,
-                headlines=headlines,
-            )
-            db.add(new_digest)
 
-        db.commit()
+@app.get("/api/upstreams")
+def list_upstreams(db: Session = Depends(get_db)):
+    """
+    取得先のホストごとのサーキットブレーカーの状態を返す。
+    全ワーカーで共有している状態を返すため、レプリカではなくプライマリから読む。
+    """
+    return {"upstreams": breakers.status(db)}
 
-        return {
-            "status": "success",
-            "date": today.isoformat(),
-            "articles_count": len(headlines),
-            "api_calls": 1,  # バッチ処理により1回のAPI呼び出しのみ
-        }
 
-    except Exception as e:
-        print(f"Error in collect_news: {e}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
+def _topic_digest(db: Session, day: date, topic: Optional[str], source: Optional[str]) -> Optional[TopicDigest]:
+    """
+    トピック・ソースで絞り込んだ日別ダイジェストを返す (事前に分けた1行を読む)。
+    両方を指定した場合はトピックの行をソースで絞り込む (返すオブジェクトはセッションから切り離す)。
+    """
+    facet, value = ("topic", topic) if topic else ("source", source)
+    row = (
+        db.query(TopicDigest)
+        .filter(TopicDigest.date == day, TopicDigest.facet == facet, TopicDigest.value == value)
+        .first()
+    )
+    if row is not None and topic and source:
+        db.expunge(row)
+        row.headlines = [h for h in row.headlines if h.get("source") == source]
+    return row
 
 
 @app.get("/api/news/daily")
 def get_daily_digest(
     target_date: Optional[str] = Query(None, description="対象日 (YYYY-MM-DD形式、省略時は今日)"),
-    db: Session = Depends(get_db),
+    topic: Optional[str] = Query(None, description="トピックで絞り込む (例: business, sports)"),
+    source: Optional[str] = Query(None, description="ソースで絞り込む (例: Google News, NHK, YouTube)"),
+    db: Session = Depends(get_read_db),
 ):
     """
     指定日の日別ダイジェストを取得する。
     1日分のニュースを箇条書き形式で返す。
+    トピック・ソースを指定した場合は、収集時に分けて保存したその分だけを返す。
     """
     try:
-        if target_date:
-            try:
-                query_date = datetime.strptime(target_date, "%Y-%m-%d").date()
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-        else:
-            query_date = date.today()
+        query_date = _parse_date(target_date) if target_date else date.today()
 
-        digest = db.query(DailyDigest).filter(DailyDigest.date == query_date).first()
+        if topic or source:
+            digest = _topic_digest(db, query_date, topic, source)
+        else:
+            digest = db.query(DailyDigest).filter(DailyDigest.date == query_date).first()
+        filters = {key: value for key, value in (("topic", topic), ("source", source)) if value}
 
         if not digest:
             return {
                 "date": query_date.isoformat(),
+                **filters,
                 "headlines": [],
                 "message": "No digest found for this date",
             }
 
         return {
             "date": digest.date.isoformat(),
+            **filters,
             "headlines": digest.headlines,
             "updated_at": digest.updated_at.isoformat() if digest.updated_at else None,
         }
@@ -161,16 +298,116 @@ def get_daily_digest(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/news/range")
+def get_digest_range(
+    from_date: str = Query(..., alias="from", description="開始日 (YYYY-MM-DD形式)"),
+    to_date: str = Query(..., alias="to", description="終了日 (YYYY-MM-DD形式、開始日を含めて最大92日)"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    期間内の日別ダイジェストをまとめて取得する。
+    日付インデックスを使った1回の範囲クエリで、週表示などの日数分の往復を不要にする。
+    """
+    start = _parse_date(from_date)
+    end = _parse_date(to_date)
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+    if (end - start).days + 1 > MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must be at most {MAX_RANGE_DAYS} days.")
+
+    digests = (
+        db.query(DailyDigest)
+        .filter(DailyDigest.date.between(start, end))
+        .order_by(DailyDigest.date)
+        .all()
+    )
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "digests": [
+            {
+                "date": d.date.isoformat(),
+                "headlines": d.headlines,
+                "updated_at": d.updated_at.isoformat() if d.updated_at else None,
+            }
+            for d in digests
+        ],
+    }
+
+
+@app.get("/api/news/rollup")
+def get_digest_rollup(
+    period: str = Query("week", description="集計単位 (week または month)"),
+    target_date: Optional[str] = Query(None, description="期間に含まれる日付 (YYYY-MM-DD形式、省略時は今日)"),
+    db: Session = Depends(get_read_db),
+):
+    """
+    指定日を含む週 (月曜始まり) または月のダイジェストを取得する。
+    事前集計済みのロールアップ1行を返す。
+    """
+    if period not in ROLLUP_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Invalid period. Use one of {', '.join(ROLLUP_PERIODS)}.")
+
+    query_date = _parse_date(target_date) if target_date else date.today()
+    start, end = period_bounds(period, query_date)
+
+    rollup = (
+        db.query(DigestRollup)
+        .filter(DigestRollup.period == period, DigestRollup.period_start == start)
+        .first()
+    )
+    days = rollup.days if rollup else {}
+
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "digests": [{"date": d, "headlines": days[d]} for d in sorted(days)],
+        "updated_at": rollup.updated_at.isoformat() if rollup and rollup.updated_at else None,
+    }
+
+
+@app.get("/api/news/search")
+def search_news(
+    q: str = Query(..., min_length=1, max_length=100, description="検索キーワード"),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+):
+    """
+    過去のダイジェストの見出し・要約と記事を全文検索する。
+    全てのキーワードを含むものを関連度順に返す。
+    """
+    total, results = search(db, q, page=page, per_page=per_page)
+    return {
+        "query": q,
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "results": results,
+    }
+
+
 @app.get("/api/news/list")
-def list_news(db: Session = Depends(get_db)):
+def list_news(
+    topic: Optional[str] = Query(None, description="トピック (記事のカテゴリ) で絞り込む"),
+    source: Optional[str] = Query(None, description="ソースで絞り込む"),
+    db: Session = Depends(get_read_db),
+):
     """
     要約済みのニュース一覧を取得 (後方互換性のため残す)
     新しいシステムではDailyDigestを使用するが、旧フロントエンドのためにこのエンドポイントも維持。
+    トピック・ソースを指定した場合は絞り込んだ分だけを返す (YouTube動画は含めない)。
     """
     result = []
+    filtered = bool(topic or source)
 
     # まずDailyDigestから今日のデータを取得
-    today_digest = db.query(DailyDigest).filter(DailyDigest.date == date.today()).first()
+    if filtered:
+        today_digest = _topic_digest(db, date.today(), topic, source)
+    else:
+        today_digest = db.query(DailyDigest).filter(DailyDigest.date == date.today()).first()
     if today_digest and today_digest.headlines:
         for i, headline in enumerate(today_digest.headlines):
             result.append({
@@ -180,7 +417,7 @@ def list_news(db: Session = Depends(get_db)):
                 "published_at": headline.get("published_at"),
                 "link": headline.get("link", ""),
                 "source": headline.get("source", "Google News"),
-                "category": None,
+                "category": headline.get("topic"),
                 "status": "processed",
                 "key_points": [],
                 "type": "article",
@@ -188,13 +425,16 @@ def list_news(db: Session = Depends(get_db)):
 
     # DailyDigestがなければ旧Articleテーブルから取得
     if not result:
-        articles = (
+        query = (
             db.query(Article)
+            .options(selectinload(Article.key_points))
             .filter(Article.status == "processed")
-            .order_by(Article.published_at.desc())
-            .limit(50)
-            .all()
         )
+        if topic:
+            query = query.filter(Article.category == topic)
+        if source:
+            query = query.filter(Article.source == source)
+        articles = query.order_by(Article.published_at.desc()).limit(50).all()
 
         for a in articles:
             key_points = [kp.point for kp in a.key_points]
@@ -212,9 +452,10 @@ def list_news(db: Session = Depends(get_db)):
             })
 
     # NHK記事が少ない場合、YouTube動画も含める (後方互換性)
-    if len(result) < 10:
+    if len(result) < 10 and not filtered:
         videos = (
             db.query(Video)
+            .options(selectinload(Video.key_points))
             .filter(Video.status == "processed")
             .order_by(Video.published_at.desc())
             .limit(20)
@@ -240,16 +481,75 @@ def list_news(db: Session = Depends(get_db)):
     return result
 
 
+# SSEで接続を保つためのコメントを送る間隔 (秒)
+SSE_KEEPALIVE_SECONDS = 15
+# 切断されたクライアントが再接続するまでの待ち時間 (ミリ秒)
+SSE_RETRY_MS = 5000
+
+
+@app.get("/api/news/stream")
+async def stream_digest_updates(
+    request: Request,
+    target_date: Optional[str] = Query(None, description="この日のダイジェストの更新だけを受け取る (YYYY-MM-DD形式)"),
+    topic: Optional[str] = Query(None, description="このトピックの見出しの更新だけを受け取る"),
+):
+    """
+    ダイジェストの更新をServer-Sent Eventsで配信する。
+    収集で見出しが追加・更新されると、変更された見出しだけを "digest" イベントで送る。
+    通知を取りこぼした場合は "resync" イベントを送るので、クライアントはダイジェストを取得し直す。
+    """
+    day = _parse_date(target_date).isoformat() if target_date else None
+    try:
+        subscription = broker.subscribe()
+    except TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many stream clients.")
+    return StreamingResponse(
+        _digest_events(request, subscription, day, topic),
+        media_type="text/event-stream",
+        # nginxでバッファリングさせない
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _digest_events(request: Request, subscription: Subscription, day: Optional[str], topic: Optional[str]):
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while not await request.is_disconnected():
+            message = await subscription.get(SSE_KEEPALIVE_SECONDS)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_event({"resync": True})
+                continue
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            # 日付のない再取得の通知 (LISTEN の再接続時) は、日付・トピックによらず全クライアントに送る
+            if message.get("resync") and not message.get("date"):
+                yield format_event(message)
+                continue
+            if day and message.get("date") != day:
+                continue
+            if topic and not message.get("resync"):
+                headlines = [h for h in message["headlines"] if h.get("topic") == topic]
+                if not headlines:
+                    continue
+                message = dict(message, headlines=headlines)
+            yield format_event(message)
+    finally:
+        broker.unsubscribe(subscription)
+
+
 # =====================================================
 # 旧YouTube用エンドポイント (後方互換性のため残す)
 # =====================================================
 
 
 @app.get("/api/news/videos")
-def list_videos(db: Session = Depends(get_db)):
+def list_videos(db: Session = Depends(get_read_db)):
     """要約済みのYouTube動画一覧を取得 (旧API)"""
     videos = (
         db.query(Video)
+        .options(selectinload(Video.key_points))
         .filter(Video.status == "processed")
         .order_by(Video.published_at.desc())
         .all()
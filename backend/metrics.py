@@ -0,0 +1,176 @@
+"""
+Prometheusメトリクス
+
+収集処理の各段階・各ソースの所要時間、Gemini APIの呼び出し結果、APIルートごとのレイテンシを記録し、
+/metrics エンドポイントで公開する。
+
+gunicornの複数ワーカーの値をまとめて公開するため、環境変数 PROMETHEUS_MULTIPROC_DIR を設定した場合は
+prometheus_client のマルチプロセスモードで動作する (ディレクトリの初期化は gunicorn.conf.py で行う)。
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+
+# 収集処理は数秒〜数分かかるため、デフォルトより長いバケットを使う
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+COLLECT_DURATION_SECONDS = Histogram(
+    "news_collect_duration_seconds",
+    "収集処理1回の所要時間",
+    ["outcome"],
+    buckets=STAGE_BUCKETS,
+)
+PIPELINE_STAGE_SECONDS = Histogram(
+    "news_collect_stage_seconds",
+    "収集処理の段階ごとの所要時間 (fetch, parse, summarize, persist, commit)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+SOURCE_FETCH_SECONDS = Histogram(
+    "news_source_fetch_seconds",
+    "ニュースソースごとのフィード取得時間",
+    ["source"],
+    buckets=STAGE_BUCKETS,
+)
+SOURCE_FETCH_TOTAL = Counter(
+    "news_source_fetch_total",
+    "収集処理でのニュースソースの取得結果 (outcome: ok, timeout, open, error)",
+    ["source", "outcome"],
+)
+BREAKER_TRANSITIONS_TOTAL = Counter(
+    "upstream_breaker_transitions_total",
+    "取得先のホストごとのサーキットブレーカーの状態の変化 (state: open, half_open, closed)",
+    ["host", "state"],
+)
+BREAKER_REJECTED_TOTAL = Counter(
+    "upstream_breaker_rejected_total",
+    "サーキットブレーカーが open のため呼び出さずに失敗させた回数",
+    ["host"],
+)
+ENRICH_TOTAL = Counter(
+    "news_enrich_total",
+    "記事の補完結果 (step: resolve, extract / outcome: ok, cached, failed, skipped)",
+    ["step", "outcome"],
+)
+PIPELINE_ITEMS_TOTAL = Counter(
+    "news_pipeline_items_total",
+    "収集パイプラインの各ステージが処理した件数",
+    ["stage"],
+)
+WORK_ITEMS_TOTAL = Counter(
+    "news_work_items_total",
+    "要約のワークキューの作業の処理結果 (kind: article, video / outcome: done, retry, dead)",
+    ["kind", "outcome"],
+)
+GEMINI_BATCH_REQUESTS_TOTAL = Counter(
+    "gemini_batch_requests_total",
+    "バッチジョブで要約したリクエストの結果 (outcome: ok, error)",
+    ["outcome"],
+)
+GEMINI_CALLS_TOTAL = Counter(
+    "gemini_calls_total",
+    "Gemini API呼び出し回数 (outcome: ok, 429, 404, empty, error)",
+    ["outcome"],
+)
+GEMINI_INPUT_TOKENS_SAVED_TOTAL = Counter(
+    "gemini_input_tokens_saved_total",
+    "バッチ要約の入力の整形で減らした入力トークン数 (見積もり)",
+)
+GEMINI_RETRIES_TOTAL = Counter(
+    "gemini_retries_total",
+    "Gemini API呼び出しのリトライ回数 (reason: rate_limit, model_prefix)",
+    ["reason"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "APIルートごとのリクエスト処理時間",
+    ["method", "route", "status"],
+    buckets=REQUEST_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "APIルートごとのレスポンスサイズ",
+    ["method", "route"],
+    buckets=SIZE_BUCKETS,
+)
+
+# 実行中の収集処理の段階ごとの累計秒数 (収集の実行記録に保存する)
+_stage_durations: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_durations", default=None)
+# パイプラインの複数スレッドから同じ dict に加算するためのロック
+_durations_lock = threading.Lock()
+
+
+@contextmanager
+def record_stage_durations():
+    """
+    このブロック内で observe_stage により計測した段階ごとの累計秒数を dict に集める。
+    クライアント内部で計測した段階 (fetch, parse 等) も含まれる。
+    """
+    durations: Dict[str, float] = {}
+    token = _stage_durations.set(durations)
+    try:
+        yield durations
+    finally:
+        _stage_durations.reset(token)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """処理段階の所要時間を計測する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PIPELINE_STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        durations = _stage_durations.get()
+        if durations is not None:
+            with _durations_lock:
+                durations[stage] = durations.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def observe_source(source: str):
+    """ニュースソースのフィード取得時間を計測する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SOURCE_FETCH_SECONDS.labels(source=source).observe(time.perf_counter() - start)
+
+
+def gemini_error_outcome(error_str: str) -> str:
+    """Gemini APIのエラーメッセージを outcome ラベルに分類する"""
+    if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+        return "429"
+    if "404" in error_str:
+        return "404"
+    if "empty response" in error_str:
+        return "empty"
+    return "error"
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """公開用のメトリクスを生成する (マルチプロセスモードでは全ワーカー分を集計する)"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
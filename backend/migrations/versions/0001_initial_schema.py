@@ -0,0 +1,162 @@
+"""initial schema
+
+これまでアプリ起動時の create_all と database/init/01_schema.sql で作成していたテーブル。
+既存の環境ではテーブルが作成済みのため、存在しないテーブルのみ作成する。
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "channels" not in existing:
+        op.create_table(
+            "channels",
+            sa.Column("channel_id", sa.String(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("url", sa.String()),
+        )
+
+    if "videos" not in existing:
+        op.create_table(
+            "videos",
+            sa.Column("youtube_id", sa.String(), primary_key=True),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("channel_id", sa.String(), sa.ForeignKey("channels.channel_id")),
+            sa.Column("transcript", sa.Text()),
+            sa.Column("summary", sa.Text()),
+            sa.Column("thumbnail_url", sa.String()),
+            sa.Column("published_at", sa.DateTime(timezone=True)),
+            sa.Column("status", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True)),
+        )
+
+    if "key_points" not in existing:
+        op.create_table(
+            "key_points",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("youtube_id", sa.String(), sa.ForeignKey("videos.youtube_id")),
+            sa.Column("point", sa.Text(), nullable=False),
+        )
+        op.create_index("ix_key_points_id", "key_points", ["id"])
+
+    if "articles" not in existing:
+        op.create_table(
+            "articles",
+            sa.Column("article_id", sa.String(), primary_key=True),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("link", sa.String(), nullable=False),
+            sa.Column("description", sa.Text()),
+            sa.Column("content", sa.Text()),
+            sa.Column("summary", sa.Text()),
+            sa.Column("category", sa.String()),
+            sa.Column("source", sa.String()),
+            sa.Column("published_at", sa.DateTime(timezone=True)),
+            sa.Column("status", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True)),
+        )
+
+    if "article_key_points" not in existing:
+        op.create_table(
+            "article_key_points",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("article_id", sa.String(), sa.ForeignKey("articles.article_id")),
+            sa.Column("point", sa.Text(), nullable=False),
+        )
+        op.create_index("ix_article_key_points_id", "article_key_points", ["id"])
+
+    if "daily_digests" not in existing:
+        op.create_table(
+            "daily_digests",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("date", sa.Date(), nullable=False),
+            sa.Column("headlines", postgresql.JSONB(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True)),
+            sa.Column("updated_at", sa.DateTime(timezone=True)),
+        )
+        op.create_index("ix_daily_digests_id", "daily_digests", ["id"])
+        op.create_index("ix_daily_digests_date", "daily_digests", ["date"], unique=True)
+
+    if "digest_rollups" not in existing:
+        op.create_table(
+            "digest_rollups",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("period", sa.String(), nullable=False),
+            sa.Column("period_start", sa.Date(), nullable=False),
+            sa.Column("days", postgresql.JSONB(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True)),
+            sa.UniqueConstraint("period", "period_start", name="uq_digest_rollups_period"),
+        )
+        op.create_index("ix_digest_rollups_id", "digest_rollups", ["id"])
+
+    if "search_documents" not in existing:
+        op.create_table(
+            "search_documents",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("doc_key", sa.String(), nullable=False, unique=True),
+            sa.Column("kind", sa.String(), nullable=False),
+            sa.Column("date", sa.Date()),
+            sa.Column("title", sa.String(), nullable=False),
+            sa.Column("summary", sa.Text()),
+            sa.Column("link", sa.String()),
+            sa.Column("source", sa.String()),
+            sa.Column("published_at", sa.DateTime(timezone=True)),
+        )
+        op.create_index("ix_search_documents_id", "search_documents", ["id"])
+        op.create_index("ix_search_documents_date", "search_documents", ["date"])
+
+    if "search_postings" not in existing:
+        op.create_table(
+            "search_postings",
+            sa.Column("term", sa.String(), primary_key=True),
+            sa.Column(
+                "document_id",
+                sa.Integer(),
+                sa.ForeignKey("search_documents.id", ondelete="CASCADE"),
+                primary_key=True,
+            ),
+            sa.Column("weight", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_search_postings_document_id", "search_postings", ["document_id"])
+
+    if "feed_poll_states" not in existing:
+        op.create_table(
+            "feed_poll_states",
+            sa.Column("feed_key", sa.String(), primary_key=True),
+            sa.Column("interval_seconds", sa.Integer(), nullable=False),
+            sa.Column("avg_change_interval", sa.Float()),
+            sa.Column("fingerprint", sa.String()),
+            sa.Column("etag", sa.String()),
+            sa.Column("last_modified", sa.String()),
+            sa.Column("unchanged_count", sa.Integer()),
+            sa.Column("last_checked_at", sa.DateTime(timezone=True)),
+            sa.Column("last_changed_at", sa.DateTime(timezone=True)),
+        )
+
+
+def downgrade() -> None:
+    for table in (
+        "feed_poll_states",
+        "search_postings",
+        "search_documents",
+        "digest_rollups",
+        "daily_digests",
+        "article_key_points",
+        "articles",
+        "key_points",
+        "videos",
+        "channels",
+    ):
+        op.drop_table(table)
@@ -0,0 +1,40 @@
+"""collect run ledger
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "collect_runs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("trigger", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True)),
+        sa.Column("stage_durations", postgresql.JSONB()),
+        sa.Column("articles_fetched", sa.Integer()),
+        sa.Column("articles_new", sa.Integer()),
+        sa.Column("articles_summarized", sa.Integer()),
+        sa.Column("gemini_calls", sa.Integer()),
+        sa.Column("input_tokens", sa.Integer()),
+        sa.Column("output_tokens", sa.Integer()),
+        sa.Column("error", sa.Text()),
+    )
+    op.create_index("ix_collect_runs_id", "collect_runs", ["id"])
+    op.create_index("ix_collect_runs_started_at", "collect_runs", ["started_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("collect_runs")
@@ -0,0 +1,70 @@
+"""indexes for hot read queries
+
+一覧取得 (status = 'processed' を published_at の降順) 用の部分インデックスと、
+重要ポイントの外部キー列のインデックスを追加する。
+PostgreSQLでは書き込みを止めないよう CREATE INDEX CONCURRENTLY で作成する。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+PROCESSED = sa.text("status = 'processed'")
+
+
+def upgrade() -> None:
+    is_postgres = op.get_bind().dialect.name == "postgresql"
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_videos_processed_published",
+            "videos",
+            [sa.text("published_at DESC")],
+            postgresql_where=PROCESSED,
+            sqlite_where=PROCESSED,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_articles_processed_published",
+            "articles",
+            [sa.text("published_at DESC")],
+            postgresql_where=PROCESSED,
+            sqlite_where=PROCESSED,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_key_points_youtube_id",
+            "key_points",
+            ["youtube_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_article_key_points_article_id",
+            "article_key_points",
+            ["article_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+        if is_postgres:
+            # database/init/01_schema.sql で作成されていた、選択性の低い status 単独のインデックスは
+            # 部分インデックスで置き換えたため削除する
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_videos_status")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_article_key_points_article_id", table_name="article_key_points")
+    op.drop_index("ix_key_points_youtube_id", table_name="key_points")
+    op.drop_index("ix_articles_processed_published", table_name="articles")
+    op.drop_index("ix_videos_processed_published", table_name="videos")
@@ -0,0 +1,87 @@
+"""digest headlines as rows
+
+日別ダイジェストの見出しを (日付, 記事ID) ごとの行で保存するテーブルを追加し、
+既存の daily_digests.headlines の内容を移す。daily_digests.headlines は以後キャッシュとして更新する。
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def _headline_id(headline: dict) -> str:
+    # digests.headline_id と同じ規則
+    if headline.get("article_id"):
+        return headline["article_id"]
+    ident = headline.get("link") or headline.get("title", "")
+    return f"h_{hashlib.sha1(ident.encode()).hexdigest()[:16]}"
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    table = op.create_table(
+        "digest_headlines",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("article_id", sa.String(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("summary", sa.Text()),
+        sa.Column("link", sa.String()),
+        sa.Column("source", sa.String()),
+        sa.Column("topic", sa.String()),
+        sa.Column("published_at", sa.DateTime(timezone=True)),
+        sa.Column("first_seen_at", sa.DateTime(timezone=True)),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+        sa.UniqueConstraint("date", "article_id", name="uq_digest_headlines_date_article"),
+    )
+    op.create_index("ix_digest_headlines_id", "digest_headlines", ["id"])
+
+    # 既存のダイジェストの見出しを移す
+    digests = sa.table(
+        "daily_digests",
+        sa.column("date", sa.Date()),
+        sa.column("headlines", sa.JSON()),
+        sa.column("updated_at", sa.DateTime(timezone=True)),
+    )
+    now = datetime.now(timezone.utc)
+    for day, headlines, updated_at in op.get_bind().execute(sa.select(digests.c.date, digests.c.headlines, digests.c.updated_at)):
+        rows = {}
+        for headline in headlines or []:
+            # 同じ記事が重複している場合は先頭のものを残す
+            rows.setdefault(_headline_id(headline), {
+                "date": day,
+                "article_id": _headline_id(headline),
+                "title": headline.get("title", ""),
+                "summary": headline.get("summary") or "",
+                "link": headline.get("link", ""),
+                "source": headline.get("source"),
+                "topic": headline.get("topic"),
+                "published_at": _parse_datetime(headline.get("published_at")),
+                "first_seen_at": updated_at or now,
+                "updated_at": updated_at or now,
+            })
+        if rows:
+            op.bulk_insert(table, list(rows.values()))
+
+
+def downgrade() -> None:
+    op.drop_table("digest_headlines")
@@ -0,0 +1,82 @@
+"""move video transcripts to a compressed table
+
+videos.transcript を zlib圧縮して video_transcripts テーブルに移し、列を削除する。
+一覧取得で動画を読み込むたびに字幕全体を転送しないようにする。
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+
+import zlib
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    transcripts = op.create_table(
+        "video_transcripts",
+        sa.Column(
+            "youtube_id",
+            sa.String(),
+            sa.ForeignKey("videos.youtube_id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("text", sa.LargeBinary()),
+        sa.Column("original_size", sa.Integer()),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+    )
+
+    bind = op.get_bind()
+    videos = sa.table("videos", sa.column("youtube_id", sa.String()), sa.column("transcript", sa.Text()))
+    now = datetime.now(timezone.utc)
+    last_id = ""
+    while True:
+        rows = bind.execute(
+            sa.select(videos.c.youtube_id, videos.c.transcript)
+            .where(videos.c.transcript.isnot(None), videos.c.youtube_id > last_id)
+            .order_by(videos.c.youtube_id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        op.bulk_insert(transcripts, [
+            {
+                "youtube_id": youtube_id,
+                "text": zlib.compress(text.encode("utf-8"), 6),
+                "original_size": len(text.encode("utf-8")),
+                "created_at": now,
+            }
+            for youtube_id, text in rows
+        ])
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table("videos") as batch:
+        batch.drop_column("transcript")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("videos") as batch:
+        batch.add_column(sa.Column("transcript", sa.Text()))
+
+    bind = op.get_bind()
+    transcripts = sa.table("video_transcripts", sa.column("youtube_id", sa.String()), sa.column("text", sa.LargeBinary()))
+    videos = sa.table("videos", sa.column("youtube_id", sa.String()), sa.column("transcript", sa.Text()))
+    for youtube_id, data in bind.execute(sa.select(transcripts.c.youtube_id, transcripts.c.text)).all():
+        if data is not None:
+            bind.execute(
+                videos.update()
+                .where(videos.c.youtube_id == youtube_id)
+                .values(transcript=zlib.decompress(data).decode("utf-8"))
+            )
+
+    op.drop_table("video_transcripts")
@@ -0,0 +1,24 @@
+"""collect source stats
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("collect_runs", sa.Column("source_stats", postgresql.JSONB()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("collect_runs") as batch:
+        batch.drop_column("source_stats")
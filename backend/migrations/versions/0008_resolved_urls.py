@@ -0,0 +1,29 @@
+"""resolved urls
+
+Google Newsのリダイレクト用URLと転送先の対応をキャッシュするテーブルを追加する。
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "resolved_urls",
+        sa.Column("url", sa.String(), primary_key=True),
+        sa.Column("resolved_url", sa.String()),
+        sa.Column("resolved_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("resolved_urls")
@@ -0,0 +1,60 @@
+"""topic digests
+
+日別ダイジェストをトピック・ソースごとに分けて保存するテーブルを追加し、既存の日別ダイジェストから作る。
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+"""
+
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+# digests.TOPIC_FACETS と同じ
+FACETS = ("topic", "source")
+
+
+def upgrade() -> None:
+    table = op.create_table(
+        "topic_digests",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("facet", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.Column("headlines", postgresql.JSONB(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+        sa.UniqueConstraint("date", "facet", "value", name="uq_topic_digests_date_facet_value"),
+    )
+    op.create_index("ix_topic_digests_id", "topic_digests", ["id"])
+
+    # 既存の日別ダイジェストを分ける
+    digests = sa.table(
+        "daily_digests",
+        sa.column("date", sa.Date()),
+        sa.column("headlines", sa.JSON()),
+        sa.column("updated_at", sa.DateTime(timezone=True)),
+    )
+    now = datetime.now(timezone.utc)
+    for day, headlines, updated_at in op.get_bind().execute(sa.select(digests.c.date, digests.c.headlines, digests.c.updated_at)):
+        groups = {}
+        for headline in headlines or []:
+            for facet in FACETS:
+                if headline.get(facet):
+                    groups.setdefault((facet, headline[facet]), []).append(headline)
+        if groups:
+            op.bulk_insert(table, [
+                {"date": day, "facet": facet, "value": value, "headlines": group, "updated_at": updated_at or now}
+                for (facet, value), group in groups.items()
+            ])
+
+
+def downgrade() -> None:
+    op.drop_table("topic_digests")
@@ -0,0 +1,41 @@
+"""work items
+
+記事・動画ごとの要約の作業を複数のワーカーで分担するためのキューのテーブルを追加する。
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "work_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("target_id", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("available_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("locked_by", sa.String()),
+        sa.Column("lease_expires_at", sa.DateTime(timezone=True)),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+        sa.UniqueConstraint("kind", "target_id", name="uq_work_items_kind_target"),
+    )
+    op.create_index("ix_work_items_id", "work_items", ["id"])
+    op.create_index("ix_work_items_status_available", "work_items", ["status", "available_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("work_items")
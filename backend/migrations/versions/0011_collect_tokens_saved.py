@@ -0,0 +1,23 @@
+"""collect tokens saved
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("collect_runs", sa.Column("input_tokens_saved", sa.Integer()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("collect_runs") as batch:
+        batch.drop_column("input_tokens_saved")
@@ -0,0 +1,38 @@
+"""upstream breakers
+
+取得先のホストごとのサーキットブレーカーの状態を全ワーカーで共有するテーブルを追加する。
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "upstream_breakers",
+        sa.Column("host", sa.String(), primary_key=True),
+        sa.Column("state", sa.String(), nullable=False),
+        sa.Column("window_started_at", sa.DateTime(timezone=True)),
+        sa.Column("calls", sa.Integer()),
+        sa.Column("failures", sa.Integer()),
+        sa.Column("consecutive_failures", sa.Integer()),
+        sa.Column("open_count", sa.Integer()),
+        sa.Column("opened_at", sa.DateTime(timezone=True)),
+        sa.Column("open_until", sa.DateTime(timezone=True)),
+        sa.Column("probe_started_at", sa.DateTime(timezone=True)),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("upstream_breakers")
@@ -0,0 +1,45 @@
+"""summary batch jobs
+
+Gemini のバッチインターフェースに投入した要約のジョブを記録するテーブルを追加する。
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "summary_batch_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), unique=True),
+        sa.Column("backend", sa.String(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("state", sa.String(), nullable=False),
+        sa.Column("requests", postgresql.JSONB(), nullable=False),
+        sa.Column("request_count", sa.Integer()),
+        sa.Column("summarized", sa.Integer()),
+        sa.Column("failed", sa.Integer()),
+        sa.Column("input_tokens", sa.Integer()),
+        sa.Column("output_tokens", sa.Integer()),
+        sa.Column("error", sa.Text()),
+        sa.Column("created_at", sa.DateTime(timezone=True)),
+        sa.Column("submitted_at", sa.DateTime(timezone=True)),
+        sa.Column("completed_at", sa.DateTime(timezone=True)),
+        sa.Column("ingested_at", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_summary_batch_jobs_id", "summary_batch_jobs", ["id"])
+    op.create_index("ix_summary_batch_jobs_state", "summary_batch_jobs", ["state"])
+
+
+def downgrade() -> None:
+    op.drop_table("summary_batch_jobs")
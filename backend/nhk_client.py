@@ -5,12 +5,16 @@ NHKニュースRSSフィードからニュース記事を取得するクライ
 import random
 import time
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional
+from typing import List, Optional
 
 import feedparser
 import requests
 from bs4 import BeautifulSoup
 
+from breaker import CircuitOpenError, breakers
+from metrics import observe_source
+from records import ArticleRecord
+
 
 class NHKNewsClient:
     """NHKニュースRSSフィードからニュース記事を取得するクライアント"""
@@ -26,8 +30,12 @@ class NHKNewsClient:
         "sports": "https://www3.nhk.or.jp/rss/news/cat7.xml",  # スポーツ
     }
 
-    def __init__(self):
-        """クライアントの初期化"""
+    def __init__(self, timeout: int = 10):
+        """
+        Args:
+            timeout: HTTPリクエストのタイムアウト秒数
+        """
+        self.timeout = timeout
         self.session = requests.Session()
         self.session.headers.update(
             {
@@ -37,7 +45,7 @@ class NHKNewsClient:
 
     def fetch_news(
         self, categories: Optional[List[str]] = None, max_articles: int = 20
-    ) -> List[Dict]:
+    ) -> List[ArticleRecord]:
         """
         NHK RSSフィードからニュース記事を取得する
 
@@ -63,7 +71,11 @@ class NHKNewsClient:
             print(f"Fetching RSS feed: {rss_url}")
 
             try:
-                feed = feedparser.parse(rss_url)
+                # feedparser にURLを渡すとタイムアウトを指定できないため、requestsで取得する
+                with observe_source("nhk"), breakers.guard(rss_url):
+                    response = self.session.get(rss_url, timeout=self.timeout)
+                    response.raise_for_status()
+                feed = feedparser.parse(response.content)
 
                 if not feed.entries:
                     print(f"No entries found in RSS feed for category: {category}")
@@ -91,20 +103,22 @@ class NHKNewsClient:
                         published_at = published_at.replace(tzinfo=jst)
 
                     articles.append(
-                        {
-                            "article_id": article_id,
-                            "title": entry.get("title", ""),
-                            "link": link,
-                            "description": entry.get("description", ""),
-                            "published_at": published_at,
-                            "category": category,
-                            "source": "NHK",
-                        }
+                        ArticleRecord(
+                            article_id=article_id,
+                            title=entry.get("title", ""),
+                            link=link,
+                            description=entry.get("description", ""),
+                            published_at=published_at,
+                            topic=category,
+                            source="NHK",
+                        )
                     )
 
                     if len(articles) >= max_articles:
                         break
 
+            except CircuitOpenError:
+                raise
             except Exception as e:
                 print(f"Error fetching RSS feed {rss_url}: {e}")
                 continue
@@ -123,11 +137,13 @@ class NHKNewsClient:
             記事本文のテキスト
         """
         try:
-            # リクエスト間隔を空ける
-            time.sleep(random.uniform(1.0, 3.0))
+            # ブレーカーが open の場合は、間隔を空ける待機もせずに失敗させる
+            with breakers.guard(url):
+                # リクエスト間隔を空ける
+                time.sleep(random.uniform(1.0, 3.0))
 
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
+                response = self.session.get(url, timeout=10)
+                response.raise_for_status()
 
             soup = BeautifulSoup(response.text, "html.parser")
 
@@ -0,0 +1,242 @@
+"""
+ステージ型のストリーミング処理パイプライン
+
+各ステージはスレッドで動作し、上限付きのキューで次のステージとつながる。
+下流が詰まると上流の put がブロックするため、処理中のデータ量はキューの容量で抑えられる。
+ステージごとに並列数と、まとめて処理する件数 (バッチサイズ) を指定できる。
+
+収集処理 (collector.py) では fetch → dedup → enrich → summarize → persist の順につなぎ、
+最初のフィードを取得した時点で要約を始め、要約できた分から保存する。
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from metrics import PIPELINE_ITEMS_TOTAL
+
+# 上流の終了を下流のワーカーに伝える目印
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    パイプラインの1ステージ。
+
+    func は1件 (batch_size > 1 の場合は最大 batch_size 件のリスト) を受け取り、
+    次のステージに渡す要素のiterable (Noneの場合は何も渡さない) を返す。
+    ジェネレータを返した場合は、生成された要素から順に次のステージへ渡す。
+    """
+
+    name: str
+    func: Callable[[Any], Optional[Iterable[Any]]]
+    workers: int = 1
+    batch_size: int = 1
+    # バッチが埋まるのを待つ最大秒数 (上流が遅い場合は集まった分だけで処理する)
+    batch_wait: float = 0.5
+
+
+@dataclass
+class StageStats:
+    """ステージごとの処理件数と稼働時間"""
+
+    workers: int
+    items_in: int = 0
+    items_out: int = 0
+    calls: int = 0
+    busy_seconds: float = 0.0
+    # 下流のキューが一杯で待たされた秒数 (大きい場合は下流がボトルネック)
+    blocked_seconds: float = 0.0
+    max_queue_depth: int = 0
+    errors: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def to_dict(self, elapsed: float) -> Dict:
+        return {
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "calls": self.calls,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            # 全ワーカーが処理し続けた場合を1とした稼働率 (1に近いステージがボトルネック)
+            "utilization": round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+            "items_per_second": round(self.items_in / self.busy_seconds, 2) if self.busy_seconds > 0 else None,
+            "max_queue_depth": self.max_queue_depth,
+            "errors": self.errors,
+        }
+
+
+class Pipeline:
+    """ステージをつないで実行する (1回の run ごとにスレッドを起動し、終了まで待つ)"""
+
+    def __init__(self, stages: List[Stage], queue_size: int = 50):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats: Dict[str, StageStats] = {}
+        self.elapsed = 0.0
+        self._started = 0.0
+        self._threads: List[threading.Thread] = []
+        self._error: Optional[BaseException] = None
+        self._failed = threading.Event()
+
+    def run(self, source: Iterable[Any]) -> Dict[str, Dict]:
+        """
+        source の各要素を先頭のステージに流し、全ステージの処理が終わるまで待つ。
+        いずれかのステージで例外が発生した場合は、残りのデータを読み捨ててから最初の例外を送出する。
+
+        Returns:
+            ステージ名ごとの処理統計
+        """
+        self.start(source)
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self.stats_dict()
+
+    def start(self, source: Iterable[Any]) -> None:
+        """ワーカーを起動し、source の投入を別スレッドで始める (完了は join で待つ)"""
+        self.stats = {s.name: StageStats(workers=s.workers) for s in self.stages}
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self._started = time.perf_counter()
+        self._threads = []
+
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            next_workers = self.stages[i + 1].workers if outbox is not None else 0
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for n in range(stage.workers):
+                # 記録中の段階ごとの所要時間 (metrics.record_stage_durations) をワーカーにも引き継ぐ
+                ctx = contextvars.copy_context()
+                thread = threading.Thread(
+                    target=ctx.run,
+                    args=(self._work, stage, queues[i], outbox, next_workers, remaining, lock),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        def feed():
+            try:
+                for item in source:
+                    if self._failed.is_set():
+                        break
+                    self._put(queues[0], item, self.stages[0].name)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        feeder = threading.Thread(target=contextvars.copy_context().run, args=(feed,), name="pipeline-feed", daemon=True)
+        feeder.start()
+        self._threads.insert(0, feeder)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        全ステージの処理が終わるまで最大 timeout 秒待つ。
+
+        Returns:
+            処理が終わった場合は True (例外は error で確認する)
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if end is None else max(0.0, end - time.monotonic()))
+            if thread.is_alive():
+                return False
+        self.elapsed = time.perf_counter() - self._started
+        return True
+
+    def cancel(self) -> None:
+        """未処理のデータを読み捨てて終了させる (処理中の要素は最後まで処理される)"""
+        self._failed.set()
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self._error
+
+    def stats_dict(self) -> Dict[str, Dict]:
+        elapsed = self.elapsed or (time.perf_counter() - self._started if self.stats else 0.0)
+        return {name: stats.to_dict(elapsed) for name, stats in self.stats.items()}
+
+    def _put(self, q: queue.Queue, item: Any, stage_name: str) -> None:
+        q.put(item)
+        stats = self.stats[stage_name]
+        depth = q.qsize()
+        if depth > stats.max_queue_depth:
+            with stats._lock:
+                stats.max_queue_depth = max(stats.max_queue_depth, depth)
+
+    def _take(self, inbox: queue.Queue, stage: Stage) -> Optional[List[Any]]:
+        """次に処理する要素 (バッチの場合はリスト) を取り出す。上流が終了した場合は None"""
+        item = inbox.get()
+        if item is _DONE:
+            return None
+        if stage.batch_size <= 1:
+            return [item]
+
+        batch = [item]
+        deadline = time.monotonic() + stage.batch_wait
+        while len(batch) < stage.batch_size:
+            try:
+                item = inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _DONE:
+                # 他のワーカーのために終了の目印を戻す
+                inbox.put(_DONE)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self, stage, inbox, outbox, next_workers, remaining, lock) -> None:
+        stats = self.stats[stage.name]
+        next_name = self.stages[self.stages.index(stage) + 1].name if outbox is not None else None
+        try:
+            while True:
+                batch = self._take(inbox, stage)
+                if batch is None:
+                    return
+                if self._failed.is_set():
+                    # 失敗後は上流が詰まらないよう読み捨てる
+                    continue
+
+                started = time.perf_counter()
+                blocked = 0.0
+                produced = 0
+                try:
+                    # 出力は生成された順に次のステージへ渡す (ジェネレータの場合は全件の生成を待たない)
+                    for output in stage.func(batch if stage.batch_size > 1 else batch[0]) or ():
+                        produced += 1
+                        if outbox is not None:
+                            put_started = time.perf_counter()
+                            self._put(outbox, output, next_name)
+                            blocked += time.perf_counter() - put_started
+                except BaseException as e:
+                    with stats._lock:
+                        stats.errors += 1
+                    if not self._failed.is_set():
+                        self._error = e
+                        self._failed.set()
+                    print(f"Pipeline stage '{stage.name}' failed: {e}")
+                finally:
+                    busy = time.perf_counter() - started - blocked
+                    with stats._lock:
+                        stats.calls += 1
+                        stats.items_in += len(batch)
+                        stats.items_out += produced
+                        stats.busy_seconds += busy
+                        stats.blocked_seconds += blocked
+                    PIPELINE_ITEMS_TOTAL.labels(stage=stage.name).inc(len(batch))
+        finally:
+            # このステージの最後のワーカーが終了したら、次のステージの全ワーカーに終了を伝える
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                for _ in range(next_workers):
+                    outbox.put(_DONE)
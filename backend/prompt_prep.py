@@ -0,0 +1,258 @@
+"""
+バッチ要約のプロンプトに入れる記事テキストの整形
+
+Google Newsの description はタイトルと配信元名を繰り返しているだけのことが多く、
+そのまま入れると要約の材料にならないトークンに毎回課金される。ここでは:
+
+- タイトル末尾の " - 配信元" を分け、本文の先頭・末尾や1文だけのタイトル・配信元名の繰り返しを除く
+- 「続きを読む」、著作権表示などの定型文と、重複した文を除く
+- 記事1件あたりのトークン数の予算 (PROMPT_ARTICLE_TOKENS) に収まるよう、文の区切りで切り詰める
+
+トークン数は文字数から見積もる。文字数あたりのトークン数は、最初にモデルのトークンカウンター
+(count_tokens) で測り、その後はAPI呼び出しごとに返される実際の入力トークン数で補正する。
+"""
+
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from records import ArticleRecord
+
+# 記事1件あたりの本文のトークン数の上限
+PROMPT_ARTICLE_TOKENS = int(os.getenv("PROMPT_ARTICLE_TOKENS", "300"))
+# 測定前に使う、1トークンあたりの文字数 (日本語のニュース記事の目安)
+DEFAULT_CHARS_PER_TOKEN = 1.5
+# 測定値への補正の重み (API呼び出しごとの実測値をこの割合で反映する)
+CALIBRATION_WEIGHT = 0.2
+# これより短いテキストでは測定しない (定型部分の比率が大きく、誤差が大きい)
+MIN_CALIBRATION_CHARS = 200
+
+# 要約の材料にならない定型文 (文ごと除く)
+BOILERPLATE_PATTERNS = [
+    re.compile(p)
+    for p in [
+        r"(記事の)?続きを読む",
+        r"全文を(読む|表示)",
+        r"Google ?ニュースで(すべて|全て)の記事を見る",
+        r"(すべて|全て)の記事を見る",
+        r"無断(転載|複製)",
+        r"[Cc]opyright|©|\(c\)|All [Rr]ights [Rr]eserved",
+        r"^(関連記事|関連ニュース|写真|動画|画像)[:：]",
+        r"(購読|会員登録|ログイン)(すると|して|が必要)",
+    ]
+]
+# 文の区切り (句点・感嘆符・疑問符の後、または英文のピリオドと空白)
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])|(?<=\.)\s+")
+_SPACES = re.compile(r"\s+")
+# 見出し・配信元名と本文の間の区切り
+_SEPARATOR = r"[\s\-:|｜：–—]"
+_SEPARATORS = re.compile(rf"^{_SEPARATOR}+|{_SEPARATOR}+$")
+
+
+def split_title(title: str) -> Tuple[str, Optional[str]]:
+    """Google Newsのタイトル "見出し - 配信元" を (見出し, 配信元) に分ける"""
+    if " - " in title:
+        headline, publisher = title.rsplit(" - ", 1)
+        if headline.strip() and 0 < len(publisher.strip()) <= 40:
+            return headline.strip(), publisher.strip()
+    return title.strip(), None
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def join_sentences(sentences: List[str]) -> str:
+    """文をつなげる (日本語の句点の後には空白を入れない)"""
+    text = ""
+    for sentence in sentences:
+        if text and not text.endswith(("。", "！", "？")):
+            text += " "
+        text += sentence
+    return text
+
+
+def _strip_echoes(sentence: str, echoes: List[str]) -> str:
+    """
+    文の先頭・末尾にある見出し・配信元名の繰り返しを除く。
+    区切り (空白・"-"・":"・"|" など) で分かれている場合だけ除き、語の一部 (「日経平均」の「日経」など) は残す。
+    """
+    changed = True
+    while sentence and changed:
+        changed = False
+        for echo in echoes:
+            stripped = _SEPARATORS.sub("", sentence.rstrip("。.").strip())
+            if stripped == echo:
+                return ""
+            escaped = re.escape(echo)
+            for pattern in (rf"^{escaped}{_SEPARATOR}+", rf"{_SEPARATOR}+{escaped}[。.]?$"):
+                rest = re.sub(pattern, " ", sentence).strip()
+                if rest != sentence:
+                    sentence = rest
+                    changed = True
+    return sentence
+
+
+def clean_text(text: str, headline: str = "", publisher: Optional[str] = None) -> str:
+    """タイトル・配信元名の繰り返し、定型文、重複した文を除く"""
+    text = _SPACES.sub(" ", text or "").strip()
+    echoes = [echo for echo in (headline, publisher) if echo and len(echo) >= 2]
+    sentences = []
+    seen = set()
+    for sentence in split_sentences(text):
+        sentence = _strip_echoes(sentence, echoes)
+        if any(p.search(sentence) for p in BOILERPLATE_PATTERNS):
+            continue
+        # 記号だけが残った文 (「。」や「 - 」など) も除く
+        if not re.search(r"\w", sentence):
+            continue
+        if sentence in seen:
+            continue
+        seen.add(sentence)
+        sentences.append(sentence)
+    return join_sentences(sentences)
+
+
+class TokenCounter:
+    """
+    文字数からトークン数を見積もる。
+    count_fn (モデルのトークンカウンター) で最初に1回測り、observe() で実際の入力トークン数から補正する。
+    """
+
+    def __init__(self, count_fn: Optional[Callable[[str], int]] = None, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        self.count_fn = count_fn
+        self.chars_per_token = chars_per_token
+        self.calibrated = count_fn is None
+        self._lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def calibrate(self, text: str) -> None:
+        """モデルのトークンカウンターで測る (1回だけ。失敗した場合は目安の値のまま)"""
+        if self.calibrated or len(text) < MIN_CALIBRATION_CHARS:
+            return
+        self.calibrated = True
+        try:
+            tokens = self.count_fn(text)
+        except Exception as e:
+            print(f"Token count failed, using estimate: {e}")
+            return
+        if tokens:
+            with self._lock:
+                self.chars_per_token = len(text) / tokens
+
+    def observe(self, text: str, tokens: Optional[int]) -> None:
+        """API呼び出しで実際に数えられた入力トークン数で補正する"""
+        if not tokens or len(text) < MIN_CALIBRATION_CHARS:
+            return
+        with self._lock:
+            measured = len(text) / tokens
+            self.chars_per_token += (measured - self.chars_per_token) * CALIBRATION_WEIGHT
+
+    def trim(self, text: str, budget: int) -> str:
+        """予算 (トークン数) に収まるよう、文の区切りで切り詰める (1文目が収まらない場合は文字数で切る)"""
+        if self.estimate(text) <= budget:
+            return text
+        kept = ""
+        sentences = []
+        for sentence in split_sentences(text):
+            candidate = join_sentences(sentences + [sentence])
+            if self.estimate(candidate) > budget:
+                break
+            sentences.append(sentence)
+            kept = candidate
+        if not kept:
+            kept = text[:max(1, int(budget * self.chars_per_token) - 1)] + "…"
+        return kept
+
+
+def prepare_article(article: ArticleRecord, counter: TokenCounter, budget: int = PROMPT_ARTICLE_TOKENS) -> Tuple[str, str]:
+    """
+    記事を (プロンプト用のタイトル, 本文) にする。
+    本文は抽出した記事本文があればそれを、なければRSSの概要を使う。
+    """
+    title = article.title or "タイトルなし"
+    headline, publisher = split_title(title)
+    text = clean_text(article.content or article.description or "", headline, publisher)
+    return headline, counter.trim(text, budget)
+
+
+def prepare_batch(
+    articles: List[ArticleRecord], counter: TokenCounter, budget: int = PROMPT_ARTICLE_TOKENS
+) -> Tuple[str, Dict]:
+    """
+    バッチ要約のプロンプトの記事一覧を作る。
+
+    Returns:
+        (記事一覧のテキスト, {"tokens": 見積もりのトークン数, "tokens_saved": 整形前の形式との差 (増えた場合は0)})
+    """
+    prepared = ""
+    original = ""
+    for i, article in enumerate(articles, 1):
+        headline, text = prepare_article(article, counter, budget)
+        prepared += f"{i}. 【{headline}】\n   {text}\n\n"
+        # 整形前の形式 (タイトルそのままと、RSSの概要の先頭500文字)
+        raw = (article.description or "")[:500]
+        original += f"{i}. 【{article.title or 'タイトルなし'}】\n   {raw}\n\n"
+    tokens = counter.estimate(prepared)
+    return prepared, {"tokens": tokens, "tokens_saved": max(0, counter.estimate(original) - tokens)}
+
+
+# =====================================================
+# プロンプト (Summarizer の同期呼び出しと、batch_jobs.py のバッチジョブで共通)
+# =====================================================
+
+
+def video_prompt(transcript: str) -> str:
+    """動画の字幕 (または説明文) の要約のプロンプト"""
+    return f"""
+あなたはプロのニュース編集者です。提供された「YouTubeニュース動画のテキスト（字幕または説明文）」を解析し、視聴者が短時間で内容を把握できる高品質な要約を作成してください。
+
+【注意点】
+- 「この字幕テキストは...」「テレビ朝日がお届けする...」「最新ニュースをライブで...」といった、動画の内容そのものではないメタ情報や定型文、チャンネルの紹介などは、要約や重要ポイントに含めないでください。
+- 放送された具体的な「事実（事件、事故、政治、経済、気象など）」にのみ焦点を当ててください。
+- まだ要約すべきニュース事実がない場合は、その旨を簡潔に記述してください。
+
+【出力形式】
+以下のJSON形式で出力してください。
+{{
+  "summary": "動画全体の流れを掴むための簡潔な要約（300文字程度）。事実に基づいた具体的な内容にすること。",
+  "key_points": [
+    "重要なニュース項目1の具体的な内容",
+    "重要なニュース項目2の具体的な内容",
+    "重要なニュース項目3の具体的な内容",
+    "..."
+  ]
+}}
+
+対象のテキスト:
+{transcript}
+"""
+
+
+def batch_prompt(articles_text: str) -> str:
+    """複数の記事をまとめて要約するプロンプト (articles_text は prepare_batch で整形した記事一覧)"""
+    return f"""
+あなたはプロのニュース編集者です。以下の複数のニュース記事を、それぞれ1〜2行の簡潔な要約にまとめてください。
+
+【注意点】
+- 各記事の核心となる事実のみを抽出してください。
+- 5W1H（いつ、どこで、誰が、何を）を意識した要約を心がけてください。
+- 定型文やメタ情報は含めないでください。
+
+【出力形式】
+以下のJSON配列形式で出力してください。記事の順番は入力と同じにしてください。
+[
+  {{"index": 1, "title": "記事タイトル", "summary": "1〜2行の簡潔な要約"}},
+  {{"index": 2, "title": "記事タイトル", "summary": "1〜2行の簡潔な要約"}},
+  ...
+]
+
+【対象の記事一覧】
+{articles_text}
+"""
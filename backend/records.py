@@ -0,0 +1,51 @@
+"""
+取得した記事・動画のレコード
+
+各クライアント (Google News, NHK, YouTube) が返し、収集パイプラインの補完・要約・保存の各ステージが受け渡す。
+1件ごとに同じキー文字列を持つ dict ではなく __slots__ のデータクラスにして、1回の収集で数千件を扱う場合の
+メモリとアクセスの負荷を減らす (benchmarks/bench_records.py)。
+DBやAPIの応答に書き出す dict (見出しなど) は、保存の直前に作る。
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+@dataclass(slots=True)
+class ArticleRecord:
+    """記事1件 (YouTubeの動画も記事の形式に揃えて扱う)"""
+
+    article_id: str
+    title: str = ""
+    link: str = ""
+    description: str = ""
+    published_at: Optional[datetime] = None
+    source: Optional[str] = None  # "Google News", "NHK", "YouTube"
+    topic: Optional[str] = None  # Google Newsのトピック、NHKのカテゴリ、YouTubeのチャンネルID
+    content: Optional[str] = None  # 配信元のページから抽出した本文 (enrich.py)
+    summary: str = ""
+    key_points: Optional[List[str]] = None  # 要約で置き換える場合だけ設定する
+
+    def headline(self) -> Dict:
+        """日別ダイジェストの見出しの形式"""
+        return {
+            "article_id": self.article_id,
+            "title": self.title,
+            "summary": self.summary,
+            "link": self.link,
+            "source": self.source,
+            "topic": self.topic,
+            "published_at": self.published_at.isoformat() if self.published_at else None,
+        }
+
+
+@dataclass(slots=True)
+class VideoRecord:
+    """YouTubeのRSSの動画1件"""
+
+    video_id: str
+    title: str = ""
+    description: str = ""
+    published_at: Optional[str] = None  # RSSの文字列のまま (ISO 8601)
+    thumbnail: Optional[str] = None
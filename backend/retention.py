@@ -0,0 +1,111 @@
+"""
+古い字幕・記事本文の保存期間管理
+
+公開から指定日数 (RETENTION_DAYS) を過ぎた動画の字幕を削除し、記事本文 (Article.content) を空にする。
+要約・重要ポイント・概要は残すため、一覧や詳細の表示には影響しない。
+RETENTION_ARCHIVE_DIR を指定した場合は、削除前に gzip圧縮したJSON Lines形式のファイルに書き出す。
+
+スケジューラ (リーダーのワーカー) から1日1回実行するほか、コマンドラインからも実行できる:
+    python retention.py --days 90 --archive-dir /data/archive
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer
+
+from database import Article, Video, VideoTranscript
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))  # 0の場合は無効
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR")
+# 1回のトランザクションで処理する件数
+BATCH_SIZE = 200
+
+
+def _archive(archive_dir: Optional[str], kind: str, records: List[Dict]) -> None:
+    """レコードをアーカイブファイルに追記する (gzipのメンバーを追加するため、通常のgzipとして読める)"""
+    if not archive_dir or not records:
+        return
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{kind}-{datetime.now(timezone.utc):%Y%m%d}.jsonl.gz")
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def purge_transcripts(db: Session, cutoff: datetime, archive_dir: Optional[str] = None) -> int:
+    """公開日時 (不明な場合は登録日時) が cutoff より前の動画の字幕を削除する。バッチごとにcommitする。"""
+    count = 0
+    while True:
+        rows = (
+            db.query(VideoTranscript)
+            .join(Video)
+            .filter(func.coalesce(Video.published_at, Video.created_at) < cutoff)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            return count
+        _archive(archive_dir, "transcripts", [{"youtube_id": r.youtube_id, "transcript": r.text} for r in rows])
+        for row in rows:
+            db.delete(row)
+        db.commit()
+        count += len(rows)
+
+
+def compact_article_contents(db: Session, cutoff: datetime, archive_dir: Optional[str] = None) -> int:
+    """公開日時 (不明な場合は登録日時) が cutoff より前の記事の本文を空にする。バッチごとにcommitする。"""
+    count = 0
+    while True:
+        articles = (
+            db.query(Article)
+            .options(undefer(Article.content))
+            .filter(Article.content.isnot(None), func.coalesce(Article.published_at, Article.created_at) < cutoff)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not articles:
+            return count
+        _archive(archive_dir, "articles", [
+            {"article_id": a.article_id, "link": a.link, "published_at": a.published_at, "content": a.content}
+            for a in articles
+        ])
+        for article in articles:
+            article.content = None
+        db.commit()
+        count += len(articles)
+
+
+def apply_retention(db: Session, days: int = RETENTION_DAYS, archive_dir: Optional[str] = RETENTION_ARCHIVE_DIR) -> Dict:
+    """保存期間を過ぎた字幕と記事本文を整理する"""
+    if days <= 0:
+        return {"transcripts": 0, "articles": 0}
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    result = {
+        "transcripts": purge_transcripts(db, cutoff, archive_dir),
+        "articles": compact_article_contents(db, cutoff, archive_dir),
+    }
+    print(f"Retention ({days} days): {result}")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="古い字幕・記事本文の整理")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS or 90, help="保存日数")
+    parser.add_argument("--archive-dir", default=RETENTION_ARCHIVE_DIR, help="削除前に書き出すディレクトリ")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        apply_retention(db, args.days, args.archive_dir)
+    finally:
+        db.close()
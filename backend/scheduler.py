@@ -0,0 +1,431 @@
+"""
+フィード監視スケジューラ
+
+ホストのcronで固定間隔に収集APIを叩く代わりに、アプリ内のAPSchedulerで
+各ソース (Google Newsトピック、NHKカテゴリ、YouTubeチャンネル) を個別の間隔でポーリングする。
+
+- ポーリング間隔はフィードごとに観測した更新頻度に合わせて調整する
+  (更新があれば短く、変更がなければバックオフで長くする)
+- フィードの更新を検知したときだけ収集処理を起動する (複数フィードの変更はまとめて1回にする)
+- ポーリング状態はDBに保存し、停止中に期限を過ぎたフィードは起動直後に取得し直す
+- RETENTION_DAYS を設定した場合、古い字幕・記事本文の整理を1日1回実行する (retention.py)
+- gunicornの複数ワーカーのうち、PostgreSQLのアドバイザリロックを取得した1つだけが実行する
+"""
+
+import hashlib
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import feedparser
+import requests
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import text
+
+from breaker import breakers
+from database import FeedPollState, SessionLocal, engine
+
+# スケジューラのリーダー選出に使うアドバイザリロックのキー (任意の固定値)
+LEADER_LOCK_KEY = 0x4E43_5343  # "NCSC"
+
+MIN_INTERVAL = int(os.getenv("SCHEDULER_MIN_INTERVAL", "300"))
+MAX_INTERVAL = int(os.getenv("SCHEDULER_MAX_INTERVAL", "7200"))
+INITIAL_INTERVAL = int(os.getenv("SCHEDULER_INITIAL_INTERVAL", "1800"))
+BACKOFF_FACTOR = float(os.getenv("SCHEDULER_BACKOFF_FACTOR", "1.5"))
+# 更新間隔の指数移動平均の重み
+EMA_ALPHA = 0.3
+# 変更検知から収集開始までの待ち時間 (同時期の複数フィードの変更を1回の収集にまとめる)
+COLLECT_DEBOUNCE_SECONDS = int(os.getenv("SCHEDULER_COLLECT_DEBOUNCE", "60"))
+LEADER_CHECK_SECONDS = 30
+
+GOOGLE_NEWS_TOPIC_URL = "https://news.google.com/rss/topics/{topic_id}?hl=ja&gl=JP&ceid=JP:ja"
+GOOGLE_NEWS_TOP_URL = "https://news.google.com/rss?hl=ja&gl=JP&ceid=JP:ja"
+YOUTUBE_FEED_URL = "https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+
+
+@dataclass
+class FeedSpec:
+    """ポーリング対象のフィード"""
+
+    key: str
+    url: str
+
+
+def _env_list(name: str, default: str = "") -> List[str]:
+    return [v.strip() for v in os.getenv(name, default).split(",") if v.strip()]
+
+
+def configured_feeds() -> List[FeedSpec]:
+    """環境変数からポーリング対象のフィード一覧を組み立てる"""
+    from google_news_client import GoogleNewsClient
+    from nhk_client import NHKNewsClient
+
+    feeds = []
+    for topic in _env_list("SCHEDULER_GOOGLE_TOPICS", "top"):
+        topic_id = GoogleNewsClient.TOPICS.get(topic)
+        if topic_id:
+            feeds.append(FeedSpec(f"google:{topic}", GOOGLE_NEWS_TOPIC_URL.format(topic_id=topic_id)))
+        elif topic == "top":
+            feeds.append(FeedSpec("google:top", GOOGLE_NEWS_TOP_URL))
+        else:
+            print(f"Unknown Google News topic: {topic}")
+
+    for category in _env_list("SCHEDULER_NHK_CATEGORIES", "main"):
+        if category in NHKNewsClient.RSS_FEEDS:
+            feeds.append(FeedSpec(f"nhk:{category}", NHKNewsClient.RSS_FEEDS[category]))
+        else:
+            print(f"Unknown NHK category: {category}")
+
+    for channel_id in _env_list("YOUTUBE_CHANNEL_IDS"):
+        feeds.append(FeedSpec(f"youtube:{channel_id}", YOUTUBE_FEED_URL.format(channel_id=channel_id)))
+
+    return feeds
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """DBから読んだ日時をUTCのaware datetimeに揃える (SQLiteはnaiveで返すため)"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _clamp(seconds: float) -> int:
+    return int(max(MIN_INTERVAL, min(MAX_INTERVAL, seconds)))
+
+
+def feed_fingerprint(content: bytes) -> str:
+    """
+    フィードのエントリ一覧からハッシュを計算する。
+    Google Newsのフィードは lastBuildDate が毎回変わるため、本文全体ではなくエントリのID/リンクのみを使う。
+    """
+    feed = feedparser.parse(content)
+    ids = sorted(entry.get("id") or entry.get("link", "") for entry in feed.entries)
+    return hashlib.sha1("\n".join(ids).encode()).hexdigest()
+
+
+def update_interval(state: FeedPollState, changed: bool, now: datetime) -> None:
+    """
+    ポーリング結果に応じて次回の間隔を決める。
+
+    - 変更あり: 観測した更新間隔の移動平均を更新し、その半分の間隔でポーリングする
+      (更新1回につき2回程度確認すれば取りこぼしが少ない)
+    - 変更なし: 間隔をBACKOFF_FACTOR倍に延ばす
+    """
+    if changed:
+        last_changed = _as_utc(state.last_changed_at)
+        if last_changed is not None:
+            gap = (now - last_changed).total_seconds()
+            if state.avg_change_interval is None:
+                state.avg_change_interval = gap
+            else:
+                state.avg_change_interval = EMA_ALPHA * gap + (1 - EMA_ALPHA) * state.avg_change_interval
+            state.interval_seconds = _clamp(state.avg_change_interval / 2)
+        else:
+            state.interval_seconds = _clamp(state.interval_seconds / 2)
+        state.last_changed_at = now
+        state.unchanged_count = 0
+    else:
+        state.interval_seconds = _clamp(state.interval_seconds * BACKOFF_FACTOR)
+        state.unchanged_count = (state.unchanged_count or 0) + 1
+    state.last_checked_at = now
+
+
+def next_run_time(state: Optional[FeedPollState], now: datetime) -> datetime:
+    """
+    次回のポーリング時刻を求める。
+    停止中に期限を過ぎていた場合は、すぐに実行する (キャッチアップ)。
+    """
+    if state is None or state.last_checked_at is None:
+        return now
+    due = _as_utc(state.last_checked_at) + timedelta(seconds=state.interval_seconds)
+    return max(due, now)
+
+
+class LeaderLock:
+    """
+    PostgreSQLのセッションレベルのアドバイザリロックによるリーダー選出。
+    ロックを持つ接続を保持し続け、接続が切れた場合はリーダーを降りる。
+    PostgreSQL以外 (ローカルのSQLiteなど) では常にリーダーとして扱う。
+    """
+
+    def __init__(self, key: int = LEADER_LOCK_KEY):
+        self.key = key
+        self.conn = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.conn is not None or engine.dialect.name != "postgresql"
+
+    def try_acquire(self) -> bool:
+        """ロックを取得 (または保持していることを確認) する"""
+        if engine.dialect.name != "postgresql":
+            return True
+
+        if self.conn is not None:
+            try:
+                self.conn.execute(text("SELECT 1"))
+                self.conn.commit()
+                return True
+            except Exception as e:
+                print(f"Scheduler leader connection lost: {e}")
+                self._close()
+
+        conn = engine.connect()
+        try:
+            acquired = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+            ).scalar()
+            conn.commit()
+        except Exception as e:
+            print(f"Error acquiring scheduler leader lock: {e}")
+            conn.close()
+            return False
+
+        if acquired:
+            self.conn = conn
+            return True
+        conn.close()
+        return False
+
+    def release(self) -> None:
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self.conn.commit()
+        except Exception as e:
+            print(f"Error releasing scheduler leader lock: {e}")
+        self._close()
+
+    def _close(self) -> None:
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+
+class NewsScheduler:
+    """フィードごとの適応的なポーリングと収集処理の起動を行うスケジューラ"""
+
+    def __init__(self, feeds: Optional[List[FeedSpec]] = None):
+        self.feeds = feeds if feeds is not None else configured_feeds()
+        self.scheduler = BackgroundScheduler(
+            timezone="UTC",
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": None},
+        )
+        self.leader = LeaderLock()
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        })
+        self.timeout = 10
+        self._polling = False
+
+    def start(self) -> None:
+        self.scheduler.start()
+        self.scheduler.add_job(
+            self._elect,
+            "interval",
+            seconds=LEADER_CHECK_SECONDS,
+            id="leader-election",
+            next_run_time=datetime.now(timezone.utc),
+        )
+        print(f"Scheduler started with {len(self.feeds)} feeds")
+
+    def shutdown(self) -> None:
+        self.scheduler.shutdown(wait=False)
+        self.leader.release()
+
+    # -------------------------------------------------
+    # リーダー選出
+    # -------------------------------------------------
+
+    def _elect(self) -> None:
+        if self.leader.try_acquire():
+            if not self._polling:
+                print(f"Scheduler elected as leader (pid={os.getpid()})")
+                self._start_polling()
+        elif self._polling:
+            print(f"Scheduler lost leadership (pid={os.getpid()})")
+            self._stop_polling()
+
+    def _start_polling(self) -> None:
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            states = {s.feed_key: s for s in db.query(FeedPollState).all()}
+        finally:
+            db.close()
+
+        for i, feed in enumerate(self.feeds):
+            # 期限切れのフィードが一斉に取得されないよう、数秒ずつずらす
+            run_at = next_run_time(states.get(feed.key), now) + timedelta(seconds=i * 2)
+            self._schedule_poll(feed, run_at)
+
+        from retention import RETENTION_DAYS
+
+        if RETENTION_DAYS > 0:
+            self.scheduler.add_job(
+                self._retention,
+                "interval",
+                days=1,
+                id="retention",
+                next_run_time=now + timedelta(minutes=10),
+                replace_existing=True,
+            )
+
+        from batch_jobs import BATCH_POLL_MINUTES
+
+        if BATCH_POLL_MINUTES > 0:
+            self.scheduler.add_job(
+                self._poll_batch_jobs,
+                "interval",
+                minutes=BATCH_POLL_MINUTES,
+                id="batch-jobs",
+                next_run_time=now + timedelta(minutes=1),
+                replace_existing=True,
+            )
+        self._polling = True
+
+    def _stop_polling(self) -> None:
+        for job in self.scheduler.get_jobs():
+            if job.id != "leader-election":
+                job.remove()
+        self._polling = False
+
+    # -------------------------------------------------
+    # フィードのポーリング
+    # -------------------------------------------------
+
+    def _schedule_poll(self, feed: FeedSpec, run_at: datetime) -> None:
+        self.scheduler.add_job(
+            self._poll,
+            "date",
+            run_date=run_at,
+            args=[feed],
+            id=f"poll:{feed.key}",
+            replace_existing=True,
+        )
+
+    def _poll(self, feed: FeedSpec) -> None:
+        if not self.leader.is_leader:
+            return
+
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            state = db.get(FeedPollState, feed.key)
+            if state is None:
+                state = FeedPollState(feed_key=feed.key, interval_seconds=INITIAL_INTERVAL, unchanged_count=0)
+                db.add(state)
+
+            try:
+                changed = self._check_feed(feed, state)
+            except Exception as e:
+                # 取得失敗は「変更なし」と同様にバックオフする
+                print(f"Error polling feed {feed.key}: {e}")
+                changed = False
+
+            update_interval(state, changed, now)
+            db.commit()
+            interval = state.interval_seconds
+        except Exception as e:
+            print(f"Error updating poll state for {feed.key}: {e}")
+            db.rollback()
+            interval = INITIAL_INTERVAL
+            changed = False
+        finally:
+            db.close()
+
+        print(f"Polled {feed.key}: changed={changed}, next in {interval}s")
+        if changed:
+            self._request_collect()
+
+        # 複数ワーカー・複数フィードのポーリングが同じ時刻に揃わないよう揺らぎを入れる
+        jitter = random.uniform(0, interval * 0.05)
+        self._schedule_poll(feed, now + timedelta(seconds=interval + jitter))
+
+    def _check_feed(self, feed: FeedSpec, state: FeedPollState) -> bool:
+        """条件付きGETでフィードを取得し、前回から変更があったかを返す"""
+        headers = {}
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+
+        with breakers.guard(feed.url):
+            response = self.session.get(feed.url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                return False
+            response.raise_for_status()
+
+        state.etag = response.headers.get("ETag")
+        state.last_modified = response.headers.get("Last-Modified")
+
+        fingerprint = feed_fingerprint(response.content)
+        changed = fingerprint != state.fingerprint
+        state.fingerprint = fingerprint
+        return changed
+
+    # -------------------------------------------------
+    # 収集処理
+    # -------------------------------------------------
+
+    def _request_collect(self) -> None:
+        """収集処理を予約する (予約済みの場合は何もしない)"""
+        if self.scheduler.get_job("collect"):
+            return
+        self.scheduler.add_job(
+            self._collect,
+            "date",
+            run_date=datetime.now(timezone.utc) + timedelta(seconds=COLLECT_DEBOUNCE_SECONDS),
+            id="collect",
+        )
+
+    def _retention(self) -> None:
+        from retention import apply_retention
+
+        if not self.leader.is_leader:
+            return
+        db = SessionLocal()
+        try:
+            apply_retention(db)
+        except Exception as e:
+            print(f"Error in retention: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _poll_batch_jobs(self) -> None:
+        from batch_jobs import poll_jobs
+
+        if not self.leader.is_leader:
+            return
+        db = SessionLocal()
+        try:
+            counts = poll_jobs(db)
+            if counts["ingested"] or counts["failed"]:
+                print(f"Batch jobs: {counts}")
+        except Exception as e:
+            print(f"Error polling batch jobs: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _collect(self) -> None:
+        from collector import run_collect
+
+        db = SessionLocal()
+        try:
+            result = run_collect(db, trigger="scheduler")
+            print(f"Scheduled collect finished: {result}")
+        except Exception as e:
+            print(f"Error in scheduled collect: {e}")
+            db.rollback()
+        finally:
+            db.close()
@@ -0,0 +1,281 @@
+"""
+ニュースの全文検索
+
+ダイジェストの見出し・要約と記事 (Article) のタイトル・要約を、文字bigramの転置インデックスで検索する。
+日本語は単語の区切りがないため、形態素解析の代わりに連続する2文字を1語として扱う。
+1文字の検索語 (「株」「米」など) も検索できるよう、インデックスには各文字 (unigram) も加える。
+英数字は単語単位でインデックスする。
+
+インデックスはDBのテーブル (search_documents / search_postings) に保持するため、
+複数ワーカーから同じインデックスを参照でき、PostgreSQL以外 (テスト用のSQLite) でも動作する。
+
+使い方 (既存データからインデックスを作り直す):
+    python search.py --reindex
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from database import Article, DailyDigest, SearchDocument, SearchPosting
+
+# タイトル中の語は要約中の語より重く扱う
+TITLE_WEIGHT = 3.0
+SUMMARY_WEIGHT = 1.0
+
+# 英数字の単語、またはそれ以外の文字 (漢字・かな等) の連続
+_TOKEN_RE = re.compile(r"[0-9a-z]+|[^\W\d_a-z]+")
+
+
+def normalize(text: str) -> str:
+    """全角英数字の半角化・小文字化を行う"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text: str, unigrams: bool = False) -> List[str]:
+    """
+    テキストを検索語に分割する。
+    英数字は単語単位、それ以外は文字bigram (1文字だけの場合はその文字) にする。
+    unigrams=True (インデックス用) の場合は、2文字以上の連続の各文字も加える。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(normalize(text)):
+        if run.isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            if unigrams:
+                tokens.extend(run)
+    return tokens
+
+
+def _term_weights(title: str, summary: str) -> Dict[str, float]:
+    weights = Counter()
+    for term in tokenize(title, unigrams=True):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(summary, unigrams=True):
+        weights[term] += SUMMARY_WEIGHT
+    return weights
+
+
+# 1文で追加する文書数 (SQLiteのバインド変数の上限を超えないようにする)
+CHUNK_SIZE = 500
+
+
+def _add_documents(db: Session, docs: List[Dict]) -> None:
+    """
+    文書をまとめて追加する。文書は1回の複数行 INSERT ... RETURNING でIDを受け取り、
+    全文書のポスティングを1回の executemany で挿入する (文書数によらずDBとの往復は2回)。
+    """
+    if not docs:
+        return
+    ids = dict(db.execute(
+        insert(SearchDocument).values(docs).returning(SearchDocument.doc_key, SearchDocument.id)
+    ).all())
+    rows = [
+        {"term": term, "document_id": ids[doc["doc_key"]], "weight": weight}
+        for doc in docs
+        for term, weight in _term_weights(doc["title"], doc["summary"] or "").items()
+    ]
+    if rows:
+        db.execute(insert(SearchPosting), rows)
+
+
+def _delete_documents(db: Session, *criteria) -> None:
+    doc_ids = select(SearchDocument.id).where(*criteria)
+    db.execute(delete(SearchPosting).where(SearchPosting.document_id.in_(doc_ids)))
+    db.execute(delete(SearchDocument).where(*criteria))
+
+
+def headline_key(day: date, headline: Dict) -> str:
+    """
+    見出しの文書キー (同じ日の同じ見出しIDは同じ文書として扱う)。
+    enrichでリンクが配信元のURLに置き換わっても、記事IDが同じなら同じ文書になる。
+    """
+    # digests は search を読み込むため、循環importを避けてここで読み込む
+    from digests import headline_id
+    return f"headline:{day.isoformat()}:{headline_id(headline)}"
+
+
+def index_headlines(db: Session, day: date, headlines: List[Dict]) -> None:
+    """
+    指定日の見出しをインデックスに追加する (同じ見出しが既にあれば置き換える)。
+    commitは呼び出し元で行う。
+    """
+    keys = {}
+    for headline in headlines:
+        keys[headline_key(day, headline)] = headline
+    if not keys:
+        return
+    items = list(keys.items())
+    for i in range(0, len(items), CHUNK_SIZE):
+        chunk = items[i:i + CHUNK_SIZE]
+        _delete_documents(db, SearchDocument.doc_key.in_([key for key, _ in chunk]))
+        _add_documents(db, [
+            {
+                "doc_key": key,
+                "kind": "headline",
+                "date": day,
+                "title": headline.get("title", ""),
+                "summary": headline.get("summary", ""),
+                "link": headline.get("link", ""),
+                "source": headline.get("source"),
+                "published_at": _parse_published(headline.get("published_at")),
+            }
+            for key, headline in chunk
+        ])
+
+
+def _article_document(article) -> Dict:
+    return {
+        "doc_key": f"article:{article.article_id}",
+        "kind": "article",
+        "date": article.published_at.date() if article.published_at else None,
+        "title": article.title,
+        "summary": article.summary or article.description or "",
+        "link": article.link,
+        "source": article.source,
+        "published_at": article.published_at,
+    }
+
+
+# インデックスに使う記事の列 (本文などは読まない)
+_ARTICLE_COLUMNS = (
+    Article.article_id, Article.title, Article.summary, Article.description,
+    Article.link, Article.source, Article.published_at,
+)
+
+
+def index_article(db: Session, article: Article) -> None:
+    """
+    記事をインデックスし直す。
+    commitは呼び出し元で行う。
+    """
+    doc = _article_document(article)
+    _delete_documents(db, SearchDocument.doc_key == doc["doc_key"])
+    _add_documents(db, [doc])
+
+
+def index_articles(db: Session, article_ids: List[str]) -> None:
+    """
+    保存済みの記事をまとめてインデックスし直す (ingest.upsert_articles から呼ぶ)。
+    空の要約で上書きしなかった既存の要約などを反映するため、保存された行を読み直してインデックスする。
+    記事数によらず、読み直し・削除・追加の数回の往復で済む。commitは呼び出し元で行う。
+    """
+    for i in range(0, len(article_ids), CHUNK_SIZE):
+        rows = db.execute(select(*_ARTICLE_COLUMNS).where(Article.article_id.in_(article_ids[i:i + CHUNK_SIZE]))).all()
+        if not rows:
+            continue
+        docs = [_article_document(row) for row in rows]
+        _delete_documents(db, SearchDocument.doc_key.in_([doc["doc_key"] for doc in docs]))
+        _add_documents(db, docs)
+
+
+def _parse_published(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def search(db: Session, query: str, page: int = 1, per_page: int = 20) -> Tuple[int, List[Dict]]:
+    """
+    全ての検索語を含む文書を、TF-IDFに近いスコアの降順で返す。
+
+    Returns:
+        (該当件数, 指定ページの結果リスト)
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return 0, []
+
+    # 各語の文書頻度から重み (IDF) を求める。1語でも該当がなければ結果は0件
+    doc_freqs = dict(
+        db.query(SearchPosting.term, func.count(SearchPosting.document_id))
+        .filter(SearchPosting.term.in_(terms))
+        .group_by(SearchPosting.term)
+        .all()
+    )
+    if len(doc_freqs) < len(terms):
+        return 0, []
+
+    total_docs = db.query(func.count(SearchDocument.id)).scalar() or 1
+    idf = case(
+        *[(SearchPosting.term == t, math.log(1 + total_docs / df)) for t, df in doc_freqs.items()],
+        else_=0.0,
+    )
+
+    matches = (
+        select(SearchPosting.document_id, func.sum(SearchPosting.weight * idf).label("score"))
+        .where(SearchPosting.term.in_(terms))
+        .group_by(SearchPosting.document_id)
+        .having(func.count(SearchPosting.term) == len(terms))
+        .subquery()
+    )
+
+    total = db.execute(select(func.count()).select_from(matches)).scalar()
+    rows = db.execute(
+        select(SearchDocument, matches.c.score)
+        .join(matches, matches.c.document_id == SearchDocument.id)
+        .order_by(matches.c.score.desc(), SearchDocument.published_at.desc(), SearchDocument.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    ).all()
+
+    results = [
+        {
+            "kind": doc.kind,
+            "date": doc.date.isoformat() if doc.date else None,
+            "title": doc.title,
+            "summary": doc.summary,
+            "link": doc.link,
+            "source": doc.source,
+            "published_at": doc.published_at.isoformat() if doc.published_at else None,
+            "score": round(score, 4),
+        }
+        for doc, score in rows
+    ]
+    return total, results
+
+
+def reindex_all(db: Session) -> int:
+    """全てのダイジェストと記事からインデックスを作り直す。commitは呼び出し元で行う。"""
+    db.execute(delete(SearchPosting))
+    db.execute(delete(SearchDocument))
+
+    count = 0
+    for digest in db.query(DailyDigest).order_by(DailyDigest.date).all():
+        index_headlines(db, digest.date, digest.headlines or [])
+        count += len(digest.headlines or [])
+    article_ids = [row.article_id for row in db.query(Article.article_id)]
+    index_articles(db, article_ids)
+    return count + len(article_ids)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="全文検索インデックスの管理")
+    parser.add_argument("--reindex", action="store_true", help="既存データからインデックスを作り直す")
+    args = parser.parse_args()
+
+    if args.reindex:
+        db = SessionLocal()
+        try:
+            indexed = reindex_all(db)
+            db.commit()
+            print(f"Indexed {indexed} documents")
+        finally:
+            db.close()
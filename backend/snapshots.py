@@ -0,0 +1,181 @@
+"""
+日別ダイジェストの静的スナップショット
+
+ダイジェストを書き換えたトランザクションがcommitされたら、その日の GET /api/news/daily と同じ内容のJSONを
+SNAPSHOT_DIR/daily/YYYY-MM-DD.json に書き出す (gzip・brotli で圧縮したファイルも並べて置く)。
+nginx は ?target_date=YYYY-MM-DD のリクエストをこのファイルから直接返し、ファイルがない場合だけバックエンドに渡す
+(nginx/default.conf)。過去の日付の表示はDBを経由せず、バックエンドの再起動中も表示できる。
+
+- ファイルは一時ファイルに書いてから rename で置き換えるため、読み込み途中のファイルを返すことはない。
+- 日付の一覧 (更新日時と見出し数) を SNAPSHOT_DIR/daily/index.json に書き出す。
+  APIのワーカー、ワークキューのワーカー、バックフィルなど複数のプロセスが同じディレクトリに書き出すため、
+  index.json の読み込みから書き込みまでは SNAPSHOT_DIR/.lock のファイルロック (flock) で直列化する。
+- SNAPSHOT_DIR が未設定の場合は何もしない。
+
+既存のダイジェストをまとめて書き出す場合はコマンドラインから実行する:
+    python snapshots.py --days 90
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    import brotli
+except ImportError:  # brotli がない場合は gzip だけを書き出す
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+
+_PENDING_KEY = "pending_digest_snapshots"
+# 同じ日付のファイルと index.json の書き込みを、プロセス内のスレッド間で直列化する
+_write_lock = threading.Lock()
+
+
+def daily_payload(day: date, headlines: List[Dict], updated_at: Optional[datetime]) -> Dict:
+    """GET /api/news/daily (絞り込みなし) の応答と同じ形式"""
+    return {
+        "date": day.isoformat(),
+        "headlines": headlines,
+        "updated_at": updated_at.isoformat() if updated_at else None,
+    }
+
+
+def schedule_snapshot(db: Session, day: date, headlines: List[Dict], updated_at: Optional[datetime]) -> None:
+    """commitされたら指定日のスナップショットを書き出す (ロールバックされた場合は書き出さない)"""
+    if not SNAPSHOT_DIR:
+        return
+    db.info.setdefault(_PENDING_KEY, {})[day] = daily_payload(day, headlines, updated_at)
+
+
+@event.listens_for(Session, "after_commit")
+def _write_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    try:
+        write_snapshots(SNAPSHOT_DIR, list(pending.values()))
+    except Exception as e:
+        # 書き出せなくてもバックエンドが応答するため、収集は続ける
+        print(f"Error writing digest snapshots: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # nginx のワーカーが読めるようにする (mkstemp は 0600 で作る)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _write_file(path: str, body: bytes) -> None:
+    """圧縮したファイルを先に置き、最後に本体を置き換える"""
+    _atomic_write(path + ".gz", gzip.compress(body, compresslevel=9, mtime=0))
+    br_path = path + ".br"
+    if brotli is not None:
+        _atomic_write(br_path, brotli.compress(body, quality=9))
+    elif os.path.exists(br_path):
+        # 古い内容の .br を返さないようにする
+        os.unlink(br_path)
+    _atomic_write(path, body)
+
+
+def _encode(payload: Dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+@contextmanager
+def _locked(directory: str):
+    """スレッド間とプロセス間 (flock) の両方で書き出しを直列化する"""
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_snapshots(directory: str, payloads: List[Dict]) -> None:
+    """日別のスナップショットと index.json を書き出す"""
+    daily_dir = os.path.join(directory, "daily")
+    os.makedirs(daily_dir, exist_ok=True)
+    with _locked(directory):
+        for payload in payloads:
+            _write_file(os.path.join(daily_dir, f"{payload['date']}.json"), _encode(payload))
+        _write_index(daily_dir, payloads)
+
+
+def _write_index(daily_dir: str, payloads: List[Dict]) -> None:
+    index_path = os.path.join(daily_dir, "index.json")
+    entries = {}
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            entries = {entry["date"]: entry for entry in json.load(f)["dates"]}
+    except (OSError, ValueError, KeyError):
+        pass
+    for payload in payloads:
+        entries[payload["date"]] = {
+            "date": payload["date"],
+            "updated_at": payload["updated_at"],
+            "headlines": len(payload["headlines"]),
+        }
+    index = {"dates": [entries[d] for d in sorted(entries, reverse=True)]}
+    _write_file(index_path, _encode(index))
+
+
+def export_all(db: Session, directory: str, days: Optional[int] = None) -> int:
+    """保存済みの日別ダイジェストをまとめて書き出す (days を指定した場合は直近の日数分)"""
+    from database import DailyDigest
+
+    query = db.query(DailyDigest).order_by(DailyDigest.date.desc())
+    if days:
+        query = query.limit(days)
+    payloads = [daily_payload(d.date, d.headlines, d.updated_at) for d in query]
+    write_snapshots(directory, payloads)
+    return len(payloads)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="日別ダイジェストの静的スナップショットの書き出し")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, required=not SNAPSHOT_DIR, help="書き出し先")
+    parser.add_argument("--days", type=int, help="直近の日数 (省略時は全て)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"Exported {export_all(db, args.dir, args.days)} digests to {args.dir}")
+    finally:
+        db.close()
@@ -0,0 +1,159 @@
+"""
+収集対象のニュースソース
+
+Google News (トピック)、NHK (カテゴリ)、YouTube (チャンネル) の各フィードを1件の取得ジョブとし、
+収集パイプラインの fetch ステージで並行に取得する。
+ジョブごとにタイムアウトを設け、遅いソースや失敗したソースがあっても他のソースの結果は使う
+(収集全体の待ち時間は、最も遅い正常なソースで決まる)。
+
+取得した記事は共通の形式 (records.ArticleRecord) に揃える。
+"""
+
+import contextvars
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from breaker import CircuitOpenError
+from metrics import SOURCE_FETCH_TOTAL
+from records import ArticleRecord, VideoRecord
+
+# 収集するソース (google_news, nhk, youtube)
+DEFAULT_SOURCES = "google_news,nhk,youtube"
+# 1ジョブあたりのタイムアウト秒数
+SOURCE_TIMEOUT_SECONDS = float(os.getenv("COLLECT_SOURCE_TIMEOUT", "20"))
+
+
+class SourceTimeout(Exception):
+    pass
+
+
+@dataclass
+class SourceJob:
+    """1つのフィードの取得ジョブ"""
+
+    source: str  # google_news, nhk, youtube
+    key: str  # 例: "nhk:main"
+    fetch: Callable[[], List[ArticleRecord]]
+
+
+def _env_list(name: str, default: str = "") -> List[str]:
+    return [v.strip() for v in os.getenv(name, default).split(",") if v.strip()]
+
+
+def configured_jobs() -> List[SourceJob]:
+    """環境変数 COLLECT_SOURCES と各ソースの設定から取得ジョブを組み立てる"""
+    max_articles = int(os.getenv("COLLECT_MAX_ARTICLES", "5"))
+    jobs = []
+    for source in _env_list("COLLECT_SOURCES", DEFAULT_SOURCES):
+        if source == "google_news":
+            from google_news_client import GoogleNewsClient
+
+            client = GoogleNewsClient()
+            for topic in _env_list("COLLECT_GOOGLE_TOPICS", "top"):
+                jobs.append(SourceJob(
+                    source, f"google:{topic}",
+                    lambda client=client, topic=topic: client.fetch_news(topics=[topic], max_articles=max_articles),
+                ))
+        elif source == "nhk":
+            from nhk_client import NHKNewsClient
+
+            client = NHKNewsClient()
+            for category in _env_list("COLLECT_NHK_CATEGORIES", "main"):
+                jobs.append(SourceJob(
+                    source, f"nhk:{category}",
+                    lambda client=client, category=category: client.fetch_news(categories=[category], max_articles=max_articles),
+                ))
+        elif source == "youtube":
+            channel_ids = _env_list("YOUTUBE_CHANNEL_IDS")
+            if not channel_ids:
+                continue
+            from youtube_client import YouTubeClient
+
+            client = YouTubeClient()
+            for channel_id in channel_ids:
+                jobs.append(SourceJob(
+                    source, f"youtube:{channel_id}",
+                    lambda client=client, channel_id=channel_id: [
+                        video_to_article(v, channel_id) for v in client.search_news_videos(channel_id)[:max_articles]
+                    ],
+                ))
+        else:
+            print(f"Unknown collect source: {source}")
+    return jobs
+
+
+def video_to_article(video: VideoRecord, channel_id: str) -> ArticleRecord:
+    """YouTubeのRSSの動画を記事の形式に揃える (要約は説明文から作る)"""
+    published_at = None
+    if video.published_at:
+        try:
+            published_at = datetime.fromisoformat(video.published_at)
+        except (TypeError, ValueError):
+            pass
+    return ArticleRecord(
+        article_id=f"yt_{video.video_id}",
+        title=video.title,
+        link=f"https://www.youtube.com/watch?v={video.video_id}",
+        description=video.description or "",
+        published_at=published_at,
+        source="YouTube",
+        topic=channel_id,
+    )
+
+
+def _call_with_timeout(func: Callable[[], List[ArticleRecord]], timeout: float) -> List[ArticleRecord]:
+    """
+    func を別スレッドで実行し、timeout 秒以内に終わらなければ SourceTimeout を送出する。
+    タイムアウトしたスレッドは待たずに放置する (HTTPリクエスト自体のタイムアウトで終了する)。
+    """
+    result: Dict = {}
+
+    def target():
+        try:
+            result["value"] = func()
+        except BaseException as e:
+            result["error"] = e
+
+    # 段階ごとの所要時間の記録 (metrics.record_stage_durations) を引き継ぐ
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise SourceTimeout(f"timed out after {timeout:.0f}s")
+    if "error" in result:
+        raise result["error"]
+    return result["value"] or []
+
+
+def fetch_job(job: SourceJob, stats: Dict[str, Dict], timeout: float = SOURCE_TIMEOUT_SECONDS) -> List[ArticleRecord]:
+    """
+    ジョブを実行して記事を返す。タイムアウト・例外の場合は空のリストを返し、結果を stats に記録する。
+    """
+    start = time.perf_counter()
+    try:
+        articles = _call_with_timeout(job.fetch, timeout)
+        outcome, error = "ok", None
+    except SourceTimeout as e:
+        articles, outcome, error = [], "timeout", str(e)
+    except CircuitOpenError as e:
+        # 取得先が不調のため、呼び出さずに失敗させた
+        articles, outcome, error = [], "open", str(e)
+    except Exception as e:
+        articles, outcome, error = [], "error", str(e)
+    elapsed = time.perf_counter() - start
+
+    SOURCE_FETCH_TOTAL.labels(source=job.source, outcome=outcome).inc()
+    if error:
+        print(f"Source {job.key} failed ({outcome}): {error}")
+    stats[job.key] = {
+        "source": job.source,
+        "status": outcome,
+        "articles": len(articles),
+        "seconds": round(elapsed, 3),
+        "error": error,
+    }
+    return articles
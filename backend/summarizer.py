@@ -1,47 +1,60 @@
 import json
 import os
 import random
+import threading
 import time
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from google import genai
 from google.genai import types
 
+from deadline import Deadline
+from metrics import GEMINI_CALLS_TOTAL, GEMINI_INPUT_TOKENS_SAVED_TOTAL, GEMINI_RETRIES_TOTAL, gemini_error_outcome
+from prompt_prep import TokenCounter, batch_prompt, prepare_batch, video_prompt
+from records import ArticleRecord
+
+
+# 締め切りまでの残り時間がこれより短い場合、API呼び出しを始めない (秒)
+MIN_CALL_SECONDS = 1.0
+
+# モデルごとのトークン数の見積もり (プロセス内で共有し、トークンカウンターでの測定は1回だけにする)
+_token_counters: Dict[str, TokenCounter] = {}
+_token_counters_lock = threading.Lock()
+
+
+class DeadlineReached(TimeoutError):
+    """締め切りまでの残り時間が短いため、API呼び出しを始めなかった"""
+
+
+def _count_failed_call(error: Exception) -> None:
+    """失敗した呼び出しを gemini_calls_total に数える (APIを呼び出さなかった締め切りの場合は数えない)"""
+    if isinstance(error, DeadlineReached):
+        return
+    GEMINI_CALLS_TOTAL.labels(outcome=gemini_error_outcome(str(error))).inc()
+
 
 class Summarizer:
     def __init__(self, api_key: str):
         self.client = genai.Client(api_key=api_key)
         # 現時点で動作とクォータが確認できた gemini-2.0-flash をデフォルトに使用
         self.model_id = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+        # このインスタンスでの実際のAPI呼び出し回数とトークン数 (リトライ・404時の再試行を含む)
+        # input_tokens_saved はバッチ要約の入力の整形 (prompt_prep.py) で減らしたトークン数の見積もり
+        self.usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "input_tokens_saved": 0}
+        # 収集パイプラインでは複数スレッドから同時に呼び出される
+        self._usage_lock = threading.Lock()
+        with _token_counters_lock:
+            if self.model_id not in _token_counters:
+                _token_counters[self.model_id] = TokenCounter(self._count_tokens)
+            self.token_counter = _token_counters[self.model_id]
 
-    def summarize(self, transcript: str) -> Dict:
+    def summarize(self, transcript: str, deadline: Optional[Deadline] = None) -> Dict:
         """
         Gemini APIを使用して字幕を要約する。(YouTube動画用)
+        deadline を指定した場合、API呼び出しのタイムアウトとリトライ待ちが残り時間を超えないようにする。
         """
-        prompt = f"""
-あなたはプロのニュース編集者です。提供された「YouTubeニュース動画のテキスト（字幕または説明文）」を解析し、視聴者が短時間で内容を把握できる高品質な要約を作成してください。
-
-【注意点】
-- 「この字幕テキストは...」「テレビ朝日がお届けする...」「最新ニュースをライブで...」といった、動画の内容そのものではないメタ情報や定型文、チャンネルの紹介などは、要約や重要ポイントに含めないでください。
-- 放送された具体的な「事実（事件、事故、政治、経済、気象など）」にのみ焦点を当ててください。
-- まだ要約すべきニュース事実がない場合は、その旨を簡潔に記述してください。
-
-【出力形式】
-以下のJSON形式で出力してください。
-{{
-  "summary": "動画全体の流れを掴むための簡潔な要約（300文字程度）。事実に基づいた具体的な内容にすること。",
-  "key_points": [
-    "重要なニュース項目1の具体的な内容",
-    "重要なニュース項目2の具体的な内容",
-    "重要なニュース項目3の具体的な内容",
-    "..."
-  ]
-}}
-
-対象のテキスト:
-{transcript}
-"""
-        return self._generate_summary(prompt)
+        prompt = video_prompt(transcript)
+        return self._generate_summary(prompt, deadline)
 
     def summarize_article(self, article_text: str) -> Dict:
         """
@@ -71,97 +84,117 @@ class Summarizer:
 """
         return self._generate_summary(prompt)
 
-    def summarize_batch(self, articles: List[Dict]) -> List[Dict]:
+    def summarize_batch(self, articles: List[ArticleRecord], deadline: Optional[Deadline] = None) -> List[Dict]:
         """
         複数のニュース記事を1回のAPI呼び出しでバッチ要約する。
 
         Args:
-            articles: 記事情報のリスト。各記事は {"title": str, "description": str} を含む。
+            articles: 記事のリスト (タイトルと概要、本文がある場合は本文を使う)。
+            deadline: 締め切り。API呼び出しのタイムアウトとリトライ待ちが残り時間を超えないようにする。
 
         Returns:
             要約結果のリスト。各要約は {"title": str, "summary": str} を含む。
+            要約に失敗した場合は "summary" にエラーメッセージが入り、"error": True が付く。
         """
         if not articles:
             return []
 
-        # 記事リストをプロンプト用に整形
-        articles_text = ""
-        for i, article in enumerate(articles, 1):
-            title = article.get("title", "タイトルなし")
-            desc = article.get("description", "")[:500]  # 長すぎる場合は切り詰め
-            articles_text += f"{i}. 【{title}】\n   {desc}\n\n"
+        # 記事リストをプロンプト用に整形 (タイトル・配信元の繰り返しと定型文を除き、1件あたりのトークン数の予算で切り詰める)
+        # 配信元のページから本文を抽出できた場合は、RSSの概要の代わりに使う
+        self.token_counter.calibrate("".join((a.content or a.description or "")[:1000] for a in articles))
+        articles_text, prompt_stats = prepare_batch(articles, self.token_counter)
+        with self._usage_lock:
+            self.usage["input_tokens_saved"] += prompt_stats["tokens_saved"]
+        GEMINI_INPUT_TOKENS_SAVED_TOTAL.inc(prompt_stats["tokens_saved"])
+        print(
+            f"Batch prompt: {len(articles)} articles, ~{prompt_stats['tokens']} tokens "
+            f"(~{prompt_stats['tokens_saved']} saved)"
+        )
 
-        prompt = f"""
-あなたはプロのニュース編集者です。以下の複数のニュース記事を、それぞれ1〜2行の簡潔な要約にまとめてください。
+        prompt = batch_prompt(articles_text)
 
-【注意点】
-- 各記事の核心となる事実のみを抽出してください。
-- 5W1H（いつ、どこで、誰が、何を）を意識した要約を心がけてください。
-- 定型文やメタ情報は含めないでください。
-
-【出力形式】
-以下のJSON配列形式で出力してください。記事の順番は入力と同じにしてください。
-[
-  {{"index": 1, "title": "記事タイトル", "summary": "1〜2行の簡潔な要約"}},
-  {{"index": 2, "title": "記事タイトル", "summary": "1〜2行の簡潔な要約"}},
-  ...
-]
-
-【対象の記事一覧】
-{articles_text}
-"""
-
-        result = self._generate_summary(prompt)
+        result = self._generate_summary(prompt, deadline)
 
         # 結果がリストでない場合（エラー時など）の対応
         if isinstance(result, dict) and "summary" in result:
             # エラーメッセージが返ってきた場合
             error_msg = result.get("summary", "バッチ要約に失敗しました")
-            return [{"title": a.get("title", ""), "summary": error_msg} for a in articles]
+            return [{"title": a.title, "summary": error_msg, "error": True} for a in articles]
 
         if isinstance(result, list):
             return result
 
         # 予期しない形式の場合
-        return [{"title": a.get("title", ""), "summary": "要約の取得に失敗しました"} for a in articles]
+        return [{"title": a.title, "summary": "要約の取得に失敗しました", "error": True} for a in articles]
+
+    def _generation_config(self, timeout: Optional[float] = None) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            # 締め切りがある場合は、残り時間をHTTPタイムアウト (ミリ秒) にする
+            http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+            safety_settings=[
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+                ),
+                types.SafetySetting(
+                    category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
+                    threshold=types.HarmBlockThreshold.BLOCK_NONE,
+                ),
+            ],
+        )
+
+    def _call_model(self, model: str, prompt: str, deadline: Optional[Deadline] = None):
+        """Gemini APIを1回呼び出し、呼び出し回数とトークン数を usage に加算する"""
+        timeout = None
+        if deadline is not None:
+            timeout = deadline.remaining()
+            if timeout < MIN_CALL_SECONDS:
+                raise DeadlineReached("collect deadline reached before calling Gemini")
+        with self._usage_lock:
+            self.usage["calls"] += 1
+        response = self.client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=self._generation_config(timeout),
+        )
+        usage_metadata = getattr(response, "usage_metadata", None)
+        if usage_metadata is not None:
+            with self._usage_lock:
+                self.usage["input_tokens"] += usage_metadata.prompt_token_count or 0
+                self.usage["output_tokens"] += usage_metadata.candidates_token_count or 0
+            # 実際の入力トークン数で、トークン数の見積もりを補正する
+            self.token_counter.observe(prompt, usage_metadata.prompt_token_count)
+        return response
+
+    def _count_tokens(self, text: str) -> int:
+        """モデルのトークンカウンターでトークン数を数える (トークン数の見積もりの初回の測定用)"""
+        return self.client.models.count_tokens(model=self.model_id, contents=text).total_tokens
 
-    def _generate_summary(self, prompt: str) -> Dict:
-        """Gemini APIを呼び出して要約を生成する共通処理 (リトライ機能付き)"""
+    def _generate_summary(self, prompt: str, deadline: Optional[Deadline] = None) -> Dict:
+        """
+        Gemini APIを呼び出して要約を生成する共通処理 (リトライ機能付き)。
+        締め切りがある場合、待ち時間が残り時間を超えるリトライは行わない。
+        """
         max_retries = 2
         base_delay = 2.0  # seconds
 
         for attempt in range(max_retries + 1):
             try:
                 # プレフィックスなしで試行
-                response = self.client.models.generate_content(
-                    model=self.model_id,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        safety_settings=[
-                            types.SafetySetting(
-                                category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                                threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                            ),
-                            types.SafetySetting(
-                                category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                                threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                            ),
-                            types.SafetySetting(
-                                category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                                threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                            ),
-                            types.SafetySetting(
-                                category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                                threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                            ),
-                            types.SafetySetting(
-                                category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
-                                threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                            ),
-                        ],
-                    ),
-                )
+                response = self._call_model(self.model_id, prompt, deadline)
                 if response.text is None:
                     # 詳細な原因究明のためにレスポンスの中身を確認
                     finish_reason = "Unknown"
@@ -172,17 +205,25 @@ class Summarizer:
 
                     error_msg = f"Gemini returned empty response. FinishReason: {finish_reason}, SafetyRatings: {safety_ratings}"
                     raise Exception(error_msg)
-                return json.loads(response.text)
+                result = json.loads(response.text)
+                GEMINI_CALLS_TOTAL.labels(outcome="ok").inc()
+                return result
             except Exception as e:
                 error_str = str(e)
+                _count_failed_call(e)
+                out_of_time = isinstance(e, TimeoutError)
                 # 429 Resource Exhausted handling
                 if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    if attempt < max_retries:
-                        # Exponential backoff + jitter
-                        delay = base_delay * (2**attempt) + random.uniform(0, 1)
+                    # Exponential backoff + jitter
+                    delay = base_delay * (2**attempt) + random.uniform(0, 1)
+                    if deadline is not None and delay + MIN_CALL_SECONDS > deadline.remaining():
+                        print("DEBUG: Rate limit hit, but no time left before the collect deadline.")
+                        out_of_time = True
+                    elif attempt < max_retries:
                         print(
                             f"DEBUG: Rate limit hit. Retrying in {delay:.2f}s... (Attempt {attempt + 1}/{max_retries})"
                         )
+                        GEMINI_RETRIES_TOTAL.labels(reason="rate_limit").inc()
                         time.sleep(delay)
                         continue
                     else:
@@ -194,57 +235,35 @@ class Summarizer:
                 # (Rate limit以外のエラーで、かつ404の場合のみ)
                 if (
                     "404" in error_str
+                    and not out_of_time
                     and not self.model_id.startswith("models/")
                     and "429" not in error_str
                 ):
                     try:
                         retry_model = f"models/{self.model_id}"
                         print(f"DEBUG: Retrying with {retry_model}")
-                        response = self.client.models.generate_content(
-                            model=retry_model,
-                            contents=prompt,
-                            config=types.GenerateContentConfig(
-                                response_mime_type="application/json",
-                                safety_settings=[
-                                    types.SafetySetting(
-                                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                                        threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                                    ),
-                                    types.SafetySetting(
-                                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                                        threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                                    ),
-                                    types.SafetySetting(
-                                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                                        threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                                    ),
-                                    types.SafetySetting(
-                                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                                        threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                                    ),
-                                    types.SafetySetting(
-                                        category=types.HarmCategory.HARM_CATEGORY_CIVIC_INTEGRITY,
-                                        threshold=types.HarmBlockThreshold.BLOCK_NONE,
-                                    ),
-                                ],
-                            ),
-                        )
+                        GEMINI_RETRIES_TOTAL.labels(reason="model_prefix").inc()
+                        response = self._call_model(retry_model, prompt, deadline)
                         if response.text is None:
                             raise Exception("Gemini returned empty response (None) even on retry.")
-                        return json.loads(response.text)
+                        result = json.loads(response.text)
+                        GEMINI_CALLS_TOTAL.labels(outcome="ok").inc()
+                        return result
                     except Exception as e2:
+                        _count_failed_call(e2)
                         error_str = f"{error_str} | Retry failed: {str(e2)}"
                         # Retryで429が出た場合のハンドリングは複雑になるため、ここではループ外のエラー処理に任せる
                         # 必要であればここもループに含める設計にすべきだが、まずは簡易対応
 
-                # リトライでもダメだった、あるいはリトライ対象外のエラー
+                # リトライでもダメだった、あるいはリトライ対象外のエラー (締め切りを過ぎる場合を含む)
                 if attempt == max_retries or (
                     "429" not in error_str and "RESOURCE_EXHAUSTED" not in error_str
-                ):
+                ) or out_of_time:
                     print(f"Error in Gemini summarization: {error_str}")
                     with open("gemini_error.log", "a") as f:
                         f.write(error_str + "\n")
                     return {
                         "summary": f"要約の生成に失敗しました。({error_str[:60]}...)",
                         "key_points": [],
+                        "error": True,
                     }
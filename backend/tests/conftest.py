@@ -27,11 +27,13 @@ sys.modules["summarizer"] = mock_summarizer_module
 os.environ["YOUTUBE_API_KEY"] = "dummy_youtube_key"
 os.environ["GEMINI_API_KEY"] = "dummy_gemini_key"
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+# 収集処理のテストでは記事ページを取得しない (補完は test_enrich.py で確認する)
+os.environ["COLLECT_ENRICH"] = "false"
 
 # backendディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from main import app
+from main import app, get_read_db
 from database import Base, get_db
 
 # テスト用DB (SQLite インメモリ)
@@ -66,6 +68,7 @@ def client(db_session):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
@@ -0,0 +1,127 @@
+import json
+import time
+from datetime import date, datetime, timezone
+from unittest.mock import MagicMock
+
+from backfill import KIND_ARTICLE, KIND_VIDEO, RateLimiter, run_backfill, select_targets
+from database import Article, ArticleKeyPoint, DailyDigest, KeyPoint, Video, VideoTranscript
+from digests import merge_headlines
+from tests.conftest import TestingSessionLocal
+
+
+def _article(article_id, published_at, status="processed"):
+    return Article(
+        article_id=article_id,
+        title=f"見出し{article_id}",
+        link=f"https://example.com/{article_id}",
+        description="概要",
+        summary="古い要約" if status == "processed" else "",
+        status=status,
+        published_at=published_at,
+    )
+
+
+def _summarizer(fail_ids=()):
+    summarizer = MagicMock()
+    summarizer.usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+
+    def summarize_batch(articles, deadline=None):
+        summarizer.usage["calls"] += 1
+        return [
+            {"summary": "失敗", "error": True} if a.article_id in fail_ids else {"summary": f"新しい要約{a.article_id}", "key_points": ["点"]}
+            for a in articles
+        ]
+
+    summarizer.summarize_batch.side_effect = summarize_batch
+    summarizer.summarize.return_value = {"summary": "動画の要約", "key_points": ["a", "b"]}
+    return summarizer
+
+
+def test_select_targets_by_date_range(db_session):
+    db_session.add_all([
+        _article("a1", datetime(2026, 9, 1, 3, tzinfo=timezone.utc)),
+        _article("a2", datetime(2026, 9, 2, 3, tzinfo=timezone.utc), status="unprocessed"),
+        _article("a3", datetime(2026, 9, 10, 3, tzinfo=timezone.utc)),
+    ])
+    db_session.commit()
+
+    targets = select_targets(db_session, date(2026, 9, 1), date(2026, 9, 2), article_ids=["a3"])
+    assert targets[KIND_ARTICLE] == ["a3", "a1", "a2"]
+    assert select_targets(db_session, date(2026, 9, 1), date(2026, 9, 2), missing_only=True)[KIND_ARTICLE] == ["a2"]
+
+
+def test_backfill_saves_in_bulk_rebuilds_digests_and_resumes(db_session, tmp_path):
+    published = datetime(2026, 9, 1, 3, tzinfo=timezone.utc)
+    db_session.add_all([_article("a1", published), _article("a2", published), _article("a3", published, "unprocessed")])
+    db_session.commit()
+    # a1 は以前のダイジェストに載っている
+    merge_headlines(db_session, date(2026, 9, 1), [{"article_id": "a1", "title": "見出しa1", "summary": "古い要約"}])
+    db_session.commit()
+
+    checkpoint = tmp_path / "checkpoint.json"
+    targets = {KIND_ARTICLE: ["a1", "a2", "a3"], KIND_VIDEO: []}
+    stats = run_backfill(
+        TestingSessionLocal, targets, workers=0, rpm=0, batch_size=2,
+        checkpoint_path=str(checkpoint), summarizer=_summarizer(fail_ids={"a3"}),
+    )
+    assert stats["articles"] == 2 and stats["failed"] == 1 and stats["calls"] == 2
+    assert stats["completed"] is True
+
+    db_session.expire_all()
+    assert db_session.get(Article, "a1").summary == "新しい要約a1"
+    assert db_session.query(ArticleKeyPoint).filter(ArticleKeyPoint.article_id == "a2").count() == 1
+    # 見出しのあった日は要約を差し替え、見出しのなかった記事は公開日のダイジェストに追加する
+    digest = db_session.query(DailyDigest).filter(DailyDigest.date == published.astimezone().date()).one()
+    assert {h["article_id"]: h["summary"] for h in digest.headlines} == {"a1": "新しい要約a1", "a2": "新しい要約a2"}
+
+    saved = json.loads(checkpoint.read_text(encoding="utf-8"))
+    assert saved["done"][KIND_ARTICLE] == ["a1", "a2"]
+    assert "a3" in saved["failed"][KIND_ARTICLE]
+
+    # 同じ対象で実行し直すと、保存済みのものを飛ばして失敗したものだけ要約する
+    summarizer = _summarizer()
+    stats = run_backfill(TestingSessionLocal, targets, workers=0, rpm=0, checkpoint_path=str(checkpoint), summarizer=summarizer)
+    assert stats["skipped"] == 2 and stats["articles"] == 1
+    [call] = summarizer.summarize_batch.call_args_list
+    assert [a.article_id for a in call.args[0]] == ["a3"]
+
+
+def test_backfill_videos(db_session, tmp_path):
+    db_session.add(Video(youtube_id="v1", title="動画", status="unprocessed"))
+    db_session.add(VideoTranscript(youtube_id="v1", text="字幕"))
+    db_session.add(Video(youtube_id="v2", title="字幕なし", status="unprocessed"))
+    db_session.add(KeyPoint(youtube_id="v1", point="古い点"))
+    db_session.commit()
+
+    summarizer = _summarizer()
+    stats = run_backfill(
+        TestingSessionLocal, {KIND_ARTICLE: [], KIND_VIDEO: ["v1", "v2"]}, workers=0, rpm=0,
+        checkpoint_path=None, max_seconds=60, summarizer=summarizer,
+    )
+    assert stats["videos"] == 1
+    # 動画の要約も実行時間の上限を締め切りとして渡す
+    assert summarizer.summarize.call_args.kwargs["deadline"].remaining() <= 60
+    db_session.expire_all()
+    video = db_session.get(Video, "v1")
+    assert video.summary == "動画の要約" and video.status == "processed"
+    assert [p.point for p in video.key_points] == ["a", "b"]
+
+
+def test_backfill_stops_at_time_limit(db_session, tmp_path):
+    db_session.add(_article("a1", datetime(2026, 9, 1, tzinfo=timezone.utc)))
+    db_session.commit()
+    summarizer = _summarizer()
+    stats = run_backfill(
+        TestingSessionLocal, {KIND_ARTICLE: ["a1"], KIND_VIDEO: []}, workers=0, rpm=0,
+        checkpoint_path=None, max_seconds=1e-9, summarizer=summarizer,
+    )
+    assert stats["completed"] is False
+    summarizer.summarize_batch.assert_not_called()
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(rpm=600)
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.wait()
+    assert time.monotonic() - started >= 0.19
@@ -0,0 +1,88 @@
+import json
+from datetime import datetime, timezone
+
+import batch_jobs
+from batch_jobs import LocalBatchBackend, ingest_job, poll_jobs, submit_job
+from database import Article, SummaryBatchJob, Video, VideoTranscript, WorkItem
+from work_queue import KIND_ARTICLE, enqueue
+
+
+def _respond(prompt):
+    if "YouTube" in prompt:
+        return json.dumps({"summary": "動画の要約", "key_points": ["点"]}, ensure_ascii=False)
+    count = prompt.count("【見出し")
+    if "見出しa3" in prompt:
+        raise RuntimeError("quota exceeded")
+    return json.dumps([{"index": i + 1, "summary": f"要約{i + 1}"} for i in range(count)], ensure_ascii=False)
+
+
+def _setup(db):
+    published = datetime(2026, 9, 1, 3, tzinfo=timezone.utc)
+    for article_id in ("a1", "a2", "a3"):
+        db.add(Article(
+            article_id=article_id, title=f"見出し{article_id}", link=f"https://example.com/{article_id}",
+            description="概要", status="unprocessed", published_at=published,
+        ))
+    db.add(Video(youtube_id="v1", title="動画", status="unprocessed"))
+    db.add(VideoTranscript(youtube_id="v1", text="字幕"))
+    db.commit()
+
+
+def test_submit_poll_and_ingest_once(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_jobs, "BATCH_DIR", str(tmp_path))
+    _setup(db_session)
+    enqueue(db_session, KIND_ARTICLE, ["a1", "a2"])
+    db_session.commit()
+    backend = LocalBatchBackend(str(tmp_path), _respond)
+
+    job = submit_job(db_session, backend, {"article": ["a1", "a2", "a3"], "video": ["v1"]}, articles_per_request=2)
+    assert job.state == "submitted" and job.request_count == 3
+    assert job.requests["article-1"] == {"kind": "article", "ids": ["a1", "a2"]}
+    # 投入したJSONLは残さない
+    assert not list(tmp_path.glob("summary-batch-*"))
+
+    # 未完了のジョブに含まれる対象は重ねて投入しない
+    assert submit_job(db_session, backend, {"article": ["a1"], "video": []}) is None
+
+    assert poll_jobs(db_session, backend) == {"pending": 0, "ingested": 1, "failed": 0}
+    db_session.expire_all()
+    assert db_session.get(Article, "a1").summary == "要約1"
+    assert db_session.get(Article, "a2").summary == "要約2"
+    assert db_session.get(Article, "a3").status == "unprocessed"
+    assert db_session.get(Video, "v1").summary == "動画の要約"
+    job = db_session.get(SummaryBatchJob, job.id)
+    assert (job.state, job.summarized, job.failed) == ("ingested", 3, 1)
+    # 取り込んだ記事のワークキューの作業は完了にする
+    assert {w.status for w in db_session.query(WorkItem)} == {"done"}
+
+    # 取り込みは1回だけ行う
+    db_session.query(Article).filter(Article.article_id == "a1").update({Article.summary: "手で直した要約"})
+    db_session.commit()
+    assert ingest_job(db_session, backend, job.id) == 0
+    assert db_session.get(Article, "a1").summary == "手で直した要約"
+
+    # 取り込みが終わったら、失敗した記事を投入し直せる
+    assert submit_job(db_session, backend, {"article": ["a3"], "video": []}).request_count == 1
+
+
+def test_failed_submission_releases_targets(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_jobs, "BATCH_DIR", str(tmp_path))
+    _setup(db_session)
+
+    class Broken(LocalBatchBackend):
+        def submit(self, path, model, display_name):
+            raise RuntimeError("upload failed")
+
+    job = submit_job(db_session, Broken(str(tmp_path), _respond), {"article": ["a1"], "video": []})
+    assert job.state == "failed" and "upload failed" in job.error
+    assert submit_job(db_session, LocalBatchBackend(str(tmp_path), _respond), {"article": ["a1"], "video": []}) is not None
+
+
+def test_parse_result_handles_errors_and_short_responses():
+    target = {"kind": "article", "ids": ["a1", "a2"]}
+    line = {"key": "article-1", "response": {"candidates": [{"content": {"parts": [{"text": '[{"summary": "要約"}]'}]}}]}}
+    assert batch_jobs.parse_result(line, target) == [
+        {"id": "a1", "summary": "要約", "key_points": []},
+        {"id": "a2", "error": "missing summary in batch response"},
+    ]
+    assert all("error" in r for r in batch_jobs.parse_result({"key": "article-1", "error": {"code": 8}}, target))
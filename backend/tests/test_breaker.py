@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import breaker
+from breaker import CircuitBreakers, CircuitOpenError
+from database import UpstreamBreaker
+from tests.conftest import TestingSessionLocal
+
+URL = "https://news.example.com/rss"
+
+
+def _fail(breakers, error=None):
+    with pytest.raises(requests.RequestException):
+        with breakers.guard(URL):
+            raise error or requests.ConnectTimeout("timed out")
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes(db_session, monkeypatch):
+    monkeypatch.setattr(breaker, "CONSECUTIVE_FAILURES", 3)
+    breakers = CircuitBreakers(TestingSessionLocal)
+    for _ in range(3):
+        _fail(breakers)
+    # 以降はDBの状態を書き換えるため、毎回DBと同期させる
+    monkeypatch.setattr(breaker, "SYNC_SECONDS", 0)
+
+    # open の間は呼び出さずに失敗させる
+    called = []
+    with pytest.raises(CircuitOpenError):
+        with breakers.guard(URL):
+            called.append(True)
+    assert called == []
+
+    # open の期間を過ぎたら1回だけ試しに呼び出し、成功すれば closed に戻す
+    db_session.query(UpstreamBreaker).update(
+        {UpstreamBreaker.open_until: datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+    db_session.commit()
+    with breakers.guard(URL):
+        # 試している間の他の呼び出しは待たせない
+        with pytest.raises(CircuitOpenError):
+            breakers.check(URL)
+    [status] = breakers.status(db_session)
+    assert status["host"] == "news.example.com"
+    assert status["state"] == "closed"
+
+
+def test_failed_probe_reopens_for_longer(db_session, monkeypatch):
+    monkeypatch.setattr(breaker, "CONSECUTIVE_FAILURES", 1)
+    monkeypatch.setattr(breaker, "OPEN_SECONDS", 60)
+    monkeypatch.setattr(breaker, "SYNC_SECONDS", 0)
+    breakers = CircuitBreakers(TestingSessionLocal)
+    _fail(breakers)
+    db_session.query(UpstreamBreaker).update(
+        {UpstreamBreaker.open_until: datetime.now(timezone.utc) - timedelta(seconds=1)}
+    )
+    db_session.commit()
+
+    _fail(breakers)
+    db_session.expire_all()
+    state = db_session.get(UpstreamBreaker, "news.example.com")
+    assert state.state == "open" and state.open_count == 2
+    assert breaker._as_utc(state.open_until) - breaker._as_utc(state.opened_at) == timedelta(seconds=120)
+
+
+def test_failure_rate_and_client_errors(db_session, monkeypatch):
+    monkeypatch.setattr(breaker, "MIN_CALLS", 4)
+    monkeypatch.setattr(breaker, "FAILURE_RATE", 0.5)
+    breakers = CircuitBreakers(TestingSessionLocal)
+
+    # 404 はホストの不調として数えない
+    not_found = requests.Response()
+    not_found.status_code = 404
+    _fail(breakers, requests.HTTPError(response=not_found))
+    with breakers.guard(URL):
+        pass
+    _fail(breakers)
+    assert breakers.check(URL) == "news.example.com"
+    _fail(breakers)
+
+    with pytest.raises(CircuitOpenError):
+        breakers.check(URL)
+
+
+def test_state_is_shared_between_workers(db_session, monkeypatch):
+    monkeypatch.setattr(breaker, "CONSECUTIVE_FAILURES", 2)
+    worker_a = CircuitBreakers(TestingSessionLocal)
+    worker_b = CircuitBreakers(TestingSessionLocal)
+    _fail(worker_a)
+    _fail(worker_b)
+
+    # 他のワーカーが open にしたことは、キャッシュの期限が切れてDBと同期したときに反映される
+    assert worker_a.check(URL) == "news.example.com"
+    monkeypatch.setattr(breaker, "SYNC_SECONDS", 0)
+    with pytest.raises(CircuitOpenError):
+        worker_a.check(URL)
+
+
+def test_closed_successes_are_counted_in_process(db_session, monkeypatch):
+    sessions = []
+
+    def session_factory():
+        sessions.append(True)
+        return TestingSessionLocal()
+
+    breakers = CircuitBreakers(session_factory)
+    for _ in range(10):
+        with breakers.guard(URL):
+            pass
+    # 最初の状態の読み込みだけで、成功のたびにDBを読み書きしない
+    assert len(sessions) == 1
+    assert db_session.get(UpstreamBreaker, "news.example.com") is None
+
+    # 失敗の記録で、それまでの成功もまとめて反映する
+    _fail(breakers)
+    state = db_session.get(UpstreamBreaker, "news.example.com")
+    assert (state.calls, state.failures, state.consecutive_failures) == (11, 1, 1)
+
+
+def test_list_upstreams(client, db_session, monkeypatch):
+    monkeypatch.setattr(breaker.breakers, "session_factory", TestingSessionLocal)
+    monkeypatch.setattr(breaker, "CONSECUTIVE_FAILURES", 1)
+    _fail(breaker.breakers)
+
+    [upstream] = client.get("/api/upstreams").json()["upstreams"]
+    assert upstream["host"] == "news.example.com"
+    assert upstream["state"] == "open"
+    assert upstream["retry_at"] is not None
+    assert "timed out" in upstream["last_error"]
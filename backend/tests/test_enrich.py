@@ -0,0 +1,126 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from database import ResolvedUrl
+from enrich import DomainRateLimiter, Enricher, extract_text, is_redirect_link, load_resolutions, save_resolutions
+from records import ArticleRecord
+
+ARTICLE_HTML = """
+<html><head><title>t</title><script>var x = "本文ではないスクリプトの文字列です。これは抽出されません";</script></head>
+<body>
+  <nav><p>トップ | 政治 | 経済 | 国際 | スポーツ | エンタメ | ライフ</p></nav>
+  <article>
+    <h1>見出し</h1>
+    <p>政府は19日、新たな経済対策の概要を発表した。対象は中小企業で、総額は1兆円規模となる。</p>
+    <p>短い</p>
+    <p>関係者によると、来月にも補正予算案を国会に提出する方針だという。</p>
+  </article>
+  <footer><p>Copyright 2026 Example News. All rights reserved.</p></footer>
+</body></html>
+"""
+
+
+class FakeResponse:
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content.encode()
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, timeout=None, allow_redirects=True):
+        self.requested.append(url)
+        final_url, content = self.pages[url]
+        return FakeResponse(final_url, content)
+
+
+def test_extract_text_prefers_article_paragraphs():
+    text = extract_text(ARTICLE_HTML)
+    assert text.splitlines() == [
+        "政府は19日、新たな経済対策の概要を発表した。対象は中小企業で、総額は1兆円規模となる。",
+        "関係者によると、来月にも補正予算案を国会に提出する方針だという。",
+    ]
+    # <article> がない場合は段落の多い要素から抽出する
+    assert "経済対策" in extract_text(ARTICLE_HTML.replace("article>", "div>"))
+    assert extract_text("") == ""
+
+
+def test_domain_rate_limiter_spaces_requests_per_domain():
+    limiter = DomainRateLimiter(interval=0.2)
+    start = time.monotonic()
+    assert limiter.wait("a.example")
+    assert limiter.wait("b.example")
+    assert time.monotonic() - start < 0.1
+    assert limiter.wait("a.example")
+    assert time.monotonic() - start >= 0.19
+    # 待ち時間が上限を超える場合は待たない
+    assert not limiter.wait("a.example", max_wait=0.05)
+
+
+def test_resolutions_cache_round_trip(db_session):
+    save_resolutions(db_session, {"https://news.google.com/rss/articles/a": "https://example.com/a"})
+    save_resolutions(db_session, {"https://news.google.com/rss/articles/b": None})
+    db_session.commit()
+    urls = ["https://news.google.com/rss/articles/a", "https://news.google.com/rss/articles/b"]
+    assert load_resolutions(db_session, urls) == {urls[0]: "https://example.com/a", urls[1]: None}
+
+    # 解決できなかったURLは一定時間後に再試行する
+    db_session.get(ResolvedUrl, urls[1]).resolved_at = datetime.now(timezone.utc) - timedelta(days=2)
+    db_session.commit()
+    assert load_resolutions(db_session, urls) == {urls[0]: "https://example.com/a"}
+
+
+def test_enricher_resolves_links_and_extracts_content():
+    redirect = "https://news.google.com/rss/articles/CBMi123?oc=5"
+    cached = "https://news.google.com/rss/articles/CBMi456?oc=5"
+    assert is_redirect_link(redirect)
+    assert not is_redirect_link("https://www3.nhk.or.jp/news/html/20260101/k1.html")
+
+    enricher = Enricher(
+        lambda urls: {cached: "https://example.com/cached"} if cached in urls else {},
+        limiter=DomainRateLimiter(interval=0),
+    )
+    enricher.session = FakeSession({
+        redirect: ("https://example.com/news/1", ARTICLE_HTML),
+        "https://example.com/cached": ("https://example.com/cached", ARTICLE_HTML),
+    })
+
+    article = enricher.enrich(ArticleRecord("gn_1", link=redirect, description="概要"))
+    assert article.link == "https://example.com/news/1"
+    assert "経済対策" in article.content
+    # 転送先のページはリダイレクトの応答をそのまま使う
+    assert enricher.session.requested == [redirect]
+    assert enricher.take_resolutions() == {redirect: "https://example.com/news/1"}
+
+    article = enricher.enrich(ArticleRecord("gn_2", link=cached))
+    assert article.link == "https://example.com/cached"
+    assert enricher.take_resolutions() == {}
+
+    # YouTubeの記事はページを取得しない
+    enricher.enrich(ArticleRecord("yt_x", link="https://www.youtube.com/watch?v=x", source="YouTube"))
+    assert enricher.session.requested == [redirect, "https://example.com/cached"]
+
+
+def test_interstitial_page_resolves_only_from_redirect_hints():
+    redirect = "https://news.google.com/rss/articles/CBMi789?oc=5"
+    interstitial = (
+        '<html><body><a href="https://policies.example.org/privacy">プライバシー</a>'
+        '<a href="https://support.example.org/help">ヘルプ</a></body></html>'
+    )
+    enricher = Enricher(lambda urls: {}, limiter=DomainRateLimiter(interval=0))
+    enricher.session = FakeSession({redirect: (redirect, interstitial)})
+
+    # ページ内の任意のリンクは転送先にせず、解決できなかったもの (None) として再試行に回す
+    article = enricher.enrich(ArticleRecord("gn_3", link=redirect))
+    assert article.link == redirect
+    assert enricher.take_resolutions() == {redirect: None}
+
+    canonical = interstitial.replace("<body>", '<head><link rel="canonical" href="https://example.com/news/3"></head><body>')
+    enricher.session = FakeSession({redirect: (redirect, canonical)})
+    assert enricher.enrich(ArticleRecord("gn_3", link=redirect)).link == "https://example.com/news/3"
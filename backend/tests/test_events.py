@@ -0,0 +1,82 @@
+import asyncio
+import json
+from datetime import date
+
+import events
+from digests import merge_headlines
+from events import _payloads, broker, format_event
+
+
+class FakeRequest:
+    def __init__(self, checks_before_disconnect):
+        self.checks = checks_before_disconnect
+
+    async def is_disconnected(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+def test_payloads_fit_notify_limit(monkeypatch):
+    monkeypatch.setattr(events, "MAX_PAYLOAD_BYTES", 300)
+    headlines = [{"article_id": f"gn_{i}", "title": "見出し" * 5} for i in range(6)]
+    payloads = [json.loads(p) for p in _payloads(date(2026, 1, 5), headlines)]
+    assert len(payloads) > 1
+    assert [h["article_id"] for p in payloads for h in p["headlines"]] == [f"gn_{i}" for i in range(6)]
+
+    # 1件で上限を超える見出しは再取得を求める通知にする
+    payloads = [json.loads(p) for p in _payloads(date(2026, 1, 5), [{"title": "長" * 200}])]
+    assert payloads == [{"date": "2026-01-05", "resync": True}]
+
+
+def test_committed_headlines_are_published(db_session):
+    async def scenario():
+        subscription = broker.subscribe()
+        try:
+            merge_headlines(db_session, date(2026, 1, 5), [{"article_id": "gn_1", "title": "記事1", "summary": "要約1"}])
+            db_session.rollback()
+            merge_headlines(db_session, date(2026, 1, 5), [{"article_id": "gn_2", "title": "記事2", "summary": "要約2"}])
+            db_session.commit()
+            message = await subscription.get(1)
+            # ロールバックした変更は通知しない
+            assert await subscription.get(0.1) is None
+            return message
+        finally:
+            broker.unsubscribe(subscription)
+
+    message = asyncio.run(scenario())
+    assert message["date"] == "2026-01-05"
+    assert [h["article_id"] for h in message["headlines"]] == ["gn_2"]
+    assert format_event(message).startswith("event: digest\ndata: ")
+
+
+def test_stream_filters_by_date_and_topic():
+    from main import _digest_events
+
+    async def scenario():
+        subscription = broker.subscribe()
+        broker.publish({"date": "2026-01-04", "headlines": [{"article_id": "old", "topic": "business"}]})
+        broker.publish({"date": "2026-01-05", "headlines": [{"article_id": "a", "topic": "sports"}, {"article_id": "b", "topic": "business"}]})
+        stream = _digest_events(FakeRequest(2), subscription, "2026-01-05", "business")
+        return [chunk async for chunk in stream]
+
+    chunks = asyncio.run(scenario())
+    assert chunks[0].startswith("retry:")
+    events_sent = [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("event: digest")]
+    assert events_sent == [{"date": "2026-01-05", "headlines": [{"article_id": "b", "topic": "business"}]}]
+    assert not broker._subscribers
+
+
+def test_stream_passes_undated_resync_to_filtered_clients():
+    from main import _digest_events
+
+    async def scenario():
+        subscription = broker.subscribe()
+        broker.publish({"resync": True})
+        broker.publish({"date": "2026-01-04", "resync": True})
+        stream = _digest_events(FakeRequest(2), subscription, "2026-01-05", "business")
+        return [chunk async for chunk in stream]
+
+    chunks = asyncio.run(scenario())
+    resyncs = [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("event: resync")]
+    # 別の日付の再取得の通知は送らない
+    assert resyncs == [{"resync": True}]
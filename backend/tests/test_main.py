@@ -1,6 +1,8 @@
 from datetime import datetime
 import pytest
 
+from records import ArticleRecord
+
 def test_read_root(client):
     response = client.get("/")
     assert response.status_code == 200
@@ -67,3 +69,373 @@ def test_get_video_detail(client, db_session):
     assert response.status_code == 200
     assert response.json()["youtube_id"] == "vid_detail"
     assert response.json()["transcript"] == "Full transcript"
+
+def test_get_digest_range(client, db_session):
+    from datetime import date
+    from digests import merge_headlines
+
+    for day in (1, 2, 3, 5):
+        merge_headlines(db_session, date(2026, 1, day), [{"title": f"News {day}", "summary": "", "link": "", "source": "Google News"}])
+    db_session.commit()
+
+    response = client.get("/api/news/range?from=2026-01-02&to=2026-01-04")
+    assert response.status_code == 200
+    data = response.json()
+    assert [d["date"] for d in data["digests"]] == ["2026-01-02", "2026-01-03"]
+    assert data["digests"][0]["headlines"][0]["title"] == "News 2"
+
+    assert client.get("/api/news/range?from=2026-01-05&to=2026-01-01").status_code == 400
+    assert client.get("/api/news/range?from=2026-01-01&to=2026-12-31").status_code == 400
+
+def test_get_digest_rollup(client, db_session):
+    from datetime import date
+    from digests import merge_headlines
+
+    # 2026-01-05は月曜日。同じ週の2日分と翌週の1日分を保存し、同じ日に追加で収集する
+    merge_headlines(db_session, date(2026, 1, 5), [{"title": "Old"}])
+    merge_headlines(db_session, date(2026, 1, 7), [{"title": "Wed"}])
+    merge_headlines(db_session, date(2026, 1, 12), [{"title": "Next week"}])
+    db_session.commit()
+    merge_headlines(db_session, date(2026, 1, 5), [{"title": "Mon"}])
+    db_session.commit()
+
+    response = client.get("/api/news/rollup?period=week&target_date=2026-01-08")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["start"] == "2026-01-05"
+    assert data["end"] == "2026-01-11"
+    assert [(d["date"], [h["title"] for h in d["headlines"]]) for d in data["digests"]] == [
+        ("2026-01-05", ["Old", "Mon"]),
+        ("2026-01-07", ["Wed"]),
+    ]
+
+    data = client.get("/api/news/rollup?period=month&target_date=2026-01-31").json()
+    assert data["start"] == "2026-01-01"
+    assert len(data["digests"]) == 3
+
+    assert client.get("/api/news/rollup?period=year").status_code == 400
+
+def test_merge_headlines_accumulates(client, db_session):
+    from datetime import date
+    from database import DailyDigest, DigestHeadline
+    from digests import merge_headlines
+
+    day = date(2026, 1, 5)
+    first = [
+        {"article_id": "gn_1", "title": "記事1", "summary": "要約1", "link": "https://example.com/1", "published_at": "2026-01-05T09:00:00"},
+        {"article_id": "gn_2", "title": "記事2", "summary": "", "link": "https://example.com/2", "published_at": "2026-01-05T08:00:00"},
+    ]
+    assert len(merge_headlines(db_session, day, first)) == 2
+    db_session.commit()
+
+    # 同じ内容の再収集では何も書き込まない
+    assert merge_headlines(db_session, day, first) == []
+
+    # 2回目の収集: 要約が空でも既存の要約は消えず、新しい記事が追加される
+    second = [
+        {"article_id": "gn_1", "title": "記事1", "summary": "", "link": "https://example.com/1", "published_at": "2026-01-05T09:00:00"},
+        {"article_id": "gn_2", "title": "記事2", "summary": "要約2", "link": "https://example.com/2", "published_at": "2026-01-05T08:00:00"},
+        {"article_id": "gn_3", "title": "記事3", "summary": "要約3", "link": "https://example.com/3", "published_at": "2026-01-05T10:00:00"},
+    ]
+    changed = merge_headlines(db_session, day, second)
+    db_session.commit()
+    assert sorted(h["article_id"] for h in changed) == ["gn_2", "gn_3"]
+    assert db_session.query(DigestHeadline).count() == 3
+
+    digest = db_session.query(DailyDigest).filter(DailyDigest.date == day).one()
+    assert [(h["article_id"], h["summary"]) for h in digest.headlines] == [
+        ("gn_3", "要約3"),
+        ("gn_1", "要約1"),
+        ("gn_2", "要約2"),
+    ]
+
+def test_get_daily_digest_by_topic(client, db_session):
+    from datetime import date
+    from database import TopicDigest
+    from digests import merge_headlines
+
+    day = date(2026, 1, 5)
+    merge_headlines(db_session, day, [
+        {"article_id": "gn_1", "title": "株価が上昇", "summary": "要約1", "source": "Google News", "topic": "business", "published_at": "2026-01-05T09:00:00"},
+        {"article_id": "gn_2", "title": "代表が勝利", "summary": "要約2", "source": "Google News", "topic": "sports", "published_at": "2026-01-05T08:00:00"},
+        {"article_id": "nhk_1", "title": "円安が進む", "summary": "要約3", "source": "NHK", "topic": "business", "published_at": "2026-01-05T10:00:00"},
+    ])
+    db_session.commit()
+    assert db_session.query(TopicDigest).filter(TopicDigest.date == day).count() == 4
+
+    data = client.get("/api/news/daily", params={"target_date": "2026-01-05", "topic": "business"}).json()
+    assert data["topic"] == "business"
+    assert [h["article_id"] for h in data["headlines"]] == ["nhk_1", "gn_1"]
+
+    data = client.get("/api/news/daily", params={"target_date": "2026-01-05", "source": "Google News"}).json()
+    assert [h["article_id"] for h in data["headlines"]] == ["gn_1", "gn_2"]
+
+    data = client.get("/api/news/daily", params={"target_date": "2026-01-05", "topic": "business", "source": "NHK"}).json()
+    assert [h["article_id"] for h in data["headlines"]] == ["nhk_1"]
+
+    data = client.get("/api/news/daily", params={"target_date": "2026-01-05", "topic": "health"}).json()
+    assert data["headlines"] == []
+
+    # 見出しのトピックが変わった場合は、元のトピックの行から外れる
+    merge_headlines(db_session, day, [
+        {"article_id": "gn_2", "title": "代表が勝利", "summary": "要約2", "source": "Google News", "topic": "top", "published_at": "2026-01-05T08:00:00"},
+    ])
+    db_session.commit()
+    data = client.get("/api/news/daily", params={"target_date": "2026-01-05", "topic": "sports"}).json()
+    assert data["headlines"] == []
+
+def test_deferred_digest_refresh(db_session):
+    from datetime import date
+    from database import DailyDigest, DigestRollup
+    from digests import merge_headlines, refresh_stale_digests
+
+    day = date(2026, 1, 6)
+    merge_headlines(db_session, date(2026, 1, 5), [{"article_id": "gn_0", "title": "前日"}])
+    db_session.commit()
+    for i in range(3):
+        merge_headlines(db_session, day, [{"article_id": f"gn_{i + 1}", "title": f"記事{i + 1}"}], defer_refresh=True)
+        db_session.commit()
+    # 後回しにした間はキャッシュを書き換えない
+    assert db_session.query(DailyDigest).filter(DailyDigest.date == day).first() is None
+
+    assert refresh_stale_digests(db_session) == 1
+    db_session.commit()
+    assert refresh_stale_digests(db_session) == 0
+    assert len(db_session.query(DailyDigest).filter(DailyDigest.date == day).one().headlines) == 3
+    # ロールアップは他の日の分を残したまま、その日の分だけを差し替える
+    week = db_session.query(DigestRollup).filter(DigestRollup.period == "week").one()
+    assert {d: [h["title"] for h in hs] for d, hs in week.days.items()} == {
+        "2026-01-05": ["前日"],
+        "2026-01-06": ["記事1", "記事2", "記事3"],
+    }
+
+def test_search_news(client, db_session):
+    from datetime import date
+    from digests import merge_headlines
+
+    merge_headlines(db_session, date(2026, 1, 5), [
+        {"title": "東京都で大雪警報", "summary": "交通機関に影響", "link": "https://example.com/1", "source": "Google News"},
+        {"title": "日銀が金利を据え置き", "summary": "東京株式市場は上昇", "link": "https://example.com/2", "source": "Google News"},
+    ])
+    merge_headlines(db_session, date(2026, 1, 6), [
+        {"title": "ＡＩ規制の新法案", "summary": "", "link": "https://example.com/3", "source": "NHK"},
+    ])
+    db_session.commit()
+
+    data = client.get("/api/news/search", params={"q": "東京"}).json()
+    assert data["total"] == 2
+    # タイトルに含まれる記事が上位になる
+    assert data["results"][0]["title"] == "東京都で大雪警報"
+
+    data = client.get("/api/news/search", params={"q": "東京 株式"}).json()
+    assert [r["title"] for r in data["results"]] == ["日銀が金利を据え置き"]
+
+    # 全角・半角を区別しない
+    data = client.get("/api/news/search", params={"q": "ai"}).json()
+    assert data["results"][0]["date"] == "2026-01-06"
+
+    data = client.get("/api/news/search", params={"q": "東京", "page": 2, "per_page": 1}).json()
+    assert data["total"] == 2
+    assert len(data["results"]) == 1
+
+    assert client.get("/api/news/search", params={"q": "存在しない"}).json()["total"] == 0
+
+def test_search_single_character(client, db_session):
+    from datetime import date
+    from digests import merge_headlines
+
+    merge_headlines(db_session, date(2026, 1, 5), [
+        {"title": "日本株が反発", "summary": "", "link": "https://example.com/1"},
+        {"title": "米国の雇用統計", "summary": "", "link": "https://example.com/2"},
+    ])
+    db_session.commit()
+
+    # 長い漢字の連続の中の1文字でも検索できる
+    assert [r["title"] for r in client.get("/api/news/search", params={"q": "株"}).json()["results"]] == ["日本株が反発"]
+    assert [r["title"] for r in client.get("/api/news/search", params={"q": "米"}).json()["results"]] == ["米国の雇用統計"]
+    assert client.get("/api/news/search", params={"q": "株 米"}).json()["total"] == 0
+
+def test_search_headline_link_change(client, db_session):
+    from datetime import date
+    from digests import merge_headlines
+
+    # enrichでリンクが配信元のURLに置き換わっても、同じ記事IDの見出しは1件のまま
+    merge_headlines(db_session, date(2026, 1, 5), [
+        {"article_id": "gn_1", "title": "日本株が反発", "summary": "", "link": "https://news.google.com/rss/articles/abc"},
+    ])
+    db_session.commit()
+    merge_headlines(db_session, date(2026, 1, 5), [
+        {"article_id": "gn_1", "title": "日本株が反発", "summary": "", "link": "https://publisher.example.com/1"},
+    ])
+    db_session.commit()
+
+    data = client.get("/api/news/search", params={"q": "反発"}).json()
+    assert data["total"] == 1
+    assert data["results"][0]["link"] == "https://publisher.example.com/1"
+
+def test_metrics_endpoint(client):
+    client.get("/api/news/daily", params={"target_date": "2026-01-01"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/news/daily",status="200"}' in body
+    assert "news_collect_stage_seconds" in body
+    assert "gemini_calls_total" in body
+
+def test_collect_news_records_run(client, db_session, monkeypatch):
+    import sys
+    import digests
+    import google_news_client
+    import nhk_client
+
+    def nhk_down(self, categories=None, max_articles=20):
+        raise ConnectionError("NHK is down")
+
+    monkeypatch.setenv("COLLECT_SOURCES", "google_news,nhk")
+    monkeypatch.setattr(nhk_client.NHKNewsClient, "fetch_news", nhk_down)
+    articles = [
+        ArticleRecord("gn_1", "記事1", "https://example.com/1", "概要1", datetime(2026, 1, 5, 9, 0)),
+        ArticleRecord("gn_2", "記事2", "https://example.com/2", "概要2"),
+    ]
+    monkeypatch.setattr(google_news_client.GoogleNewsClient, "fetch_news", lambda self, topics=None, max_articles=20: articles)
+    summarizer = sys.modules["summarizer"].Summarizer.return_value
+    monkeypatch.setattr(summarizer, "usage", {"calls": 2, "input_tokens": 120, "output_tokens": 40, "input_tokens_saved": 30})
+    monkeypatch.setattr(summarizer, "summarize_batch", lambda items, deadline=None: [{"summary": "要約1"}, {"summary": ""}])
+    # ダイジェストのキャッシュ等は収集の終わりに1回だけ作り直す
+    refreshed = []
+    refresh = digests.refresh_digest_cache
+    monkeypatch.setattr(digests, "refresh_digest_cache", lambda db, day: refreshed.append(day) or refresh(db, day))
+
+    response = client.post("/api/news/collect")
+    assert response.status_code == 200
+    assert response.json()["api_calls"] == 2
+    assert len(refreshed) == 1
+
+    data = client.get("/api/news/collect/runs").json()
+    run = data["runs"][0]
+    assert run["status"] == "success"
+    assert run["trigger"] == "api"
+    assert run["articles_fetched"] == 2
+    assert run["articles_new"] == 2
+    assert run["articles_summarized"] == 1
+    assert run["input_tokens"] == 120
+    assert run["input_tokens_saved"] == 30
+    assert "summarize" in run["stage_durations"]
+    assert run["pipeline_stats"]["summarize"]["items_in"] == 2
+    assert run["pipeline_stats"]["persist"]["items_in"] == 2
+    # 失敗したソースがあっても他のソースの記事は保存される
+    assert run["source_stats"]["google:top"]["status"] == "ok"
+    assert run["source_stats"]["nhk:main"]["status"] == "error"
+    assert data["daily"][0]["gemini_calls"] == 2
+    assert data["daily"][0]["input_tokens_saved"] == 30
+
+    from database import Article, DailyDigest
+    assert db_session.query(Article).count() == 2
+    assert len(db_session.query(DailyDigest).one().headlines) == 2
+
+def test_collect_publishes_partial_digest_at_deadline(client, db_session, monkeypatch):
+    import sys
+    import time
+    import collector
+    import google_news_client
+    from database import CollectRun, DailyDigest, DigestHeadline
+
+    monkeypatch.setenv("COLLECT_SOURCES", "google_news")
+    monkeypatch.setattr(collector, "COLLECT_DEADLINE_SECONDS", 0.5)
+    articles = [
+        ArticleRecord("gn_1", "記事1", "https://example.com/1", "概要1"),
+        ArticleRecord("gn_2", "記事2", "https://example.com/2", "概要2"),
+    ]
+    monkeypatch.setattr(google_news_client.GoogleNewsClient, "fetch_news", lambda self, topics=None, max_articles=20: articles)
+
+    def slow_summaries(items, deadline=None):
+        time.sleep(1.0)
+        return [{"summary": f"要約{i}"} for i in range(len(items))]
+
+    summarizer = sys.modules["summarizer"].Summarizer.return_value
+    monkeypatch.setattr(summarizer, "usage", {"calls": 1, "input_tokens": 10, "output_tokens": 5, "input_tokens_saved": 0})
+    monkeypatch.setattr(summarizer, "summarize_batch", slow_summaries)
+
+    response = client.post("/api/news/collect")
+    assert response.status_code == 200
+    assert response.json()["status"] == "partial"
+    assert response.json()["pending_summaries"] == 2
+
+    # 締め切りの時点で見出しは要約なしで公開される
+    headlines = db_session.query(DigestHeadline).order_by(DigestHeadline.article_id).all()
+    assert [h.title for h in headlines] == ["記事1", "記事2"]
+    assert all(not h.summary for h in headlines)
+    assert db_session.query(CollectRun).one().status == "partial"
+    # バックグラウンドの処理が中断されても要約されるよう、ワークキューにも入る
+    from database import WorkItem
+    assert {(w.target_id, w.status) for w in db_session.query(WorkItem)} == {("gn_1", "pending"), ("gn_2", "pending")}
+
+    # 残りの要約はバックグラウンドで反映され、実行記録は成功になる
+    assert collector.wait_for_background(5)
+    db_session.expire_all()
+    headlines = db_session.query(DigestHeadline).order_by(DigestHeadline.article_id).all()
+    assert [h.summary for h in headlines] == ["要約0", "要約1"]
+    assert {h["summary"] for h in db_session.query(DailyDigest).one().headlines} == {"要約0", "要約1"}
+    run = db_session.query(CollectRun).one()
+    assert run.status == "success"
+    assert run.articles_summarized == 2
+    # 収集処理で要約できた記事はキューから外れる
+    assert {w.status for w in db_session.query(WorkItem)} == {"done"}
+
+def test_upsert_articles(db_session):
+    from database import Article, ArticleKeyPoint
+    from ingest import upsert_articles
+
+    articles = [
+        ArticleRecord("gn_1", "記事1", "https://example.com/1", summary="要約1", key_points=["a", "b"], source="Google News", topic="top"),
+        ArticleRecord("gn_2", "記事2", "https://example.com/2", source="Google News"),
+    ]
+    assert upsert_articles(db_session, articles) == 2
+    db_session.commit()
+
+    # 再取得: タイトルは更新し、空の要約では既存の要約を上書きしない
+    assert upsert_articles(db_session, [
+        ArticleRecord("gn_1", "記事1 (更新)", "https://example.com/1", key_points=["c"]),
+    ]) == 1
+    db_session.commit()
+    db_session.expire_all()
+
+    article = db_session.get(Article, "gn_1")
+    assert article.title == "記事1 (更新)"
+    assert article.summary == "要約1"
+    assert article.status == "processed"
+    assert article.category == "top"
+    assert [p.point for p in db_session.query(ArticleKeyPoint).filter_by(article_id="gn_1")] == ["c"]
+    assert db_session.get(Article, "gn_2").status == "unprocessed"
+
+    # 保存した記事は再インデックスなしで検索でき、保存された要約で置き換わる
+    from search import search
+    total, results = search(db_session, "更新")
+    assert total == 1
+    assert (results[0]["kind"], results[0]["summary"]) == ("article", "要約1")
+    assert search(db_session, "記事")[0] == 2
+
+def test_upsert_articles_indexes_in_constant_statements(db_session):
+    from sqlalchemy import event
+    from database import SearchDocument
+    from ingest import upsert_articles
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # 記事数によらず、検索インデックスの文書とポスティングはそれぞれ1回のINSERTで書き込む
+    def insert_counts(n):
+        articles = [ArticleRecord(f"gn_{n}_{i}", f"記事{i}", f"https://example.com/{n}/{i}") for i in range(n)]
+        statements.clear()
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            upsert_articles(db_session, articles)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        return len(statements)
+
+    assert insert_counts(300) == insert_counts(3)
+    assert db_session.query(SearchDocument).count() == 303
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def test_items_flow_through_all_stages():
+    saved = []
+    pipeline = Pipeline([
+        Stage("fetch", lambda feed: [f"{feed}-{i}" for i in range(3)], workers=2),
+        Stage("upper", lambda item: [item.upper()], workers=3),
+        Stage("save", lambda batch: saved.extend(batch), batch_size=4),
+    ], queue_size=2)
+
+    stats = pipeline.run(["a", "b"])
+
+    assert sorted(saved) == ["A-0", "A-1", "A-2", "B-0", "B-1", "B-2"]
+    assert stats["fetch"]["items_in"] == 2
+    assert stats["fetch"]["items_out"] == 6
+    assert stats["upper"]["items_in"] == 6
+    assert stats["save"]["items_in"] == 6
+    assert stats["save"]["calls"] <= 6
+
+
+def test_bounded_queue_limits_items_in_flight():
+    in_flight = []
+    current = [0]
+    lock = threading.Lock()
+
+    def produce(n):
+        for i in range(n):
+            with lock:
+                current[0] += 1
+                in_flight.append(current[0])
+            yield i
+
+    def slow(item):
+        time.sleep(0.002)
+        with lock:
+            current[0] -= 1
+
+    Pipeline([Stage("produce", produce), Stage("slow", slow)], queue_size=5).run([100])
+
+    # キューの容量 + 処理中の1件 + 生成中の1件を超えて先行しない
+    assert max(in_flight) <= 7
+
+
+def test_stage_error_is_raised_after_draining():
+    def fail(item):
+        if item == 3:
+            raise ValueError("boom")
+        return [item]
+
+    pipeline = Pipeline([Stage("first", lambda item: [item]), Stage("fail", fail, workers=2)], queue_size=1)
+    with pytest.raises(ValueError, match="boom"):
+        pipeline.run(range(50))
+    assert pipeline.stats["fail"].errors == 1
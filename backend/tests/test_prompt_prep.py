@@ -0,0 +1,68 @@
+from prompt_prep import TokenCounter, clean_text, prepare_batch, split_title
+from records import ArticleRecord
+
+
+def test_split_title_separates_publisher():
+    assert split_title("円相場 一時150円台に - 日本経済新聞") == ("円相場 一時150円台に", "日本経済新聞")
+    assert split_title("見出しのみ") == ("見出しのみ", None)
+
+
+def test_clean_text_strips_echoes_boilerplate_and_duplicates():
+    # Google Newsの description はタイトルと配信元名の繰り返しだけのことが多い
+    assert clean_text("円相場 一時150円台に 日本経済新聞", "円相場 一時150円台に", "日本経済新聞") == ""
+
+    text = "政府は新たな対策を発表した。政府は新たな対策を発表した。続きを読む。Copyright 2026 Example."
+    assert clean_text(text, "対策発表") == "政府は新たな対策を発表した。"
+
+
+def test_clean_text_keeps_publisher_names_inside_words():
+    # 配信元名を含む語 (「日経平均」「NHKの」) は残し、区切られた先頭・末尾の配信元名だけを除く
+    assert clean_text("日経平均株価が上昇した。日経", "株価上昇", "日経") == "日経平均株価が上昇した。"
+    assert clean_text("NHKの調査で分かった。", "調査結果", "NHK") == "NHKの調査で分かった。"
+    assert clean_text("NHK - 政府は対策を発表した。", "新対策", "NHK") == "政府は対策を発表した。"
+    assert clean_text("新対策の詳細が判明した | NHK", "新対策", "NHK") == "新対策の詳細が判明した"
+
+
+def test_trim_keeps_whole_sentences_within_budget():
+    counter = TokenCounter(chars_per_token=1.0)
+    text = "一文目です。二文目です。三文目です。"
+    assert counter.trim(text, 12) == "一文目です。二文目です。"
+    # 1文目が収まらない場合は文字数で切る
+    assert counter.trim("とても長い一文目です。", 5) == "とても長…"
+
+
+def test_token_counter_calibrates_once_and_follows_usage():
+    calls = []
+
+    def count(text):
+        calls.append(text)
+        return len(text) // 2
+
+    counter = TokenCounter(count)
+    counter.calibrate("短い")
+    assert calls == []
+    counter.calibrate("あ" * 400)
+    counter.calibrate("あ" * 400)
+    assert len(calls) == 1
+    assert counter.chars_per_token == 2.0
+
+    counter.observe("あ" * 400, 400)
+    assert 1.0 < counter.chars_per_token < 2.0
+
+
+def test_prepare_batch_reports_tokens_saved():
+    counter = TokenCounter(chars_per_token=1.0)
+    articles = [
+        ArticleRecord("gn_1", "円相場 一時150円台に - 日本経済新聞", description="円相場 一時150円台に 日本経済新聞"),
+        ArticleRecord("nhk_1", "新対策 - NHK", content="政府は新たな対策を発表した。" * 5),
+    ]
+    text, stats = prepare_batch(articles, counter, budget=30)
+
+    assert "1. 【円相場 一時150円台に】\n   \n" in text
+    assert "2. 【新対策】\n   政府は新たな対策を発表した。\n" in text
+    assert stats["tokens"] == len(text)
+    assert stats["tokens_saved"] > 0
+
+    # 本文を抽出できた記事は、整形前の形式 (概要の先頭500文字) より長くなるため、減らしたことにしない
+    text, stats = prepare_batch([ArticleRecord("gn_2", "新対策", content="政府は新たな対策を発表した。" * 5)], counter, budget=300)
+    assert stats["tokens_saved"] == 0
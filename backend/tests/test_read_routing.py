@@ -0,0 +1,64 @@
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+import database
+from main import LAST_WRITE_COOKIE, get_read_db
+
+
+def make_request(cookie=None):
+    headers = [(b"cookie", f"{LAST_WRITE_COOKIE}={cookie}".encode())] if cookie is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def bind_of(request):
+    gen = get_read_db(request)
+    db = next(gen)
+    try:
+        return db.get_bind()
+    finally:
+        gen.close()
+
+
+def with_replica(monkeypatch):
+    replica = create_engine("sqlite://")
+    monkeypatch.setattr(database, "read_engine", replica)
+    monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(bind=replica))
+    monkeypatch.setattr(database, "_last_write_at", 0.0)
+    return replica
+
+
+def test_without_replica_reads_primary(monkeypatch):
+    monkeypatch.setattr(database, "read_engine", database.engine)
+    assert bind_of(make_request()) is database.engine
+
+
+def test_reads_go_to_replica(monkeypatch):
+    replica = with_replica(monkeypatch)
+    assert bind_of(make_request()) is replica
+
+
+def test_recent_write_in_process_reads_primary(monkeypatch):
+    with_replica(monkeypatch)
+    database.mark_primary_write()
+    assert bind_of(make_request()) is database.engine
+
+
+def test_recent_write_cookie_reads_primary(monkeypatch):
+    replica = with_replica(monkeypatch)
+    assert bind_of(make_request(time.time())) is database.engine
+    # 期限切れ・不正な値のCookieはレプリカを使う
+    assert bind_of(make_request(time.time() - database.READ_YOUR_WRITES_SECONDS - 1)) is replica
+    assert bind_of(make_request("invalid")) is replica
+
+
+def test_future_write_cookie_is_ignored(monkeypatch):
+    replica = with_replica(monkeypatch)
+    # 時計のずれの範囲ならプライマリ、それより未来の時刻や非有限値はレプリカを使う
+    assert bind_of(make_request(time.time() + 1)) is database.engine
+    assert bind_of(make_request(time.time() + database.CLOCK_SKEW_SECONDS + 60)) is replica
+    assert bind_of(make_request("99999999999")) is replica
+    assert bind_of(make_request("inf")) is replica
+    assert bind_of(make_request("nan")) is replica
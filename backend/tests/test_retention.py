@@ -0,0 +1,39 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+from database import Article, Video, VideoTranscript
+from retention import apply_retention
+
+
+def test_retention_purges_old_transcripts_and_article_bodies(db_session, tmp_path):
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(days=100)
+    db_session.add_all([
+        Video(youtube_id="old", title="Old", published_at=old, transcript="古い字幕" * 100),
+        Video(youtube_id="new", title="New", published_at=now, transcript="新しい字幕"),
+        Article(article_id="a_old", title="Old", link="https://example.com/old", content="本文", summary="要約", published_at=old),
+        Article(article_id="a_new", title="New", link="https://example.com/new", content="本文", published_at=now),
+        # 公開日時が不明な記事は登録日時で判定する
+        Article(article_id="a_undated", title="Undated", link="https://example.com/undated", content="本文", created_at=old),
+    ])
+    db_session.commit()
+
+    assert apply_retention(db_session, days=90, archive_dir=str(tmp_path)) == {"transcripts": 1, "articles": 2}
+    db_session.expire_all()
+
+    assert db_session.get(Video, "old").transcript is None
+    assert db_session.get(Video, "new").transcript == "新しい字幕"
+    assert db_session.query(VideoTranscript).count() == 1
+    assert db_session.get(Article, "a_old").content is None
+    assert db_session.get(Article, "a_old").summary == "要約"
+    assert db_session.get(Article, "a_new").content == "本文"
+    assert db_session.get(Article, "a_undated").content is None
+
+    [archive] = tmp_path.glob("transcripts-*.jsonl.gz")
+    with gzip.open(archive, "rt", encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"youtube_id": "old", "transcript": "古い字幕" * 100}
+
+
+def test_retention_disabled(db_session):
+    assert apply_retention(db_session, days=0) == {"transcripts": 0, "articles": 0}
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import scheduler
+from database import FeedPollState
+from scheduler import feed_fingerprint, next_run_time, update_interval
+
+NOW = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+FEED_XML = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel>
+<lastBuildDate>{build}</lastBuildDate>
+<item><title>A</title><link>https://example.com/a</link></item>
+<item><title>B</title><link>https://example.com/b</link></item>
+</channel></rss>"""
+
+
+def make_state(**kwargs):
+    values = {"feed_key": "google:top", "interval_seconds": 1800, "unchanged_count": 0}
+    values.update(kwargs)
+    return FeedPollState(**values)
+
+
+def test_unchanged_feed_backs_off_until_max():
+    state = make_state()
+    for _ in range(20):
+        update_interval(state, changed=False, now=NOW)
+    assert state.interval_seconds == scheduler.MAX_INTERVAL
+    assert state.unchanged_count == 20
+    assert state.last_checked_at == NOW
+
+
+def test_changed_feed_follows_observed_update_frequency():
+    # 10分ごとに更新されるフィードは、5分間隔 (最小値) でポーリングされる
+    state = make_state(last_changed_at=NOW - timedelta(minutes=10))
+    update_interval(state, changed=True, now=NOW)
+    assert state.avg_change_interval == 600
+    assert state.interval_seconds == 300
+    assert state.last_changed_at == NOW
+    assert state.unchanged_count == 0
+
+    # 更新間隔が延びると移動平均に追従して間隔も延びる
+    later = NOW + timedelta(hours=2)
+    update_interval(state, changed=True, now=later)
+    assert state.avg_change_interval == 0.3 * 7200 + 0.7 * 600
+    assert state.interval_seconds == int(state.avg_change_interval / 2)
+
+
+def test_overdue_feed_runs_immediately_after_downtime():
+    state = make_state(last_checked_at=NOW - timedelta(hours=5), interval_seconds=600)
+    assert next_run_time(state, NOW) == NOW
+    assert next_run_time(None, NOW) == NOW
+
+    # naive datetime (SQLite) もUTCとして扱う
+    recent = make_state(last_checked_at=datetime(2026, 1, 1, 11, 55, 0), interval_seconds=600)
+    assert next_run_time(recent, NOW) == NOW + timedelta(minutes=5)
+
+
+def test_fingerprint_ignores_build_date():
+    first = feed_fingerprint(FEED_XML.replace(b"{build}", b"Mon, 01 Jan 2026 00:00:00 GMT"))
+    second = feed_fingerprint(FEED_XML.replace(b"{build}", b"Mon, 01 Jan 2026 01:00:00 GMT"))
+    assert first == second
+    assert first != feed_fingerprint(FEED_XML.replace(b"<title>B</title><link>https://example.com/b", b"<title>C</title><link>https://example.com/c"))
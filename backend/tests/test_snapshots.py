@@ -0,0 +1,81 @@
+import gzip
+import json
+from datetime import date
+
+import snapshots
+from digests import merge_headlines
+from snapshots import export_all
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_snapshot_written_on_commit_matches_api(client, db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    day = date(2026, 1, 5)
+    merge_headlines(db_session, day, [{"article_id": "a1", "title": "見出し", "summary": "要約", "link": "https://example.com/1"}])
+    # commit前は書き出さない
+    assert not (tmp_path / "daily").exists()
+    db_session.commit()
+
+    path = tmp_path / "daily" / "2026-01-05.json"
+    snapshot = _read(path)
+    assert snapshot == client.get("/api/news/daily", params={"target_date": "2026-01-05"}).json()
+    with gzip.open(f"{path}.gz", "rt", encoding="utf-8") as f:
+        assert json.load(f) == snapshot
+    assert _read(tmp_path / "daily" / "index.json")["dates"] == [
+        {"date": "2026-01-05", "updated_at": snapshot["updated_at"], "headlines": 1}
+    ]
+    # 一時ファイルは残らない
+    assert not list((tmp_path / "daily").glob(".tmp-*"))
+
+
+def test_snapshot_not_written_on_rollback(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    merge_headlines(db_session, date(2026, 1, 5), [{"article_id": "a1", "title": "見出し", "summary": "要約"}])
+    db_session.rollback()
+    db_session.commit()
+    assert not (tmp_path / "daily").exists()
+
+
+def test_export_all_updates_index(db_session, tmp_path, monkeypatch):
+    for day in (date(2026, 1, 4), date(2026, 1, 5)):
+        merge_headlines(db_session, day, [{"article_id": f"a{day.day}", "title": "見出し", "summary": "要約"}])
+    db_session.commit()
+
+    assert export_all(db_session, str(tmp_path), days=1) == 1
+    assert [e["date"] for e in _read(tmp_path / "daily" / "index.json")["dates"]] == ["2026-01-05"]
+    export_all(db_session, str(tmp_path))
+    assert [e["date"] for e in _read(tmp_path / "daily" / "index.json")["dates"]] == ["2026-01-05", "2026-01-04"]
+
+
+def _write_days(directory, days, barrier):
+    from snapshots import daily_payload, write_snapshots
+
+    barrier.wait()
+    for day in days:
+        write_snapshots(directory, [daily_payload(day, [{"title": "見出し"}], None)])
+
+
+def test_index_keeps_dates_written_by_concurrent_processes(tmp_path):
+    import multiprocessing
+    from datetime import timedelta
+
+    context = multiprocessing.get_context("spawn")
+    workers = 4
+    days = [date(2026, 1, 1) + timedelta(days=i) for i in range(workers * 30)]
+    barrier = context.Barrier(workers)
+    processes = [
+        context.Process(target=_write_days, args=(str(tmp_path), days[i::workers], barrier))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+        assert p.exitcode == 0
+    # 別のプロセスの書き込みで他の日付が消えない
+    dates = [e["date"] for e in _read(tmp_path / "daily" / "index.json")["dates"]]
+    assert dates == [d.isoformat() for d in reversed(days)]
@@ -0,0 +1,41 @@
+import time
+
+from records import ArticleRecord, VideoRecord
+from sources import SourceJob, fetch_job, video_to_article
+
+
+def test_fetch_job_records_success():
+    stats = {}
+    articles = fetch_job(SourceJob("nhk", "nhk:main", lambda: [ArticleRecord("k1")]), stats)
+    assert articles == [ArticleRecord("k1")]
+    assert stats["nhk:main"]["status"] == "ok"
+    assert stats["nhk:main"]["articles"] == 1
+
+
+def test_fetch_job_isolates_failures_and_timeouts():
+    def fail():
+        raise ConnectionError("down")
+
+    def slow():
+        time.sleep(2)
+        return [ArticleRecord("late")]
+
+    stats = {}
+    start = time.perf_counter()
+    assert fetch_job(SourceJob("nhk", "nhk:main", fail), stats) == []
+    assert fetch_job(SourceJob("youtube", "youtube:UC1", slow), stats, timeout=0.1) == []
+    # 遅いソースの完了を待たない
+    assert time.perf_counter() - start < 1
+    assert stats["nhk:main"]["status"] == "error"
+    assert stats["youtube:UC1"]["status"] == "timeout"
+
+
+def test_video_to_article():
+    article = video_to_article(
+        VideoRecord("abc", "【ライブ】1/5 朝ニュースまとめ", "概要", "2026-01-05T09:00:00+00:00"),
+        "UC1",
+    )
+    assert article.article_id == "yt_abc"
+    assert article.link == "https://www.youtube.com/watch?v=abc"
+    assert article.source == "YouTube"
+    assert article.published_at.year == 2026
@@ -0,0 +1,133 @@
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from database import Article, DailyDigest, DigestHeadline, Video, WorkItem
+from digests import merge_headlines
+import work_queue
+from work_queue import KIND_ARTICLE, KIND_VIDEO, claim, complete, enqueue, enqueue_backlog, fail, process_items
+
+
+def _expire_leases(db):
+    db.query(WorkItem).update({WorkItem.lease_expires_at: datetime.now(timezone.utc) - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_enqueue_is_idempotent_and_claim_leases_items(db_session):
+    enqueue(db_session, KIND_ARTICLE, ["a1", "a2", "a1"])
+    enqueue(db_session, KIND_ARTICLE, ["a2", "a3"])
+    db_session.commit()
+    assert db_session.query(WorkItem).count() == 3
+
+    first = claim(db_session, "w1", limit=2)
+    assert [i.target_id for i in first] == ["a1", "a2"]
+    assert all(i.status == "running" and i.locked_by == "w1" and i.attempts == 1 for i in first)
+
+    # リース中の作業は他のワーカーに渡さない
+    second = claim(db_session, "w2", limit=5)
+    assert [i.target_id for i in second] == ["a3"]
+    assert claim(db_session, "w3") == []
+
+
+def test_expired_lease_is_reclaimed_and_late_completion_is_rejected(db_session):
+    enqueue(db_session, KIND_ARTICLE, ["a1"])
+    db_session.commit()
+    [item] = claim(db_session, "w1")
+    _expire_leases(db_session)
+
+    [again] = claim(db_session, "w2")
+    assert again.id == item.id and again.attempts == 2
+    # リースを失ったワーカーは完了にできない
+    assert complete(db_session, item.id, "w1") is False
+    assert complete(db_session, item.id, "w2") is True
+    db_session.commit()
+    assert db_session.get(WorkItem, item.id).status == "done"
+
+
+def test_failures_back_off_then_dead_letter(db_session, monkeypatch):
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 2)
+    enqueue(db_session, KIND_ARTICLE, ["a1"])
+    db_session.commit()
+
+    [item] = claim(db_session, "w1")
+    assert fail(db_session, item.id, "w1", "boom") == "pending"
+    db_session.commit()
+    row = db_session.get(WorkItem, item.id)
+    assert row.last_error == "boom"
+    # 待ち時間の間は取得しない
+    assert claim(db_session, "w1") == []
+
+    db_session.query(WorkItem).update({WorkItem.available_at: datetime.now(timezone.utc) - timedelta(seconds=1)})
+    db_session.commit()
+    [item] = claim(db_session, "w1")
+    assert fail(db_session, item.id, "w1", "boom again") == "dead"
+    db_session.commit()
+    assert db_session.get(WorkItem, item.id).status == "dead"
+
+    # 登録し直しても dead の作業はそのまま (requeue_done の場合だけ戻す)
+    enqueue(db_session, KIND_ARTICLE, ["a1"])
+    db_session.commit()
+    assert db_session.get(WorkItem, item.id).status == "dead"
+    enqueue(db_session, KIND_ARTICLE, ["a1"], requeue_done=True)
+    db_session.commit()
+    db_session.expire_all()
+    assert db_session.get(WorkItem, item.id).status == "pending"
+    assert db_session.get(WorkItem, item.id).attempts == 0
+
+
+def test_process_items_saves_summaries_and_fills_digest(db_session):
+    today = date.today()
+    db_session.add_all([
+        Article(article_id="a1", title="記事1", link="https://example.com/1", description="概要1", status="unprocessed"),
+        Article(article_id="a2", title="記事2", link="https://example.com/2", description="概要2", status="unprocessed"),
+        Video(youtube_id="v1", title="動画", status="unprocessed"),
+    ])
+    merge_headlines(db_session, today, [{"article_id": "a1", "title": "記事1", "summary": "", "link": "https://example.com/1"}])
+    db_session.commit()
+    enqueue_backlog(db_session)
+    enqueue(db_session, KIND_ARTICLE, ["missing"])
+    enqueue(db_session, KIND_VIDEO, ["v1"])
+    db_session.commit()
+
+    summarizer = MagicMock()
+    summarizer.summarize_batch.return_value = [
+        {"title": "記事1", "summary": "要約1", "key_points": ["点1"]},
+        {"title": "記事2", "summary": "失敗", "error": True},
+    ]
+    items = claim(db_session, "w1", limit=10)
+    counts = process_items(db_session, summarizer, "w1", items)
+
+    # 存在しない記事と字幕のない動画は再試行しない
+    assert counts == {"done": 1, "retry": 1, "dead": 2, "lost": 0}
+    db_session.expire_all()
+    a1 = db_session.get(Article, "a1")
+    assert a1.summary == "要約1" and a1.status == "processed"
+    assert [k.point for k in a1.key_points] == ["点1"]
+    assert db_session.get(Article, "a2").status == "unprocessed"
+    assert db_session.query(DigestHeadline).filter_by(article_id="a1").one().summary == "要約1"
+    assert db_session.query(DailyDigest).filter_by(date=today).one().headlines[0]["summary"] == "要約1"
+    statuses = {(i.kind, i.target_id): i.status for i in db_session.query(WorkItem)}
+    assert statuses == {
+        (KIND_ARTICLE, "a1"): "done",
+        (KIND_ARTICLE, "a2"): "pending",
+        (KIND_ARTICLE, "missing"): "dead",
+        (KIND_VIDEO, "v1"): "dead",
+    }
+
+
+def test_process_items_passes_deadline_to_video_summary(db_session):
+    from deadline import Deadline
+    from database import VideoTranscript
+
+    db_session.add(Video(youtube_id="v1", title="動画", status="unprocessed"))
+    db_session.add(VideoTranscript(youtube_id="v1", text="字幕"))
+    enqueue(db_session, KIND_VIDEO, ["v1"])
+    db_session.commit()
+
+    summarizer = MagicMock()
+    summarizer.summarize.return_value = {"summary": "動画の要約", "key_points": []}
+    deadline = Deadline(30)
+    counts = process_items(db_session, summarizer, "w1", claim(db_session, "w1"), deadline)
+
+    # 動画の要約も締め切りを守る
+    assert counts["done"] == 1
+    summarizer.summarize.assert_called_once_with("字幕", deadline=deadline)
@@ -0,0 +1,484 @@
+"""
+要約のワークキュー
+
+記事・動画1件ごとの要約を work_items テーブルの作業として登録し、任意の数のワーカープロセス
+(同じホストでも別のホストでも) が SELECT ... FOR UPDATE SKIP LOCKED で取得して並行に処理する。
+停止や障害で溜まった未要約の記事、モデル変更後の再要約などを、収集1回の処理能力に縛られずに消化できる。
+
+- 取得した作業にはリース (期限) が付き、期限までに完了しなかった作業 (ワーカーの異常終了など) は他のワーカーが取得し直す。
+- 失敗した作業は指数的に間隔を空けて再試行し、試行回数が上限 (max_attempts) に達したら dead にして再試行しない。
+- 完了は要約の保存と同じトランザクションで、リースを持っている場合だけ行う (リースを失った結果は保存しない)。
+
+収集処理 (collector.py) は、要約できずに保存した記事を登録し、要約できた記事の未取得の作業は完了にする。コマンドラインから実行する:
+    python work_queue.py enqueue-backlog          # 未要約の記事・動画を全て登録する
+    python work_queue.py enqueue-backlog --all    # 要約済みのものも登録し直す (モデル変更後の再要約)
+    python work_queue.py worker                   # ワーカーを起動する (SIGTERMで処理中の作業を終えてから停止)
+    python work_queue.py stats                    # 種類・状態ごとの件数
+    python work_queue.py retry-dead               # dead の作業を再試行する
+"""
+
+import os
+import signal
+import socket
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.orm import Session, undefer
+
+from database import (
+    Article,
+    ArticleKeyPoint,
+    DigestHeadline,
+    KeyPoint,
+    Video,
+    VideoTranscript,
+    WorkItem,
+    dialect_insert,
+    mark_primary_write,
+)
+from deadline import Deadline
+from digests import headline_to_dict, merge_headlines
+from metrics import WORK_ITEMS_TOTAL
+from records import ArticleRecord
+from search import index_article
+
+KIND_ARTICLE = "article"
+KIND_VIDEO = "video"
+KINDS = (KIND_ARTICLE, KIND_VIDEO)
+
+# 取得した作業のリースの秒数 (要約はこの8割の時間で打ち切る)
+LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "300"))
+# 1作業あたりの試行回数の上限
+MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "5"))
+# 再試行までの待ち時間 (RETRY_BASE_SECONDS * 2^(試行回数-1)、RETRY_MAX_SECONDS まで)
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+# ワーカーが1回に取得する件数 (記事は1回のAPI呼び出しでまとめて要約する)
+CLAIM_BATCH_SIZE = int(os.getenv("WORK_CLAIM_BATCH_SIZE", "5"))
+# 作業がない場合に次に取得を試みるまでの秒数
+POLL_SECONDS = float(os.getenv("WORK_POLL_SECONDS", "10"))
+# 1文あたりの行数 (SQLiteのバインド変数の上限を超えないようにする)
+CHUNK_SIZE = 500
+
+
+class PermanentError(Exception):
+    """再試行しても成功しない失敗 (対象の記事が存在しない等)。すぐに dead にする"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue(db: Session, kind: str, target_ids: List[str], requeue_done: bool = False) -> int:
+    """
+    作業を登録する。登録済みの作業は、requeue_done の場合に完了済み (done, dead) のものだけ pending に戻す。
+    処理中の作業には影響しない。commitは呼び出し元で行う。
+
+    Returns:
+        登録を試みた件数
+    """
+    target_ids = list(dict.fromkeys(t for t in target_ids if t))
+    if not target_ids:
+        return 0
+    now = _now()
+    insert_stmt = dialect_insert(db)
+    for i in range(0, len(target_ids), CHUNK_SIZE):
+        rows = [
+            {
+                "kind": kind,
+                "target_id": target_id,
+                "status": "pending",
+                "attempts": 0,
+                "max_attempts": MAX_ATTEMPTS,
+                "available_at": now,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for target_id in target_ids[i:i + CHUNK_SIZE]
+        ]
+        stmt = insert_stmt(WorkItem).values(rows)
+        if requeue_done:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[WorkItem.kind, WorkItem.target_id],
+                set_={
+                    "status": "pending",
+                    "attempts": 0,
+                    "available_at": now,
+                    "last_error": None,
+                    "updated_at": now,
+                },
+                where=WorkItem.status.in_(["done", "dead"]),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[WorkItem.kind, WorkItem.target_id])
+        db.execute(stmt)
+    return len(target_ids)
+
+
+def cancel(db: Session, kind: str, target_ids: List[str]) -> int:
+    """
+    まだ取得されていない作業を完了にする (収集処理が先に要約できた記事の分)。commitは呼び出し元で行う。
+    """
+    target_ids = list(dict.fromkeys(t for t in target_ids if t))
+    count = 0
+    for i in range(0, len(target_ids), CHUNK_SIZE):
+        count += db.execute(
+            update(WorkItem)
+            .where(
+                WorkItem.kind == kind,
+                WorkItem.target_id.in_(target_ids[i:i + CHUNK_SIZE]),
+                WorkItem.status == "pending",
+            )
+            .values(status="done", updated_at=_now())
+        ).rowcount
+    return count
+
+
+def enqueue_backlog(db: Session, include_processed: bool = False) -> Dict[str, int]:
+    """未要約の記事と、字幕のある未要約の動画を登録する (include_processed の場合は要約済みも)。commitする。"""
+    articles = db.query(Article.article_id)
+    videos = db.query(Video.youtube_id).join(VideoTranscript)
+    if not include_processed:
+        articles = articles.filter(Article.status != "processed")
+        videos = videos.filter(Video.status != "processed")
+    result = {
+        KIND_ARTICLE: enqueue(db, KIND_ARTICLE, [r[0] for r in articles], requeue_done=include_processed),
+        KIND_VIDEO: enqueue(db, KIND_VIDEO, [r[0] for r in videos], requeue_done=include_processed),
+    }
+    db.commit()
+    return result
+
+
+def claim(
+    db: Session,
+    worker_id: str,
+    limit: int = CLAIM_BATCH_SIZE,
+    lease_seconds: float = LEASE_SECONDS,
+    kind: Optional[str] = None,
+) -> List[WorkItem]:
+    """
+    処理できる作業 (待ち時間を過ぎた pending と、リースが切れた running) を古い順に取得し、リースを付けてcommitする。
+    他のワーカーが取得中の行は SKIP LOCKED で読み飛ばすため、複数のワーカーが同じ作業を取得することはない。
+    リースが切れた作業のうち、試行回数が上限に達しているものは dead にする。
+    """
+    now = _now()
+    query = db.query(WorkItem).filter(
+        or_(
+            and_(WorkItem.status == "pending", WorkItem.available_at <= now),
+            and_(WorkItem.status == "running", WorkItem.lease_expires_at < now),
+        )
+    )
+    if kind:
+        query = query.filter(WorkItem.kind == kind)
+    items = query.order_by(WorkItem.available_at, WorkItem.id).limit(limit).with_for_update(skip_locked=True).all()
+
+    claimed = []
+    for item in items:
+        item.updated_at = now
+        if item.attempts >= item.max_attempts:
+            item.status = "dead"
+            item.locked_by = None
+            item.lease_expires_at = None
+            item.last_error = f"lease expired ({item.last_error})" if item.last_error else "lease expired"
+            WORK_ITEMS_TOTAL.labels(kind=item.kind, outcome="dead").inc()
+            continue
+        item.status = "running"
+        item.locked_by = worker_id
+        item.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        item.attempts += 1
+        claimed.append(item)
+    db.commit()
+    return claimed
+
+
+def complete(db: Session, item_id: int, worker_id: str) -> bool:
+    """
+    作業を完了にする (リースを持っている場合だけ)。結果の保存と同じトランザクションで呼び、commitは呼び出し元で行う。
+    False の場合はリースを失っている (他のワーカーが取得し直した) ため、結果を保存してはならない。
+    """
+    result = db.execute(
+        update(WorkItem)
+        .where(WorkItem.id == item_id, WorkItem.locked_by == worker_id, WorkItem.status == "running")
+        .values(status="done", locked_by=None, lease_expires_at=None, last_error=None, updated_at=_now())
+    )
+    return result.rowcount == 1
+
+
+def fail(db: Session, item_id: int, worker_id: str, error: str, permanent: bool = False) -> Optional[str]:
+    """
+    作業を失敗にする (リースを持っている場合だけ)。試行回数が上限に達したか permanent の場合は dead、
+    それ以外は待ち時間を空けて pending に戻す。commitは呼び出し元で行う。
+
+    Returns:
+        変更後の状態 (リースを失っている場合は None)
+    """
+    item = (
+        db.query(WorkItem)
+        .filter(WorkItem.id == item_id, WorkItem.locked_by == worker_id, WorkItem.status == "running")
+        .with_for_update()
+        .one_or_none()
+    )
+    if item is None:
+        return None
+    now = _now()
+    item.locked_by = None
+    item.lease_expires_at = None
+    item.last_error = error[:1000]
+    item.updated_at = now
+    if permanent or item.attempts >= item.max_attempts:
+        item.status = "dead"
+    else:
+        item.status = "pending"
+        delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, item.attempts - 1))
+        item.available_at = now + timedelta(seconds=delay)
+    WORK_ITEMS_TOTAL.labels(kind=item.kind, outcome="dead" if item.status == "dead" else "retry").inc()
+    return item.status
+
+
+def retry_dead(db: Session, kind: Optional[str] = None) -> int:
+    """dead の作業を試行回数を戻して pending にする。commitする。"""
+    stmt = update(WorkItem).where(WorkItem.status == "dead")
+    if kind:
+        stmt = stmt.where(WorkItem.kind == kind)
+    now = _now()
+    count = db.execute(stmt.values(status="pending", attempts=0, available_at=now, updated_at=now)).rowcount
+    db.commit()
+    return count
+
+
+def queue_stats(db: Session) -> Dict[str, Dict[str, int]]:
+    """種類・状態ごとの作業数"""
+    stats: Dict[str, Dict[str, int]] = defaultdict(dict)
+    rows = db.query(WorkItem.kind, WorkItem.status, func.count()).group_by(WorkItem.kind, WorkItem.status)
+    for kind, status, count in rows:
+        stats[kind][status] = count
+    return dict(stats)
+
+
+# =====================================================
+# 作業の処理
+# =====================================================
+
+
+def process_items(db: Session, summarizer, worker_id: str, items: List[WorkItem], deadline: Optional[Deadline] = None) -> Dict[str, int]:
+    """
+    取得した作業を要約して保存し、完了・失敗を記録してcommitする。
+    記事はまとめて1回のAPI呼び出しで要約し、動画は1件ずつ要約する。
+
+    Returns:
+        結果ごとの件数 {"done": n, "retry": n, "dead": n, "lost": n}
+    """
+    counts = {"done": 0, "retry": 0, "dead": 0, "lost": 0}
+    # 要約の呼び出し中にトランザクションを開いたままにしない
+    claimed = [(item.id, item.kind, item.target_id) for item in items]
+    db.rollback()
+
+    by_kind = defaultdict(list)
+    for item_id, kind, target_id in claimed:
+        by_kind[kind].append((item_id, target_id))
+    outcomes = []  # (item_id, kind, 結果 or 例外)
+    if by_kind.get(KIND_ARTICLE):
+        outcomes.extend(_summarize_articles(db, summarizer, by_kind.pop(KIND_ARTICLE), deadline))
+    for item_id, target_id in by_kind.pop(KIND_VIDEO, []):
+        outcomes.append(_summarize_video(db, summarizer, item_id, target_id, deadline))
+    for kind, pairs in by_kind.items():
+        outcomes.extend((item_id, kind, PermanentError(f"unknown kind: {kind}")) for item_id, _ in pairs)
+
+    try:
+        headlines = defaultdict(list)
+        for item_id, kind, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                status = fail(db, item_id, worker_id, str(outcome), permanent=isinstance(outcome, PermanentError))
+                counts[{"pending": "retry", "dead": "dead"}.get(status, "lost")] += 1
+                continue
+            if not complete(db, item_id, worker_id):
+                # リースを失っている (他のワーカーが処理する) ため、結果は保存しない
+                counts["lost"] += 1
+                continue
+            _save_summary(db, kind, outcome, headlines)
+            WORK_ITEMS_TOTAL.labels(kind=kind, outcome="done").inc()
+            counts["done"] += 1
+        for day, rows in headlines.items():
+            merge_headlines(db, day, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if counts["done"]:
+        mark_primary_write()
+    return counts
+
+
+def _summarize_articles(db: Session, summarizer, pairs, deadline: Optional[Deadline]) -> List:
+    """記事をまとめて要約する (要約済みの記事も要約し直す)"""
+    ids = [target_id for _, target_id in pairs]
+    articles = {
+        a.article_id: a
+        for a in db.query(Article).options(undefer(Article.content)).filter(Article.article_id.in_(ids))
+    }
+    outcomes = []
+    batch = []
+    for item_id, target_id in pairs:
+        article = articles.get(target_id)
+        if article is None:
+            outcomes.append((item_id, KIND_ARTICLE, PermanentError("article not found")))
+        else:
+            batch.append((item_id, ArticleRecord(
+                article_id=article.article_id,
+                title=article.title,
+                description=article.description or "",
+                content=article.content,
+            )))
+    db.rollback()
+    if not batch:
+        return outcomes
+
+    try:
+        summaries = summarizer.summarize_batch([a for _, a in batch], deadline=deadline)
+    except Exception as e:
+        return outcomes + [(item_id, KIND_ARTICLE, e) for item_id, _ in batch]
+    for i, (item_id, article) in enumerate(batch):
+        item = summaries[i] if i < len(summaries) else None
+        if not isinstance(item, dict) or item.get("error") or not item.get("summary"):
+            error = item.get("summary") if isinstance(item, dict) else "missing summary in batch response"
+            outcomes.append((item_id, KIND_ARTICLE, Exception(error or "empty summary")))
+            continue
+        outcomes.append((item_id, KIND_ARTICLE, {
+            "article_id": article.article_id,
+            "summary": item["summary"],
+            "key_points": item.get("key_points") or [],
+        }))
+    return outcomes
+
+
+def _summarize_video(db: Session, summarizer, item_id: int, youtube_id: str, deadline: Optional[Deadline]):
+    record = db.get(VideoTranscript, youtube_id)
+    transcript = record.text if record is not None else None
+    db.rollback()
+    if not transcript:
+        return item_id, KIND_VIDEO, PermanentError("transcript not found")
+    try:
+        result = summarizer.summarize(transcript, deadline=deadline)
+    except Exception as e:
+        return item_id, KIND_VIDEO, e
+    if not isinstance(result, dict) or result.get("error") or not result.get("summary"):
+        error = result.get("summary") if isinstance(result, dict) else "unexpected response"
+        return item_id, KIND_VIDEO, Exception(error or "empty summary")
+    return item_id, KIND_VIDEO, {"youtube_id": youtube_id, "summary": result["summary"], "key_points": result.get("key_points") or []}
+
+
+def _save_summary(db: Session, kind: str, result: Dict, headlines: Dict) -> None:
+    """要約と重要ポイントを保存する。記事の場合は、要約が空のダイジェストの見出しも埋める"""
+    if kind == KIND_VIDEO:
+        video = db.get(Video, result["youtube_id"])
+        if video is None:
+            return
+        video.summary = result["summary"]
+        video.status = "processed"
+        video.key_points = [KeyPoint(point=p) for p in result["key_points"] if p]
+        return
+
+    article = db.get(Article, result["article_id"])
+    if article is None:
+        return
+    article.summary = result["summary"]
+    article.status = "processed"
+    article.key_points = [ArticleKeyPoint(point=p) for p in result["key_points"] if p]
+    index_article(db, article)
+    rows = db.query(DigestHeadline).filter(
+        DigestHeadline.article_id == article.article_id,
+        or_(DigestHeadline.summary.is_(None), DigestHeadline.summary == ""),
+    )
+    for row in rows:
+        headlines[row.date].append(dict(headline_to_dict(row), summary=result["summary"]))
+
+
+# =====================================================
+# ワーカー
+# =====================================================
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(
+    worker_id: Optional[str] = None,
+    batch_size: int = CLAIM_BATCH_SIZE,
+    once: bool = False,
+    kind: Optional[str] = None,
+    stop: Optional[threading.Event] = None,
+) -> Dict[str, int]:
+    """
+    作業を取得しては処理する。once の場合は取得できる作業がなくなったら終了する。
+    stop がセットされたら、処理中の作業を終えてから終了する。
+    """
+    from database import SessionLocal
+    from summarizer import Summarizer
+
+    worker_id = worker_id or default_worker_id()
+    stop = stop or threading.Event()
+    summarizer = Summarizer(os.getenv("GEMINI_API_KEY"))
+    totals = {"done": 0, "retry": 0, "dead": 0, "lost": 0}
+    print(f"Work queue worker {worker_id} started")
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            items = claim(db, worker_id, batch_size, LEASE_SECONDS, kind)
+            if not items:
+                if once:
+                    break
+                stop.wait(POLL_SECONDS)
+                continue
+            # リースが切れる前に要約を打ち切る (保存とcommitの時間を残す)
+            counts = process_items(db, summarizer, worker_id, items, Deadline(LEASE_SECONDS * 0.8))
+            for key, value in counts.items():
+                totals[key] += value
+            print(f"Work queue: {counts}")
+        except Exception as e:
+            print(f"Work queue worker error: {e}")
+            stop.wait(POLL_SECONDS)
+        finally:
+            db.close()
+    print(f"Work queue worker {worker_id} stopped: {totals}")
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="要約のワークキュー")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backlog = sub.add_parser("enqueue-backlog", help="未要約の記事・動画を登録する")
+    backlog.add_argument("--all", action="store_true", help="要約済みのものも登録し直す")
+    worker = sub.add_parser("worker", help="ワーカーを起動する")
+    worker.add_argument("--once", action="store_true", help="作業がなくなったら終了する")
+    worker.add_argument("--batch-size", type=int, default=CLAIM_BATCH_SIZE)
+    worker.add_argument("--kind", choices=KINDS)
+    sub.add_parser("stats", help="種類・状態ごとの件数")
+    retry = sub.add_parser("retry-dead", help="dead の作業を再試行する")
+    retry.add_argument("--kind", choices=KINDS)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+        run_worker(batch_size=args.batch_size, once=args.once, kind=args.kind, stop=stop_event)
+    else:
+        db = SessionLocal()
+        try:
+            if args.command == "enqueue-backlog":
+                print(f"Enqueued: {enqueue_backlog(db, include_processed=args.all)}")
+            elif args.command == "stats":
+                for kind, counts in sorted(queue_stats(db).items()):
+                    print(f"{kind:<8} {counts}")
+            elif args.command == "retry-dead":
+                print(f"Requeued {retry_dead(db, args.kind)} dead items")
+        finally:
+            db.close()
@@ -3,27 +3,47 @@ import random
 import re
 import time
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import List, Optional
 
 import feedparser
+import requests
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from breaker import CircuitOpenError, breakers, is_upstream_failure
+from metrics import observe_source
+from records import VideoRecord
+
+# 字幕の取得先 (サーキットブレーカーのホスト)
+TRANSCRIPT_URL = "https://www.youtube.com/"
+
+
+def _is_blocking_error(error: Exception) -> bool:
+    """YouTubeにブロック・レート制限されていることを示すエラーか (字幕がないだけの場合は False)"""
+    message = str(error)
+    return is_upstream_failure(error) or any(
+        marker in message for marker in ("IpBlocked", "RequestBlocked", "blocking requests", "Too Many Requests", "429")
+    )
+
 
 class YouTubeClient:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, timeout: int = 10):
         """
         YouTubeクライアントの初期化
         api_key: 現在は使用していないが、互換性のために残している
+        timeout: RSSフィード取得のタイムアウト秒数
         """
-        pass
+        self.timeout = timeout
 
-    def search_news_videos(self, channel_id: str):
+    def search_news_videos(self, channel_id: str) -> List[VideoRecord]:
         """RSSフィードから最新のニュース動画を取得する (APIクォータ消費ゼロ)"""
         # YouTube公式RSSフィードのURL
         rss_url = f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
 
         # RSSフィードを取得
-        feed = feedparser.parse(rss_url)
+        with observe_source("youtube"), breakers.guard(rss_url):
+            response = requests.get(rss_url, timeout=self.timeout)
+            response.raise_for_status()
+        feed = feedparser.parse(response.content)
 
         if not feed.entries:
             print(f"No entries found in RSS feed for channel: {channel_id}")
@@ -102,13 +122,13 @@ class YouTubeClient:
                 description = entry.summary if hasattr(entry, "summary") else ""
 
                 videos.append(
-                    {
-                        "video_id": video_id,
-                        "title": title,
-                        "description": description,
-                        "published_at": published_at,
-                        "thumbnail": thumbnail_url,
-                    }
+                    VideoRecord(
+                        video_id=video_id,
+                        title=title,
+                        description=description,
+                        published_at=published_at,
+                        thumbnail=thumbnail_url,
+                    )
                 )
                 seen_ids.add(video_id)
 
@@ -117,6 +137,13 @@ class YouTubeClient:
 
     def get_transcript(self, video_id: str) -> Optional[str]:
         """動画の字幕を取得する"""
+        # YouTubeにブロックされている間は、待機も字幕の取得もせずに失敗させる
+        try:
+            host = breakers.check(TRANSCRIPT_URL)
+        except CircuitOpenError as e:
+            print(f"Skipping transcript for {video_id}: {e}")
+            return None
+
         try:
             # 429回避のための待機 (ランダム化)
             sleep_time = random.uniform(5.0, 15.0)  # さらに延長
@@ -182,16 +209,20 @@ class YouTubeClient:
                             print(
                                 f"No suitable transcript or translatable captions found for {video_id}"
                             )
+                            breakers.record(host, True)
                             return None
 
             print(
                 f"DEBUG: Found transcript for {video_id} (Language: {transcript.language}, Generated: {transcript.is_generated})"
             )
             data = transcript.fetch()
+            breakers.record(host, True)
             return " ".join([t.text for t in data])
 
         except Exception as e:
             error_msg = str(e)
+            blocked = _is_blocking_error(e)
+            breakers.record(host, not blocked, error_msg if blocked else None)
             print(f"Error fetching transcript for {video_id}: {error_msg}")
 
             # 字幕が無効化されている場合は、説明文にフォールバックせずにNoneを返す
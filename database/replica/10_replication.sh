@@ -0,0 +1,10 @@
+#!/bin/sh
+# プライマリの初期化時にストリーミングレプリケーション用のユーザーと接続許可を追加する
+# (docker-compose.replica.yml から /docker-entrypoint-initdb.d にマウントされる)
+set -e
+
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-SQL
+    CREATE ROLE ${REPLICATION_USER:-replicator} WITH REPLICATION LOGIN PASSWORD '${REPLICATION_PASSWORD:-replicator}';
+SQL
+
+echo "host replication ${REPLICATION_USER:-replicator} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -2,9 +2,19 @@
 
 import { useState, useEffect, Suspense } from 'react';
 import { useSearchParams, useRouter } from 'next/navigation';
-import { DailyDigest } from '@/types/news';
+import { DailyDigest, DailyDigestHeadline, DigestUpdate } from '@/types/news';
 import styles from './page.module.css';
 
+// 変更された見出しを記事IDで差し替え・追加し、公開日時の新しい順に並べ直す
+const mergeHeadlines = (digest: DailyDigest, changed: DailyDigestHeadline[]): DailyDigest => {
+  const byId = new Map(digest.headlines.map((h) => [h.article_id ?? h.link, h]));
+  changed.forEach((h) => byId.set(h.article_id ?? h.link, h));
+  const headlines = Array.from(byId.values()).sort((a, b) =>
+    (b.published_at ?? '').localeCompare(a.published_at ?? '')
+  );
+  return { ...digest, headlines, message: undefined };
+};
+
 function NewsContent() {
   const [digest, setDigest] = useState<DailyDigest | null>(null);
   const [isLoading, setIsLoading] = useState(true);
@@ -15,9 +25,9 @@ function NewsContent() {
   // URLクエリパラメータから日付を取得 (YYYY-MM-DD)
   const dateParam = searchParams.get('date');
 
-  const fetchDailyDigest = async (targetDate?: string) => {
+  const fetchDailyDigest = async (targetDate?: string, silent = false) => {
     try {
-      setIsLoading(true);
+      if (!silent) setIsLoading(true);
       const apiUrl = process.env.NEXT_PUBLIC_API_URL ?? 'http://localhost:8000';
 
       let url = `${apiUrl}/api/news/daily`;
@@ -41,6 +51,29 @@ function NewsContent() {
     fetchDailyDigest(dateParam || undefined);
   }, [dateParam]);
 
+  // 収集で見出しが更新されたらSSEで受け取り、表示中の日付のダイジェストに反映する (ポーリングしない)
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+
+    const apiUrl = process.env.NEXT_PUBLIC_API_URL ?? 'http://localhost:8000';
+    let url = `${apiUrl}/api/news/stream`;
+    if (dateParam) {
+      url += `?target_date=${dateParam}`;
+    }
+
+    const source = new EventSource(url);
+    source.addEventListener('digest', (event) => {
+      const update: DigestUpdate = JSON.parse((event as MessageEvent).data);
+      setDigest((prev) => (prev && prev.date === update.date ? mergeHeadlines(prev, update.headlines) : prev));
+    });
+    // 通知を取りこぼした場合は取得し直す
+    source.addEventListener('resync', () => {
+      fetchDailyDigest(dateParam || undefined, true);
+    });
+
+    return () => source.close();
+  }, [dateParam]);
+
   const formatDate = (dateString: string) => {
     try {
       const d = new Date(dateString);
@@ -24,10 +24,12 @@ export interface Channel {
 }
 
 export interface DailyDigestHeadline {
+  article_id?: string;
   title: string;
   summary: string;
   link: string;
   source: string;
+  topic?: string | null;
   published_at: string | null;
 }
 
@@ -37,3 +39,9 @@ export interface DailyDigest {
   updated_at?: string;
   message?: string;
 }
+
+// /api/news/stream の "digest" イベント (変更された見出しだけを含む)
+export interface DigestUpdate {
+  date: string;
+  headlines: DailyDigestHeadline[];
+}